@@ -165,6 +165,12 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels.layers.InMemoryChannelLayer'
     }
 }
+# 多 worker 部署时如需跨进程的通道层，设置 CHANNEL_REDIS_URL (需要安装 channels-redis)
+if os.environ.get('CHANNEL_REDIS_URL'):
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [os.environ['CHANNEL_REDIS_URL']]},
+    }
 
 # 确保这些配置存在
 ALLOWED_HOSTS = ['*']
@@ -183,4 +189,87 @@ CACHES = {
     }
 }
 
-DLIB_MODELS_DIR = os.path.join(BASE_DIR, 'dlib_models') 
\ No newline at end of file
+DLIB_MODELS_DIR = os.path.join(BASE_DIR, 'dlib_models') 
+
+# 人脸特征近似最近邻索引
+FACE_ANN_BACKEND = 'ivf'    # 'ivf' 或 'brute'
+FACE_ANN_MIN_SIZE = 5000    # 特征库小于该规模时直接暴力搜索
+FACE_ANN_NLIST = 0          # 聚类数，0 表示按 sqrt(N) 自动选择
+FACE_ANN_NPROBE = 8         # 查询时搜索的簇数，越大召回越高、延迟越大
+FACE_ANN_RETRAIN_GROWTH = 4 # 特征库增长到训练时的几倍后重新训练聚类中心
+
+# 推理线程池/进程池
+INFERENCE_EXECUTOR = 'thread'    # 'thread' 或 'process'，dlib 计算不释放 GIL 时可用进程池
+# 多 worker 部署时由 runworkers 通过环境变量设置为每个进程分到的核数
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0)) or os.cpu_count() or 1
+INFERENCE_MAX_PENDING = INFERENCE_WORKERS * 2    # 排队上限，超出时丢帧并通知客户端
+
+# 跨连接合并 dlib 特征提取
+DESCRIPTOR_BATCHING = True
+DESCRIPTOR_BATCH_MAX = 16       # 单批最多的人脸数
+DESCRIPTOR_BATCH_WAIT_MS = 5    # 凑批最长等待时间
+
+# 人脸跟踪：关键帧之间只在上一帧人脸附近重新检测
+FACE_TRACKING = True
+TRACKING_KEYFRAME_INTERVAL = 10    # 每隔多少帧做一次全图检测
+TRACKING_REVERIFY_SECONDS = 2.0    # 跟踪中的身份多久重新识别一次
+TRACKING_ROI_MARGIN = 0.5          # 重新检测区域相对人脸框的外扩比例
+
+# 后台训练
+TRAINING_LOAD_WORKERS = os.cpu_count() or 1    # 并行读取训练图片的线程数
+
+# 打包的训练样本库
+SAMPLE_SHARD_SIZE = 50000    # 每个分片文件最多的样本数 (每个样本 10KB)
+
+# 连拍采集
+BURST_MAX_FRAMES = 60     # 单次连拍最多处理的帧数
+BURST_SAMPLES = 20        # 每个学生保留的样本数
+BURST_MIN_SAMPLES = 10    # 有效且不重复的帧少于该数时要求重新采集
+BURST_MIN_DIFF = 4.0      # 两帧人脸平均像素差小于该值视为重复帧
+
+# 人脸质量评分
+FACE_QUALITY_GATE = True              # 识别时跳过质量过低的人脸，不计算特征
+FACE_QUALITY_MIN_SCORE = 0.15         # 总分 (各项乘积) 低于该值视为质量过低
+FACE_QUALITY_SHARPNESS_REF = 100.0    # 拉普拉斯方差达到该值时清晰度记满分
+FACE_QUALITY_SIZE_REF = 80            # 人脸宽度达到该像素数时尺寸记满分
+FACE_TEMPLATE_CANDIDATES = 8          # 注册时参与关键点评估的样本数
+FACE_TEMPLATE_COUNT = 5               # 每个学生保存的模板数，取质量最好的几张样本
+
+# 多模板特征库
+FACE_GALLERY_AGGREGATION = 'min'    # 'min'、'mean' 或 'centroid'，多个模板的距离聚合方式，ANN 索引只用于 min
+
+# 自适应分辨率检测
+# accurate: 最小人脸 30 像素，全分辨率检测，与旧版行为一致 (默认)；
+# balanced: 最小人脸 60 像素；fast: 最小人脸 120 像素，延迟最低。
+# 确认摄像头场景中的人脸足够大后再切换到 balanced 或 fast
+DETECTION_PROFILE = 'accurate'
+# 可覆盖或新增配置，例如 {'kiosk': {'min_face': 150, 'max_face': 400, 'levels': 5, 'adaptive': True}}
+DETECTION_PROFILES = {}
+
+# 帧解码
+# 最小人脸足够大时用 IMREAD_REDUCED_* 在解码阶段直接缩小 (2/4/8 倍)
+REDUCED_DECODE = True
+
+# 识别引擎
+# 客户端的检测方式即引擎名：opencv (Haar + LBPH)、dlib (HOG + ResNet)、
+# onnx (YuNet + SFace，OpenCV DNN 在 CPU 上推理)
+# 启用 onnx 需要把 OpenCV Zoo 的 face_detection_yunet_2022mar.onnx 和
+# face_recognition_sface_2021dec.onnx 放到 backend/onnx/ 下
+FACE_ENGINES = ['opencv', 'dlib']
+ONNX_DETECTOR_MODEL = os.path.join(BASE_DIR, 'onnx/face_detection_yunet_2022mar.onnx')
+ONNX_RECOGNIZER_MODEL = os.path.join(BASE_DIR, 'onnx/face_recognition_sface_2021dec.onnx')
+ONNX_DETECTOR_SCORE = 0.8      # YuNet 置信度阈值
+ONNX_MATCH_THRESHOLD = 0.363   # SFace 余弦相似度阈值
+
+# 多 worker 部署 (manage.py runworkers)
+# 修改特征库、LBPH 模型或学生信息后通知其他 worker 重新加载：
+# 'file' (MEDIA_ROOT/generations.json，单机)、'redis' (需要安装 redis 包) 或 None (单进程)
+MODEL_SYNC_BACKEND = 'file'
+MODEL_SYNC_INTERVAL = 1.0    # 每个 worker 检查的间隔 (秒)
+MODEL_SYNC_REDIS_URL = os.environ.get('MODEL_SYNC_REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+# 考勤记录：识别成功的人脸按学号去重后批量写入 recognition_events
+ATTENDANCE_EVENTS = True
+ATTENDANCE_DEDUP_SECONDS = 60     # 同一学生在该时间内的重复识别只记一次
+ATTENDANCE_FLUSH_INTERVAL = 2.0   # 后台写入的间隔 (秒)
+ATTENDANCE_FLUSH_SIZE = 200       # 积累到该条数时立即写入
@@ -3,13 +3,15 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
-from core.views import UserViewSet
+from core.views import UserViewSet, RecognitionEventViewSet, metrics_view
 
 # 创建路由器
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
+router.register(r'events', RecognitionEventViewSet, basename='event')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/metrics/', metrics_view, name='metrics'),
     path('api/', include(router.urls)),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) 
\ No newline at end of file
@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import User
+from .models import User, RecognitionEvent
 
-admin.site.register(User) 
\ No newline at end of file
+admin.site.register(User)
+admin.site.register(RecognitionEvent)
@@ -0,0 +1,219 @@
+import os
+import logging
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _sq_distances(queries, matrix, sq_norms):
+    """(M, D) 与 (N, D) 之间的平方欧氏距离"""
+    sq_dists = (np.einsum('ij,ij->i', queries, queries)[:, None]
+                + sq_norms[None, :]
+                - 2.0 * queries.dot(matrix.T))
+    np.maximum(sq_dists, 0, out=sq_dists)
+    return sq_dists
+
+
+def _nearest_centroid(data, centroids, chunk=8192):
+    c_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        # |x|^2 对 argmin 无影响，省略
+        labels[start:start + chunk] = np.argmin(c_norms[None, :] - 2.0 * block.dot(centroids.T), axis=1)
+    return labels
+
+
+def kmeans(data, nlist, iterations=20, seed=0):
+    """朴素 k-means，返回 float32 (nlist, D) 聚类中心"""
+    data = np.asarray(data, dtype=np.float32)
+    rng = np.random.RandomState(seed)
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroid(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        # 空簇重新随机选点
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """倒排文件 (IVF-Flat) 近似最近邻索引
+
+    k-means 把特征划分为 nlist 个簇，查询时只对最近的 nprobe 个簇内的
+    特征做精确距离计算。nprobe 越大召回越高、延迟越大。
+
+    索引不保存特征本身，只保存每一行模板所属的簇 (与 FaceGallery 的行对齐)，
+    倒排表在特征库变化后按需重建。
+    """
+
+    name = 'ivf'
+
+    def __init__(self, centroids, nprobe=8, min_size=0, trained_size=0):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self.min_size = min_size
+        # 训练聚类中心时的特征库规模，特征库增长较多后需要重新训练
+        self.trained_size = trained_size
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._size = 0
+        self._order = None
+        self._offsets = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, matrix, nlist=0, nprobe=8, min_size=0, max_train=100000, seed=0):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not nlist:
+            nlist = max(1, int(np.sqrt(len(matrix))))
+        nlist = min(nlist, len(matrix))
+        sample = matrix
+        if len(matrix) > max_train:
+            rng = np.random.RandomState(seed)
+            sample = matrix[rng.choice(len(matrix), max_train, replace=False)]
+        index = cls(kmeans(sample, nlist, seed=seed), nprobe=nprobe, min_size=min_size,
+                    trained_size=len(matrix))
+        index.attach(matrix)
+        return index
+
+    def attach(self, matrix):
+        """为特征库当前的所有行计算所属簇"""
+        self._assignments = _nearest_centroid(np.asarray(matrix, dtype=np.float32), self.centroids)
+        self._size = len(self._assignments)
+        self._order = None
+
+    def on_add(self, start, vectors):
+        """FaceGallery 在 start 处追加了若干行模板"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        end = start + len(vectors)
+        if end > len(self._assignments):
+            grown = np.zeros(max(end, len(self._assignments) * 2, 64), dtype=np.int32)
+            grown[:self._size] = self._assignments[:self._size]
+            self._assignments = grown
+        self._assignments[start:end] = _nearest_centroid(vectors, self.centroids)
+        self._size = max(self._size, end)
+        self._order = None
+
+    def on_remove(self, start, count):
+        """FaceGallery 删除了 start 起的 count 行，后面的行整体前移"""
+        size = self._size
+        self._assignments[start:size - count] = self._assignments[start + count:size]
+        self._size = size - count
+        self._order = None
+
+    def inverted_lists(self):
+        """返回 (行号按簇排序, 每个簇的起始位置)
+
+        特征库变化后重新计算并替换，已返回的数组不会被修改。
+        """
+        if self._order is None:
+            assignments = self._assignments[:self._size]
+            self._order = np.argsort(assignments, kind='mergesort').astype(np.int64)
+            self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.nlist))])
+        return self._order, self._offsets
+
+    def search(self, matrix, sq_norms, queries, k, lists=None):
+        """返回每个查询的 (行号数组, 距离数组)，按距离升序
+
+        lists 为与 matrix 同时取出的 inverted_lists()，省略时使用当前的倒排表。
+        """
+        order, offsets = lists or self.inverted_lists()
+        nprobe = min(self.nprobe, self.nlist)
+        coarse = _sq_distances(queries, self.centroids,
+                               np.einsum('ij,ij->i', self.centroids, self.centroids))
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists])
+            if not len(rows):
+                results.append((rows, np.zeros(0, dtype=np.float32)))
+                continue
+            dists = np.sqrt(_sq_distances(query[None, :], matrix[rows], sq_norms[rows])[0])
+            top = min(k, len(rows))
+            best = np.argpartition(dists, top - 1)[:top] if top < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(dists[best])]
+            results.append((rows[best], dists[best]))
+        return results
+
+    def save(self, path, version=0):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 多个 worker 可能同时重建索引，各自写入唯一的临时文件再原子替换
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, centroids=self.centroids,
+                         assignments=self._assignments[:self._size],
+                         trained_size=np.int64(self.trained_size),
+                         version=np.int64(version))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path, nprobe=8, min_size=0):
+        """返回 (index, 保存时的特征库版本)"""
+        with np.load(path) as data:
+            # 旧版本的索引文件没有记录训练规模，按簇数估计 (nlist ≈ sqrt(N))
+            trained_size = int(data['trained_size']) if 'trained_size' in data.files \
+                else len(data['centroids']) ** 2
+            index = cls(data['centroids'], nprobe=nprobe, min_size=min_size, trained_size=trained_size)
+            index._assignments = data['assignments'].astype(np.int32)
+            index._size = len(index._assignments)
+            return index, int(data['version'])
+
+
+def index_path(name='ann_index'):
+    return os.path.join(settings.MEDIA_ROOT, f'recognizer/{name}.npz')
+
+
+def build_index(gallery, version=0, path=None):
+    """按配置为特征库加载或训练 ANN 索引，小规模或非 min 聚合的特征库返回 None (暴力搜索)
+
+    path 为索引文件路径，每个特征库各用一个，省略时为 dlib 特征库的索引。
+    """
+    backend = getattr(settings, 'FACE_ANN_BACKEND', 'ivf')
+    min_size = getattr(settings, 'FACE_ANN_MIN_SIZE', 5000)
+    nprobe = getattr(settings, 'FACE_ANN_NPROBE', 8)
+    nlist = getattr(settings, 'FACE_ANN_NLIST', 0)
+    growth = getattr(settings, 'FACE_ANN_RETRAIN_GROWTH', 4)
+
+    # mean 和 centroid 聚合总是精确搜索，不需要索引
+    if backend != 'ivf' or gallery.aggregation != 'min' or gallery.num_templates < min_size:
+        return None
+
+    path = path or index_path()
+    matrix = gallery.matrix
+    if os.path.exists(path):
+        try:
+            index, saved_version = IVFIndex.load(path, nprobe=nprobe, min_size=min_size)
+            if saved_version == version and index._size == gallery.num_templates:
+                return index
+            if gallery.num_templates <= growth * index.trained_size:
+                # 特征库变化不大，沿用聚类中心，重新分配
+                index.attach(matrix)
+                index.save(path, version)
+                return index
+            # 特征库增长较多，原来的簇数太少、倒排表过长，重新训练
+            logger.info(f"Gallery grew from {index.trained_size} to {gallery.num_templates} templates, "
+                        f"retraining IVF index")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to load ANN index, rebuilding: {e}")
+
+    index = IVFIndex.train(matrix, nlist=nlist, nprobe=nprobe, min_size=min_size)
+    index.save(path, version)
+    logger.info(f"Trained IVF index with {index.nlist} lists over {gallery.num_templates} templates")
+    return index
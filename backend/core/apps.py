@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'core' 
\ No newline at end of file
+    name = 'core'
+
+    def ready(self):
+        # 注册 User 变更时同步身份缓存的信号
+        from . import signals  # noqa: F401 
\ No newline at end of file
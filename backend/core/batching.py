@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+from .inference import get_executor
+from . import pipeline, metrics
+from .engines import get_engine
+
+logger = logging.getLogger(__name__)
+
+
+class DescriptorBatcher:
+    """跨连接合并一个识别引擎的特征提取
+
+    各连接提交的对齐人脸先进入队列，凑满 max_batch 个或等待 max_wait_ms 后
+    合并成一次 pipeline.describe 批量调用，结果再按提交顺序分发回去。
+    """
+
+    def __init__(self, method='dlib', max_batch=16, max_wait_ms=5):
+        self.method = method
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = Counter()
+        self._queue = []
+        self._queued_chips = 0
+        self._timer = None
+
+    async def submit(self, chips):
+        """提交一个连接的若干人脸，返回 (对应的匹配结果列表, 本批各阶段耗时)"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._queue.append((list(chips), future))
+        self._queued_chips += len(chips)
+
+        if self._queued_chips >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._queue:
+            return
+        batch, self._queue = self._queue, []
+        self._queued_chips = 0
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        chips = [chip for request_chips, _ in batch for chip in request_chips]
+        self.batch_sizes[len(chips)] += 1
+        try:
+            # 已经通过检测阶段的帧不再受排队上限限制
+            matches, stages = await get_executor().run_unbounded(metrics.timed, pipeline.describe, self.method, chips)
+        except Exception as e:
+            logger.warning(f"Batched descriptor computation failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for request_chips, future in batch:
+            if not future.done():
+                future.set_result((matches[offset:offset + len(request_chips)], stages))
+            offset += len(request_chips)
+
+    def stats(self):
+        """批大小直方图 {批大小: 次数}"""
+        return dict(sorted(self.batch_sizes.items()))
+
+
+_batchers = {}
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(method='dlib'):
+    """每个引擎一个批处理器，未启用批处理或引擎不支持时返回 None"""
+    if not getattr(settings, 'DESCRIPTOR_BATCHING', True) or not get_engine(method).batched:
+        return None
+    batcher = _batchers.get(method)
+    if batcher is None:
+        with _batcher_lock:
+            batcher = _batchers.get(method)
+            if batcher is None:
+                batcher = _batchers[method] = DescriptorBatcher(
+                    method,
+                    max_batch=getattr(settings, 'DESCRIPTOR_BATCH_MAX', 16),
+                    max_wait_ms=getattr(settings, 'DESCRIPTOR_BATCH_WAIT_MS', 5),
+                )
+    return batcher
+
+
+def batcher_stats():
+    """各引擎的批大小直方图 {引擎: {批大小: 次数}}"""
+    return {method: batcher.stats() for method, batcher in _batchers.items()}
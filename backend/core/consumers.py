@@ -1,235 +1,336 @@
 import json
+import time
+import uuid
+import asyncio
+from urllib.parse import parse_qs
 import cv2
 import base64
-import numpy as np
 import os
-import dlib
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
-from asgiref.sync import sync_to_async
-from .models import User
+from .registry import registry
+from .inference import get_executor, ExecutorBusy
+from .batching import get_batcher
+from .engines import get_engine, enabled_engines, NO_SINGLE_FACE, UNKNOWN_FACE
+from .tracking import FaceTracker
+from .detection import DetectionScaler
+from .preprocess import FrameBuffers
+from .metrics import counters, FrameTimer
+from .events import event_buffer
+from . import metrics
+from . import enrollment, pipeline, protocol
 from PIL import Image
 
 class FaceRecognitionConsumer(AsyncWebsocketConsumer):
+    # 识别所需的共享模型 (另加已启用引擎的模型)，首次连接时在线程池中加载
+    REQUIRED_MODELS = (
+        'identities',
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         print("Initializing FaceRecognitionConsumer")
-        
-        # OpenCV 检测器和识别器
-        self.face_cascade = cv2.CascadeClassifier(
-            os.path.join(settings.BASE_DIR, 'haarcascades/haarcascade_frontalface_default.xml')
-        )
-        
-        try:
-            self.recognizer = cv2.face.LBPHFaceRecognizer_create()
-            recognizer_file = os.path.join(settings.MEDIA_ROOT, 'recognizer/trainingData.yml')
-            if os.path.exists(recognizer_file):
-                self.recognizer.read(recognizer_file)
-        except Exception as e:
-            print(f"Error initializing OpenCV recognizer: {str(e)}")
-            self.recognizer = None
-        
-        # Dlib 检测器和模型
-        self.dlib_detector = dlib.get_frontal_face_detector()
-        self.shape_predictor = dlib.shape_predictor(
-            os.path.join(settings.BASE_DIR, 'dlib/shape_predictor_68_face_landmarks.dat')
-        )
-        self.face_recognition_model = dlib.face_recognition_model_v1(
-            os.path.join(settings.BASE_DIR, 'dlib/dlib_face_recognition_resnet_model_v1.dat')
-        )
-        
-        # 加载已知人脸特征 (用于dlib)
-        self.known_face_descriptors = {}
-        self.load_known_faces()
-
-    def load_known_faces(self):
-        faces_dir = os.path.join(settings.MEDIA_ROOT, 'faces')
-        for stu_id in os.listdir(faces_dir):
-            user_path = os.path.join(faces_dir, stu_id)
-            if os.path.isdir(user_path):
-                try:
-                    # 获取第一张人脸图片作为参考
-                    face_path = os.path.join(user_path, 'face_0.jpg')
-                    if os.path.exists(face_path):
-                        img = dlib.load_rgb_image(face_path)
-                        faces = self.dlib_detector(img)
-                        if len(faces) == 1:
-                            shape = self.shape_predictor(img, faces[0])
-                            face_descriptor = self.face_recognition_model.compute_face_descriptor(img, shape)
-                            self.known_face_descriptors[stu_id] = np.array(face_descriptor)
-                except Exception as e:
-                    print(f"Error loading face for {stu_id}: {str(e)}")
+
+        # 只保留最新的一帧：处理速度跟不上时旧帧直接丢弃
+        self.pending_frame = None
+        self.frame_ready = asyncio.Event()
+        self.worker_task = None
+
+        # 本连接的帧计数，同时出现在 /api/metrics 中
+        self.connection_id = uuid.uuid4().hex[:8]
+        self.camera = self.connection_id
+        self.stats = {kind: 0 for kind in
+                      ('received', 'processed', 'dropped', 'no_face', 'unknown', 'recognized', 'errors')}
+        self.avg_process_ms = 0.0
+
+        # 关键帧之间只做区域检测，身份沿用上一次识别结果
+        self.tracker = None
+        if getattr(settings, 'FACE_TRACKING', True):
+            self.tracker = FaceTracker(
+                keyframe_interval=getattr(settings, 'TRACKING_KEYFRAME_INTERVAL', 10),
+                reverify_seconds=getattr(settings, 'TRACKING_REVERIFY_SECONDS', 2.0),
+            )
+
+        # 根据最近检测到的人脸大小调整检测分辨率
+        self.scaler = DetectionScaler()
+        # 本连接的帧按顺序处理，颜色转换和裁剪复用同一组缓冲区
+        self.buffers = FrameBuffers()
 
     async def connect(self):
         try:
+            # 在线程池中加载模型，避免阻塞事件循环
+            loop = asyncio.get_event_loop()
+            models = list(self.REQUIRED_MODELS)
+            for engine in enabled_engines():
+                models.extend(engine.models)
+            await loop.run_in_executor(None, registry.preload, models)
             await self.accept()
+            # 考勤记录中的摄像头编号，客户端可通过 ?camera= 指定，否则为连接编号
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            self.camera = (query.get('camera') or [self.connection_id])[0][:16]
+            metrics.connections.register(self.connection_id, self.stats)
+            self.worker_task = asyncio.ensure_future(self.process_frames())
             print(f"WebSocket connected from {self.scope['client']}")
         except Exception as e:
             print(f"WebSocket connection error: {str(e)}")
             return False
 
     async def disconnect(self, close_code):
-        print(f"WebSocket disconnected with code: {close_code}")
-        # 清理资源
-        if hasattr(self, 'recognizer'):
-            self.recognizer = None
-        
-    async def receive(self, text_data):
+        print(f"WebSocket disconnected with code: {close_code}, "
+              f"received {self.stats['received']}, dropped {self.stats['dropped']}")
+        metrics.connections.unregister(self.connection_id)
+        if self.worker_task:
+            self.worker_task.cancel()
+            self.worker_task = None
+
+    def flow_control(self):
+        """随结果返回的流控信息：客户端收到后获得一个发送额度，并按建议间隔发送"""
+        return {
+            'credit': 1,
+            'interval_ms': int(self.avg_process_ms),
+            'received': self.stats['received'],
+            'processed': self.stats['processed'],
+            'dropped': self.stats['dropped'],
+        }
+
+    async def send_result(self, data, seq=None):
+        """发送识别结果，二进制模式下附带帧序号"""
+        if seq is not None:
+            data['seq'] = seq
+        data['flow'] = self.flow_control()
+        await self.send(text_data=protocol.dumps(data))
+
+    def drop_frame(self, method):
+        self.stats['dropped'] += 1
+        counters.inc('frames_dropped', method=method)
+
+    def count_results(self, method, multi_face, results):
+        """按全图识别的结果累加计数：未检测到人脸、无法识别、识别成功、质量过低和出错"""
+        if not results or (not multi_face and results[0][0].get('error') == NO_SINGLE_FACE):
+            self.stats['no_face'] += 1
+            counters.inc('frames_no_face', method=method)
+            return
+        for response_data, _ in results:
+            if 'stu_id' in response_data:
+                kind = 'recognized'
+            elif response_data.get('low_quality'):
+                kind = 'low_quality'
+            elif response_data.get('error') == UNKNOWN_FACE:
+                kind = 'unknown'
+            else:
+                kind = 'errors'
+            if kind in self.stats:
+                self.stats[kind] += 1
+            counters.inc(f'faces_{kind}', method=method)
+
+    def record_events(self, method, results):
+        """识别成功的人脸记入考勤事件，去重和批量写入见 events.py"""
+        if not getattr(settings, 'ATTENDANCE_EVENTS', True):
+            return
+        for response_data, _ in results:
+            if 'stu_id' in response_data:
+                event_buffer.record(response_data['stu_id'], method,
+                                    response_data.get('confidence'), self.camera)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        received_at = time.perf_counter()
         try:
-            data = json.loads(text_data)
-            detection_method = data.get('detection_method', 'opencv')
-            
-            # 解码图像
-            image_data = data.get('image').split(',')[1]
-            image_bytes = base64.b64decode(image_data)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if detection_method == 'dlib':
-                # dlib 检测和识别逻辑
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                # 增加检测参数，提高检测率
-                faces = self.dlib_detector(rgb_frame, 1)  # 增加上采样次数
-                
-                if len(faces) != 1:
-                    # 如果没检测到脸，尝试使用 OpenCV 作为备选
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    cv_faces = self.face_cascade.detectMultiScale(
-                        gray,
-                        scaleFactor=1.1,
-                        minNeighbors=3,
-                        minSize=(30, 30)
-                    )
-                    
-                    if len(cv_faces) == 1:
-                        x, y, w, h = cv_faces[0]
-                        # 将 OpenCV 检测结果转换为 dlib 矩形
-                        face = dlib.rectangle(x, y, x + w, y + h)
-                    else:
-                        await self.send(text_data=json.dumps({
-                            'error': '未检测到人脸或检测到多个人脸',
-                            'face_rect': None
-                        }))
-                        return
-                else:
-                    face = faces[0]
-                
-                try:
-                    shape = self.shape_predictor(rgb_frame, face)
-                    face_descriptor = self.face_recognition_model.compute_face_descriptor(rgb_frame, shape)
-                    face_descriptor = np.array(face_descriptor)
-                    
-                    # 计算与所有已知人脸的距离
-                    min_dist = float('inf')
-                    matched_stu_id = None
-                    
-                    for stu_id, known_descriptor in self.known_face_descriptors.items():
-                        dist = np.linalg.norm(face_descriptor - known_descriptor)
-                        if dist < min_dist:
-                            min_dist = dist
-                            matched_stu_id = stu_id
-                    
-                    # 获取关键点坐标
-                    landmarks = []
-                    for i in range(68):
-                        point = shape.part(i)
-                        landmarks.append({'x': point.x, 'y': point.y})
-                    
-                    # 计算相似度
-                    similarity = max(0, min(100, (1 - min_dist) * 100))
-                    
-                    # 构建响应数据
-                    response_data = {
-                        'face_rect': {
-                            'x': face.left(),
-                            'y': face.top(),
-                            'width': face.right() - face.left(),
-                            'height': face.bottom() - face.top()
-                        },
-                        'landmarks': landmarks,
-                        'detection_method': 'dlib'
-                    }
-                    
-                    if matched_stu_id and similarity > 60:
-                        user = await sync_to_async(User.objects.get)(stu_id=matched_stu_id)
-                        response_data.update({
-                            'stu_id': user.stu_id,
-                            'cn_name': user.cn_name,
-                            'confidence': similarity
-                        })
-                    else:
-                        response_data['error'] = '无法识别的人脸'
-                    
-                    await self.send(text_data=json.dumps(response_data))
-                    
-                except Exception as e:
-                    print(f"Dlib recognition error: {str(e)}")
-                    await self.send(text_data=json.dumps({
-                        'error': '人脸识别出错',
-                        'face_rect': {
-                            'x': face.left(),
-                            'y': face.top(),
-                            'width': face.right() - face.left(),
-                            'height': face.bottom() - face.top()
-                        }
-                    }))
+            if bytes_data is not None:
+                # 二进制帧：头部 + 原始 JPEG，无需 base64 解码
+                header, image_bytes = protocol.parse_frame(bytes_data)
+                seq = header.seq
+                detection_method = header.method
+                options = {'multi_face': header.multi_face, 'landmarks': header.landmarks,
+                           'debug': header.debug}
             else:
-                # OpenCV 检测和识别
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=3,
-                    minSize=(30, 30)
-                )
-                
-                if len(faces) != 1:
-                    await self.send(text_data=json.dumps({
-                        'error': '未检测到人脸或检测到多个人脸',
-                        'face_rect': None
-                    }))
-                    return
-                
-                x, y, w, h = faces[0]
-                face_region = gray[y:y+h, x:x+w]
-                face_region = cv2.resize(face_region, (92, 112))
-                
-                try:
-                    # 使用 OpenCV 的 LBPH 识别器
-                    face_id, confidence = self.recognizer.predict(face_region)
-                    user = await sync_to_async(User.objects.get)(face_id=face_id)
-                    
-                    await self.send(text_data=json.dumps({
-                        'face_rect': {
-                            'x': int(x),
-                            'y': int(y),
-                            'width': int(w),
-                            'height': int(h)
-                        },
-                        'stu_id': user.stu_id,
-                        'cn_name': user.cn_name,
-                        'confidence': float(confidence),
-                        'detection_method': 'opencv'
-                    }))
-                    
-                except Exception as e:
-                    print(f"OpenCV recognition error: {str(e)}")
-                    await self.send(text_data=json.dumps({
-                        'error': '人脸识别出错',
-                        'face_rect': {
-                            'x': int(x),
-                            'y': int(y),
-                            'width': int(w),
-                            'height': int(h)
-                        }
-                    }))
-                
+                data = json.loads(text_data)
+                seq = None
+                detection_method = data.get('detection_method', 'opencv')
+                options = {
+                    'multi_face': bool(data.get('multi_face', False)),
+                    'landmarks': bool(data.get('landmarks', True)),
+                    'debug': bool(data.get('debug', False)),
+                }
+
+                image_data = data.get('image').split(',')[1]
+                image_bytes = base64.b64decode(image_data)
         except Exception as e:
             print(f"Error in receive: {str(e)}")
-            await self.send(text_data=json.dumps({
+            await self.send_result({
                 'error': str(e)
-            }))
+            })
+            return
+
+        self.stats['received'] += 1
+        counters.inc('frames_received', method=detection_method)
+        if self.pending_frame is not None:
+            # 上一帧还没开始处理，已经过时
+            self.drop_frame(self.pending_frame[1])
+        timer = FrameTimer(received_at)
+        # 解析帧头 (JSON 模式下包括 base64 解码) 的耗时
+        timer.lap('decode')
+        self.pending_frame = (seq, detection_method, image_bytes, options, timer)
+        self.frame_ready.set()
+
+    async def process_frames(self):
+        """每个连接一个处理协程，每次只处理最新的一帧"""
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            frame, self.pending_frame = self.pending_frame, None
+            if frame is None:
+                continue
+
+            start = time.perf_counter()
+            await self.process_frame(*frame)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if self.stats['processed']:
+                self.avg_process_ms = 0.8 * self.avg_process_ms + 0.2 * elapsed_ms
+            else:
+                self.avg_process_ms = elapsed_ms
+            self.stats['processed'] += 1
+            counters.inc('frames_processed', method=frame[1])
+
+    @staticmethod
+    async def run_timed(timer, run, fn, *args):
+        """在推理池中执行 fn，把各阶段耗时记入 timer"""
+        result, stages = await run(metrics.timed, fn, *args)
+        timer.add(stages)
+        return result
+
+    async def recognize_batched(self, executor, batcher, detection_method, image_bytes,
+                                multi_face, landmarks, params, buffers, timer):
+        """检测和对齐在推理池中执行，特征提取与其他连接合并成一批"""
+        prepared = await self.run_timed(
+            timer, executor.run,
+            pipeline.prepare, detection_method, image_bytes, multi_face, landmarks, params, buffers
+        )
+        aligned = [aligned for _, aligned in prepared if aligned is not None]
+        if not aligned:
+            return prepared
+        try:
+            start = time.perf_counter()
+            matches, stages = await batcher.submit(aligned)
+            timer.add(stages)
+            # 凑批等待和排队的时间
+            timer.add({'batch_wait': max(0.0, (time.perf_counter() - start) * 1000 - sum(stages.values()))})
+        except Exception as e:
+            print(f"{detection_method} recognition error: {str(e)}")
+            return [({'error': '人脸识别出错', 'face_rect': response_data['face_rect']}, None)
+                    for response_data, _ in prepared]
+        return get_engine(detection_method).combine(prepared, matches)
+
+    async def resolve_users(self, results):
+        """从身份缓存为匹配成功的人脸补充学生信息，不访问数据库"""
+        identities = registry.peek('identities')
+        if identities is None:
+            # 缓存被清空后在线程池中重新加载，事件循环中不能执行 ORM 查询
+            loop = asyncio.get_event_loop()
+            identities = await loop.run_in_executor(None, registry.get, 'identities')
+        for response_data, lookup in results:
+            if not lookup:
+                continue
+            user = identities.get(**lookup)
+            if user is None:
+                print(f"User not found for {lookup}")
+                response_data.pop('confidence', None)
+                response_data['error'] = '人脸识别出错'
+            else:
+                response_data.update({
+                    'stu_id': user['stu_id'],
+                    'cn_name': user['cn_name']
+                })
+
+    async def process_frame(self, seq, detection_method, image_bytes, options, timer):
+        # 从收到帧到开始处理的等待时间
+        timer.lap('queue')
+        try:
+            # 解码、检测和识别在推理线程池/进程池中执行
+            executor = get_executor()
+            # 进程池中无法复用本连接的缓冲区
+            buffers = None
+            if executor.is_process:
+                image_bytes = bytes(image_bytes)
+            else:
+                buffers = self.buffers
+            # 未启用的引擎在这里报错，不进入推理池
+            engine = get_engine(detection_method)
+            multi_face = options.get('multi_face')
+            mode = (detection_method, bool(multi_face))
+            try:
+                results = None
+                if self.tracker is not None and self.tracker.should_track(mode):
+                    # 跟踪帧：只在上一帧人脸附近重新检测，沿用已识别的身份
+                    landmarks = engine.has_landmarks and (not multi_face or options.get('landmarks'))
+                    detections = await self.run_timed(
+                        timer, executor.run,
+                        pipeline.redetect_faces, image_bytes, detection_method,
+                        self.tracker.rects(), landmarks,
+                        getattr(settings, 'TRACKING_ROI_MARGIN', 0.5), buffers
+                    )
+                    tracked = self.tracker.update(detections)
+                    if tracked is not None:
+                        results = [(response_data, None) for response_data in tracked]
+
+                if results is None:
+                    results = await self.recognize(
+                        executor, image_bytes, detection_method, options, buffers, timer
+                    )
+                    self.scaler.observe([response_data.get('face_rect') for response_data, _ in results])
+                    with timer.stage('identity'):
+                        await self.resolve_users(results)
+                    self.count_results(detection_method, multi_face, results)
+                    self.record_events(detection_method, results)
+                    if self.tracker is not None:
+                        self.tracker.reset(mode, results)
+            except ExecutorBusy:
+                self.drop_frame(detection_method)
+                await self.send_result({
+                    'type': 'busy',
+                    'error': '服务器繁忙，已丢弃该帧',
+                    'face_rect': None
+                }, seq)
+                return
+
+            if multi_face:
+                # 多人脸模式：每张人脸一个结果
+                response_data = {
+                    'detection_method': detection_method,
+                    'faces': [face for face, _ in results]
+                }
+                if not results:
+                    response_data['error'] = '未检测到人脸'
+            else:
+                response_data = results[0][0]
+
+            timings = timer.report(detection_method)
+            if options.get('debug'):
+                response_data['timings'] = timings
+            await self.send_result(response_data, seq)
+
+        except Exception as e:
+            print(f"Error in process_frame: {str(e)}")
+            self.stats['errors'] += 1
+            counters.inc('frames_error', method=detection_method)
+            await self.send_result({
+                'error': str(e)
+            }, seq)
+
+    async def recognize(self, executor, image_bytes, detection_method, options, buffers, timer):
+        """全图检测和识别，返回 [(response, lookup), ...]"""
+        params = self.scaler.params()
+        multi_face = bool(options.get('multi_face'))
+        # 单人脸模式始终返回关键点
+        landmarks = not multi_face or bool(options.get('landmarks'))
+        batcher = get_batcher(detection_method)
+        if batcher is not None:
+            return await self.recognize_batched(
+                executor, batcher, detection_method, image_bytes, multi_face, landmarks, params, buffers, timer
+            )
+        return await self.run_timed(
+            timer, executor.run,
+            pipeline.recognize_frame, image_bytes, detection_method, multi_face, landmarks, params, buffers
+        )
     
     async def send_frame(self, frame, data=None, error=None):
         _, buffer = cv2.imencode('.jpg', frame)
@@ -259,12 +360,11 @@ class FaceRecordConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         print("Initializing FaceRecordConsumer")
-        self.face_cascade = cv2.CascadeClassifier(
-            os.path.join(settings.BASE_DIR, 'haarcascades/haarcascade_frontalface_default.xml')
-        )
         self.record_count = 0
+        self.stu_id = None
         self.user_folder = None
-        
+        self.samples = []
+
     async def connect(self):
         await self.accept()
         print("WebSocket connected")
@@ -272,23 +372,38 @@ class FaceRecordConsumer(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         print(f"WebSocket disconnected with code: {close_code}")
         
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            if bytes_data is not None:
+                # 二进制采集帧，JPEG 数据直接交给 imdecode
+                header, payload = protocol.parse_frame(bytes_data)
+                if header.msg_type == 'record_burst':
+                    data = {'type': header.msg_type, 'images': protocol.parse_burst(payload)}
+                else:
+                    data = {'type': header.msg_type, 'image': payload}
+            else:
+                data = json.loads(text_data)
             print(f"Received message type: {data.get('type')}")  # 添加日志
             
             # 处理开始采集的消息
             if data.get('type') == 'start_record':
                 self.record_count = 0
+                self.samples = []
                 stu_id = data.get('stu_id')
+                self.stu_id = stu_id
                 print(f"Starting record for stu_id: {stu_id}")  # 添加日志
+                # 目录和文件在采集完成时由 enrollment.enroll_samples 在线程池中创建
                 self.user_folder = os.path.join(settings.MEDIA_ROOT, 'faces', stu_id)
-                os.makedirs(self.user_folder, exist_ok=True)
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=protocol.dumps({
                     'type': 'record_started',
                     'message': '开始采集人脸数据'
                 }))
                 return
+
+            # 连拍采集：一条消息上传多帧，并行检测后挑选样本
+            if data.get('type') == 'record_burst':
+                await self.record_burst(data.get('images') or [])
+                return
                 
             # 处理人脸采集请求
             if data.get('type') == 'record_face':
@@ -303,62 +418,133 @@ class FaceRecordConsumer(AsyncWebsocketConsumer):
                     
                 print(f"Processing frame {self.record_count + 1}")  # 添加日志
                 
-                # 解码Base64图像
-                image_data = image_data.split(',')[1]
-                image_bytes = base64.b64decode(image_data)
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                
-                # 人脸检测
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=5,
-                    minSize=(30, 30)
-                )
-                
-                if len(faces) != 1:
-                    await self.send(text_data=json.dumps({
+                if isinstance(image_data, str):
+                    # 解码Base64图像
+                    image_data = base64.b64decode(image_data.split(',')[1])
+
+                executor = get_executor()
+                if executor.is_process:
+                    image_data = bytes(image_data)
+
+                # 检测和裁剪在推理线程池/进程池中执行，样本在采集完成时一次写入
+                try:
+                    face_rect, face = await executor.run(pipeline.capture_face, image_data)
+                except ExecutorBusy:
+                    await self.send(text_data=protocol.dumps({
+                        'type': 'busy',
+                        'error': '服务器繁忙，已丢弃该帧'
+                    }))
+                    return
+
+                if face_rect is None:
+                    await self.send(text_data=protocol.dumps({
                         'type': 'face_detect',
                         'error': '未检测到人脸或检测到多个人脸',
                         'face_rect': None
                     }))
                     return
-                
-                x, y, w, h = faces[0]
-                face = gray[y:y+h, x:x+w]
-                face = cv2.resize(face, (92, 112))
-                
-                # 保存人脸图像
-                if self.user_folder and self.record_count < 20:
-                    filename = f'face_{self.record_count}.jpg'
-                    cv2.imwrite(os.path.join(self.user_folder, filename), face)
+
+                if self.user_folder:
+                    self.samples.append(face)
                     self.record_count += 1
-                
+
                 # 发送人脸框位置和采集帧数
-                await self.send(text_data=json.dumps({
+                await self.send(text_data=protocol.dumps({
                     'type': 'face_detect',
-                    'face_rect': {
-                        'x': int(x),
-                        'y': int(y),
-                        'width': int(w),
-                        'height': int(h)
-                    },
+                    'face_rect': face_rect,
                     'record_count': self.record_count
                 }))
                 
                 # 检查是否采集完成
                 if self.record_count >= 20:
                     print("Recording completed")  # 添加日志
-                    await self.send(text_data=json.dumps({
-                        'type': 'record_completed',
-                        'message': '人脸数据采集完成'
-                    }))
+                    samples, self.samples = self.samples, []
+                    # 按质量评分排序，最好的一张作为参考图片
+                    await self.finish_record(enrollment.select_samples(samples, len(samples), min_diff=0))
                 
         except Exception as e:
             print(f"Error in receive: {str(e)}")  # 保持现有的错误日志
-            await self.send(text_data=json.dumps({
+            await self.send(text_data=protocol.dumps({
                 'type': 'error',
                 'error': str(e)
-            })) 
\ No newline at end of file
+            }))
+
+    async def record_burst(self, images):
+        """并行处理连拍的多帧，挑选清晰且不重复的帧后一次完成注册"""
+        if not self.user_folder:
+            await self.send(text_data=protocol.dumps({
+                'type': 'error',
+                'error': '请先开始采集'
+            }))
+            return
+
+        start = time.perf_counter()
+        executor = get_executor()
+        # 整个连拍作为一个任务接受，之后各帧并行提交
+        if executor.pending >= executor.max_pending:
+            await self.send(text_data=protocol.dumps({
+                'type': 'busy',
+                'error': '服务器繁忙，请稍后重试'
+            }))
+            return
+
+        # 限制单次连拍的帧数
+        images = [
+            base64.b64decode(image.split(',')[1]) if isinstance(image, str) else image
+            for image in images[:getattr(settings, 'BURST_MAX_FRAMES', 60)]
+        ]
+        if executor.is_process:
+            images = [bytes(image) for image in images]
+
+        executor.pending += 1
+        try:
+            results = await asyncio.gather(*(
+                executor.run_unbounded(pipeline.capture_face, image) for image in images
+            ))
+        finally:
+            executor.pending -= 1
+
+        faces = [face for _, face in results if face is not None]
+        samples = enrollment.select_samples(faces, getattr(settings, 'BURST_SAMPLES', 20))
+        print(f"Burst: {len(images)} frames, {len(faces)} faces, {len(samples)} selected")
+
+        if len(samples) < getattr(settings, 'BURST_MIN_SAMPLES', 10):
+            await self.send(text_data=protocol.dumps({
+                'type': 'record_failed',
+                'error': f'有效人脸帧不足 ({len(samples)}/{len(images)})，请正对摄像头并稍微转动头部后重试',
+                'frames': len(images),
+                'faces': len(faces),
+            }))
+            return
+
+        self.record_count = len(samples)
+        await self.finish_record(samples, started=start)
+
+    async def finish_record(self, samples, started=None):
+        """在线程池中一次写入样本和特征，识别端无需重新训练或重连"""
+        loop = asyncio.get_event_loop()
+        try:
+            enrolled = await loop.run_in_executor(
+                None, enrollment.enroll_samples, self.stu_id, samples
+            )
+        except ValueError as e:
+            # 样本为空或不合法，要求重新采集
+            print(f"Invalid samples for {self.stu_id}: {str(e)}")
+            await self.send(text_data=protocol.dumps({
+                'type': 'record_failed',
+                'error': f'{str(e)}，请正对摄像头后重试',
+            }))
+            return
+        except Exception as e:
+            print(f"Error enrolling {self.stu_id}: {str(e)}")
+            enrolled = None
+
+        response = {
+            'type': 'record_completed',
+            'message': '人脸数据采集完成',
+            'record_count': self.record_count,
+            'enrolled': enrolled
+        }
+        if started is not None:
+            response['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        await self.send(text_data=protocol.dumps(response))
@@ -0,0 +1,198 @@
+"""自适应分辨率的人脸检测
+
+检测器能找到的最小人脸由其窗口大小决定 (Haar 约 30 像素，dlib HOG 约
+80 像素，上采样一次后约 40 像素，YuNet 约 20 像素)。只要知道场景中最小的人脸有多大，
+就可以把图像缩小到让最小人脸刚好等于检测窗口，在小图上检测后再把
+人脸框映射回原图做关键点定位和特征提取。
+
+部署配置 (DETECTION_PROFILES) 明确给出最小人脸尺寸与延迟的取舍，
+每个连接的 DetectionScaler 再根据最近检测到的人脸大小收紧检测范围。
+"""
+from collections import deque, namedtuple
+
+import cv2
+import dlib
+import numpy as np
+from django.conf import settings
+
+from .registry import registry
+
+HAAR_WINDOW = 30
+DLIB_WINDOW = 80
+# YuNet 在输入图像上能稳定检测约 20 像素以上的人脸，留一些余量
+YUNET_WINDOW = 32
+
+# scale: 检测前的缩放比例；min_face/max_face: 原图中的人脸尺寸范围 (像素)；
+# scale_factor: Haar 金字塔步长；upsample: dlib 上采样次数
+DetectionParams = namedtuple('DetectionParams', 'scale min_face max_face scale_factor upsample')
+
+DEFAULT_PROFILES = {
+    # 只检测近处的人脸，延迟最低
+    'fast': {'min_face': 120, 'max_face': 480, 'levels': 8, 'adaptive': True},
+    'balanced': {'min_face': 60, 'max_face': 480, 'levels': 16, 'adaptive': True},
+    # 与原来的全分辨率检测相当
+    'accurate': {'min_face': 30, 'max_face': 0, 'levels': 0, 'adaptive': False},
+}
+
+
+def get_profile(name=None):
+    profiles = dict(DEFAULT_PROFILES)
+    profiles.update(getattr(settings, 'DETECTION_PROFILES', {}))
+    name = name or getattr(settings, 'DETECTION_PROFILE', 'accurate')
+    if name not in profiles:
+        raise ValueError(f'未知的检测配置: {name}')
+    return profiles[name]
+
+
+def make_params(min_face, max_face=0, levels=0):
+    """按人脸尺寸范围计算检测参数
+
+    levels 为 Haar 金字塔在 [min_face, max_face] 之间的层数，0 表示沿用
+    scaleFactor=1.1。dlib 在最小人脸小于 80 像素时上采样一次。
+    """
+    min_face = max(int(min_face), 1)
+    if levels and max_face > min_face:
+        scale_factor = (max_face / min_face) ** (1.0 / levels)
+        scale_factor = min(max(scale_factor, 1.05), 1.4)
+    else:
+        scale_factor = 1.1
+
+    upsample = 0 if min_face >= DLIB_WINDOW else 1
+    return DetectionParams(
+        scale=min(1.0, HAAR_WINDOW / min_face),
+        min_face=min_face,
+        max_face=int(max_face),
+        scale_factor=round(scale_factor, 3),
+        upsample=upsample,
+    )
+
+
+def params_for_face(width):
+    """跟踪帧在已知人脸附近的区域内检测，按上一帧的人脸大小设置参数"""
+    return make_params(width * 0.7, width * 1.5, levels=4)
+
+
+def reduce_params(params, factor):
+    """把原图尺度的检测参数换算到缩小 factor 倍解码的图像上"""
+    if params is None or factor == 1:
+        return params
+    min_face = max(1, int(params.min_face / factor))
+    return params._replace(
+        scale=min(1.0, HAAR_WINDOW / min_face),
+        min_face=min_face,
+        max_face=int(params.max_face / factor),
+        upsample=0 if min_face >= DLIB_WINDOW else 1,
+    )
+
+
+def default_params():
+    profile = get_profile()
+    return make_params(profile['min_face'], profile['max_face'], profile['levels'])
+
+
+def _resize(image, scale):
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def detect_haar(gray, params=None, min_neighbors=3):
+    """在缩小的灰度图上做 Haar 检测，返回原图坐标的 [(x, y, w, h), ...]"""
+    params = params or default_params()
+    scale = params.scale
+    small = _resize(gray, scale)
+    min_size = max(HAAR_WINDOW, int(params.min_face * scale))
+    kwargs = {}
+    if params.max_face:
+        max_size = int(params.max_face * scale)
+        kwargs['maxSize'] = (max_size, max_size)
+    faces = registry.local('face_cascade').detectMultiScale(
+        small,
+        scaleFactor=params.scale_factor,
+        minNeighbors=min_neighbors,
+        minSize=(min_size, min_size),
+        **kwargs
+    )
+    if scale >= 1.0:
+        return [tuple(int(v) for v in face) for face in faces]
+    return [tuple(int(round(v / scale)) for v in face) for face in faces]
+
+
+def detect_dlib(rgb, params=None):
+    """在缩小的 RGB 图上做 dlib HOG 检测，返回原图坐标的 dlib.rectangle 列表"""
+    params = params or default_params()
+    # 上采样一次后 HOG 的最小人脸约为窗口的一半
+    window = DLIB_WINDOW / (2 ** params.upsample)
+    scale = min(1.0, window / params.min_face)
+    faces = registry.local('dlib_detector')(_resize(rgb, scale), params.upsample)
+    if scale >= 1.0:
+        return list(faces)
+    return [
+        dlib.rectangle(int(face.left() / scale), int(face.top() / scale),
+                       int(face.right() / scale), int(face.bottom() / scale))
+        for face in faces
+    ]
+
+
+def detect_yunet(bgr, params=None):
+    """在缩小的 BGR 图上做 YuNet 检测
+
+    返回原图坐标的 (N, 15) float32 数组：x, y, w, h、5 个关键点 (右眼、左眼、
+    鼻尖、右嘴角、左嘴角) 和置信度，可以直接传给 FaceRecognizerSF.alignCrop。
+    """
+    params = params or default_params()
+    scale = min(1.0, YUNET_WINDOW / params.min_face)
+    small = _resize(bgr, scale)
+    detector = registry.local('yunet_detector')
+    height, width = small.shape[:2]
+    detector.setInputSize((width, height))
+    _, faces = detector.detect(small)
+    if faces is None:
+        return np.zeros((0, 15), dtype=np.float32)
+    if scale < 1.0:
+        faces[:, :14] /= scale
+    if params.max_face:
+        faces = faces[faces[:, 2] <= params.max_face]
+    return faces
+
+
+class DetectionScaler:
+    """每个识别连接一个，根据最近检测到的人脸大小调整检测参数
+
+    最近的人脸都很大时提高最小人脸尺寸 (图像缩得更小、金字塔层数更少)；
+    连续几帧没有检测到人脸，或每隔 rescan_interval 次检测，回到部署配置的
+    完整范围，以便发现新出现的较小人脸。
+    """
+
+    HISTORY = 30
+    MISSES_BEFORE_RESET = 3
+
+    def __init__(self, profile=None, rescan_interval=30):
+        self.profile = get_profile(profile)
+        self.rescan_interval = rescan_interval
+        self._sizes = deque(maxlen=self.HISTORY)
+        self._misses = 0
+        self._calls = 0
+
+    def observe(self, rects):
+        """记录一次全图检测得到的人脸框"""
+        widths = [rect['width'] for rect in rects if rect]
+        if not widths:
+            self._misses += 1
+            if self._misses >= self.MISSES_BEFORE_RESET:
+                self._sizes.clear()
+            return
+        self._misses = 0
+        self._sizes.extend(widths)
+
+    def params(self):
+        profile = self.profile
+        self._calls += 1
+        min_face, max_face = profile['min_face'], profile['max_face']
+        rescan = self.rescan_interval and self._calls % self.rescan_interval == 0
+        if profile.get('adaptive') and len(self._sizes) >= 5 and not rescan:
+            # 留出余量，允许人脸在相邻关键帧之间变大或变小
+            min_face = max(min_face, int(min(self._sizes) * 0.6))
+            observed_max = int(max(self._sizes) * 1.6)
+            max_face = min(max_face, observed_max) if max_face else observed_max
+        return make_params(min_face, max_face, profile['levels'])
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """持久化的人脸特征库
+
+    目录结构 (MEDIA_ROOT/embeddings)::
+
+        CURRENT          当前版本号
+        v000001.npy      float32 (T, 128) 模板矩阵，同一学生的模板连续存放
+        v000001.json     id 清单、每个学生的模板数及元数据
+
+    每次写入生成新版本并原子地切换 CURRENT，读取端用 mmap 打开 .npy，
+    同一台机器上的多个 worker 共享同一份页缓存。
+    """
+
+    KEEP_VERSIONS = 2
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(settings.MEDIA_ROOT, 'embeddings')
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def _path(self, version, ext):
+        return os.path.join(self.root, f'v{version:06d}.{ext}')
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.root, 'CURRENT')) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def load(self):
+        """返回 (ids, matrix, counts, version)，matrix 为只读 mmap；不存在时返回 None"""
+        version = self.current_version()
+        if not version:
+            return None
+        try:
+            with open(self._path(version, 'json')) as f:
+                manifest = json.load(f)
+            if not manifest['count']:
+                # 空数组无法 mmap
+                return [], np.zeros((0, manifest['dim'] or 128), dtype=np.float32), np.zeros(0, dtype=np.int64), version
+            matrix = np.load(self._path(version, 'npy'), mmap_mode='r')
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to load embedding store v{version}: {e}")
+            return None
+
+        ids = manifest['ids']
+        # 旧版本每个学生只有一个特征
+        counts = np.asarray(manifest.get('counts') or [1] * len(ids), dtype=np.int64)
+        if len(counts) != len(ids) or matrix.shape[0] != counts.sum():
+            logger.warning(f"Embedding store v{version} is inconsistent, ignoring")
+            return None
+        return ids, matrix, counts, version
+
+    def save(self, ids, matrix, counts=None):
+        """写入新版本并原子切换，返回新版本号
+
+        counts 为每个学生的模板数，省略时每个学生一个模板。
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        counts = [1] * len(ids) if counts is None else [int(c) for c in counts]
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, _FileLock(os.path.join(self.root, '.lock')):
+            version = self.current_version() + 1
+
+            # 先写临时文件再 rename，读取端不会看到写了一半的文件
+            npy_path = self._path(version, 'npy')
+            with open(npy_path + '.tmp', 'wb') as f:
+                np.save(f, matrix)
+            os.replace(npy_path + '.tmp', npy_path)
+
+            json_path = self._path(version, 'json')
+            with open(json_path + '.tmp', 'w') as f:
+                json.dump({
+                    'version': version,
+                    'dim': int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                    'count': len(ids),
+                    'ids': list(ids),
+                    'counts': counts,
+                    'created': time.time(),
+                }, f)
+            os.replace(json_path + '.tmp', json_path)
+
+            current_path = os.path.join(self.root, 'CURRENT')
+            with open(current_path + '.tmp', 'w') as f:
+                f.write(str(version))
+            os.replace(current_path + '.tmp', current_path)
+
+            self._cleanup(version)
+            return version
+
+    @contextmanager
+    def updating(self):
+        """修改特征库的跨进程锁
+
+        注册和删除学生在锁内完成 同步 → 修改 → 写入 → 通知，多个 worker
+        同时修改时不会互相覆盖。save() 自己的写锁是另一个文件，在锁内可以直接调用。
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with self._update_lock, _FileLock(os.path.join(self.root, '.update.lock')):
+            yield
+
+    def save_gallery(self, gallery):
+        ids, matrix, counts = gallery.snapshot()
+        return self.save(ids, matrix, counts)
+
+    def clear(self):
+        return self.save([], np.zeros((0, 128), dtype=np.float32))
+
+    def _cleanup(self, version):
+        # 旧版本可能仍被其他进程 mmap，保留最近几个版本
+        for old in range(version - self.KEEP_VERSIONS, 0, -1):
+            removed = False
+            for ext in ('npy', 'json'):
+                path = self._path(old, ext)
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed = True
+            if not removed:
+                break
+
+
+class _FileLock:
+    """跨进程写锁，防止多个 worker 同时写入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+embedding_store = EmbeddingStore()
+# ONNX 引擎 (SFace) 的特征与 dlib 特征不在同一空间，单独存放
+onnx_embedding_store = EmbeddingStore(os.path.join(settings.MEDIA_ROOT, 'embeddings_onnx'))
@@ -0,0 +1,405 @@
+"""可替换的人脸识别引擎
+
+每个引擎把识别拆成四步：
+
+    detect  在帧上检测人脸
+    align   裁剪并对齐人脸 (关键点定位、质量门限也在这一步)
+    embed   计算特征
+    match   与已注册人脸比对
+
+detect/align 在 prepare 中逐帧执行；embed/match 在 describe 中执行，
+batched 的引擎可以把多个连接的人脸合并成一批。客户端的 detection_method
+即引擎名，每个摄像头 (连接) 可以选择不同的引擎。
+
+    opencv  Haar 检测 + LBPH
+    dlib    HOG 检测 + 68 点对齐 + ResNet 特征
+    onnx    YuNet 检测 + 5 点对齐 + SFace 特征，通过 OpenCV DNN 在 CPU 上运行
+"""
+import cv2
+import dlib
+import numpy as np
+from django.conf import settings
+
+from .registry import registry, lbph_lock, compute_templates, compute_onnx_templates
+from .embedding_store import embedding_store, onnx_embedding_store
+from .detection import detect_dlib, detect_haar, detect_yunet, default_params, reduce_params
+from .preprocess import Frame, reduce_factor, LBPH_MIN_FACE, DLIB_MIN_FACE
+from . import quality
+from .metrics import stage
+
+NO_SINGLE_FACE = '未检测到人脸或检测到多个人脸'
+LOW_QUALITY = '人脸质量过低，请正对摄像头并保持光线充足'
+RECOGNITION_ERROR = '人脸识别出错'
+UNKNOWN_FACE = '无法识别的人脸'
+
+# SFace 对齐后的人脸为 112x112
+ONNX_MIN_FACE = 112
+
+
+def rect_dict(x, y, w, h):
+    return {'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)}
+
+
+def quality_gate(response_data, gray, rect, reduce=1, points=None):
+    """质量过低时在 response 中标记并返回 False，调用方跳过特征提取
+
+    rect 为 (x, y, w, h)，reduce 为解码缩小倍数，人脸尺寸按原图计算。
+    """
+    if not getattr(settings, 'FACE_QUALITY_GATE', True):
+        return True
+    height, width = gray.shape[:2]
+    x, y, w, h = rect
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    if x1 <= x0 or y1 <= y0:
+        face_quality = {'score': 0.0}
+    else:
+        face_quality = quality.assess(gray[y0:y1, x0:x1], w * reduce, points)
+    response_data['quality'] = face_quality['score']
+    if quality.is_acceptable(face_quality):
+        return True
+    response_data['low_quality'] = True
+    response_data['error'] = LOW_QUALITY
+    return False
+
+
+def open_frame(image_bytes, params, face_px, color, buffers):
+    """解码一帧，检测参数允许时在解码阶段直接缩小，返回 (frame, 缩小后的参数)"""
+    params = params or default_params()
+    reduce = reduce_factor(params, face_px)
+    frame = Frame(image_bytes, color=color, reduce=reduce, buffers=buffers)
+    return frame, reduce_params(params, reduce)
+
+
+class Engine:
+    """识别引擎基类，实例无状态，模型都从 registry 获取"""
+
+    name = None
+    # 是否需要彩色图像；不需要时直接按灰度解码
+    color = True
+    # 缩小解码后人脸宽度的下限
+    min_face = DLIB_MIN_FACE
+    # describe 是否适合跨连接合并成一批
+    batched = False
+    # 是否返回关键点
+    has_landmarks = False
+    # 特征库的 registry 名称和持久化存储，LBPH 没有特征库
+    gallery = None
+    store = None
+    # 连接建立时预加载的共享模型
+    models = ()
+
+    def image(self, frame):
+        """检测和跟踪使用的图像"""
+        return frame.rgb
+
+    def detect(self, frame, params, multi_face=False):
+        raise NotImplementedError
+
+    def rect(self, detection):
+        """检测结果在检测图像上的 (x, y, w, h)"""
+        raise NotImplementedError
+
+    def align(self, frame, detection, landmarks=True):
+        """返回 (response, aligned)，aligned 为送入 embed 的人脸，质量过低时为 None"""
+        raise NotImplementedError
+
+    def embed(self, aligned):
+        raise NotImplementedError
+
+    def match(self, embeddings):
+        """返回与 embeddings 一一对应的匹配结果"""
+        raise NotImplementedError
+
+    def finish(self, response_data, match):
+        """根据匹配结果补充 response，返回 (response, lookup)"""
+        raise NotImplementedError
+
+    def redetect(self, roi, params, landmarks=False):
+        """跟踪帧在人脸附近的区域内检测最大的一张人脸，返回区域坐标的结果或 None"""
+        raise NotImplementedError
+
+    def templates(self, faces):
+        """从 92x112 灰度样本计算注册模板 (T, D)，没有特征库的引擎返回 None"""
+        return None
+
+    def describe(self, aligned):
+        with stage('embed'):
+            embeddings = self.embed(aligned)
+        with stage('match'):
+            return self.match(embeddings)
+
+    def prepare(self, image_bytes, multi_face=False, landmarks=True, params=None, buffers=None):
+        """检测并对齐帧中的人脸，返回 [(response, aligned), ...]
+
+        单人脸模式下检测到的人脸数不为 1 时返回一条错误结果。
+        """
+        with stage('imdecode'):
+            frame, params = open_frame(image_bytes, params, self.min_face, self.color, buffers)
+        with stage('detect'):
+            detections = self.detect(frame, params, multi_face)
+        if not multi_face and len(detections) != 1:
+            return [({'error': NO_SINGLE_FACE, 'face_rect': None}, None)]
+
+        prepared = []
+        for detection in detections:
+            try:
+                response_data, aligned = self.align(frame, detection, landmarks)
+            except Exception as e:
+                print(f"{self.name} recognition error: {str(e)}")
+                response_data = {'error': RECOGNITION_ERROR, 'face_rect': rect_dict(*self.rect(detection))}
+                aligned = None
+            if not multi_face:
+                response_data.setdefault('detection_method', self.name)
+            prepared.append((frame.to_original(response_data), aligned))
+        return prepared
+
+    def combine(self, prepared, matches):
+        """把 describe 的结果按顺序填回 prepare 的结果"""
+        matches = iter(matches)
+        return [
+            self.finish(response_data, next(matches)) if aligned is not None else (response_data, None)
+            for response_data, aligned in prepared
+        ]
+
+    def recognize(self, image_bytes, multi_face=False, landmarks=True, params=None, buffers=None):
+        """完整识别一帧，返回 [(response, lookup), ...]"""
+        prepared = self.prepare(image_bytes, multi_face, landmarks, params, buffers)
+        aligned = [aligned for _, aligned in prepared if aligned is not None]
+        if not aligned:
+            return prepared
+        try:
+            matches = self.describe(aligned)
+        except Exception as e:
+            print(f"{self.name} recognition error: {str(e)}")
+            return [({'error': RECOGNITION_ERROR, 'face_rect': response_data['face_rect']}, None)
+                    for response_data, _ in prepared]
+        return self.combine(prepared, matches)
+
+
+class OpenCVEngine(Engine):
+    """Haar 检测 + LBPH，只需要灰度图"""
+
+    name = 'opencv'
+    color = False
+    min_face = LBPH_MIN_FACE
+    models = ('face_cascade', 'lbph_recognizer', 'face_normalization')
+
+    def image(self, frame):
+        return frame.gray
+
+    def detect(self, frame, params, multi_face=False):
+        return detect_haar(frame.gray, params)
+
+    def rect(self, detection):
+        return detection
+
+    def align(self, frame, detection, landmarks=True):
+        x, y, w, h = detection
+        # 与训练样本使用相同的归一化
+        with stage('align'):
+            face = frame.crop_face(x, y, w, h, registry.get('face_normalization'))
+        return {'face_rect': rect_dict(x, y, w, h)}, face
+
+    def embed(self, aligned):
+        # LBPH 直接使用归一化后的灰度人脸
+        return aligned
+
+    def match(self, faces):
+        recognizer = registry.get('lbph_recognizer')
+        matches = []
+        for face in faces:
+            with lbph_lock.reading():
+                face_id, confidence = recognizer.predict(face)
+            matches.append((int(face_id), float(confidence)))
+        return matches
+
+    def finish(self, response_data, match):
+        face_id, confidence = match
+        response_data['confidence'] = confidence
+        return response_data, {'face_id': face_id}
+
+    def redetect(self, roi, params, landmarks=False):
+        faces = detect_haar(roi, params)
+        if not len(faces):
+            return None
+        return {'face_rect': rect_dict(*max(faces, key=lambda f: f[2] * f[3]))}
+
+
+def _landmark_list(shape):
+    return [{'x': shape.part(i).x, 'y': shape.part(i).y} for i in range(shape.num_parts)]
+
+
+class EmbeddingEngine(Engine):
+    """特征向量 + 特征库最近邻匹配的引擎"""
+
+    batched = True
+    has_landmarks = True
+    # 相似度 (0~100) 超过该值视为匹配
+    threshold = 60
+
+    def similarity(self, distance):
+        raise NotImplementedError
+
+    def match(self, embeddings):
+        # 一次矩阵运算计算整批特征与所有已知人脸的距离
+        found = registry.get(self.gallery).search(embeddings, k=1)
+        return [matches[0] if matches else None for matches in found]
+
+    def finish(self, response_data, match):
+        min_dist = float('inf')
+        matched_stu_id = None
+        if match is not None:
+            matched_stu_id, min_dist = match
+
+        # 计算相似度
+        similarity = self.similarity(min_dist)
+
+        if matched_stu_id and similarity > self.threshold:
+            response_data['confidence'] = similarity
+            return response_data, {'stu_id': matched_stu_id}
+
+        response_data['error'] = UNKNOWN_FACE
+        return response_data, None
+
+
+class DlibEngine(EmbeddingEngine):
+    """HOG 检测 + 68 点对齐 + ResNet 特征"""
+
+    name = 'dlib'
+    gallery = 'known_faces'
+    store = embedding_store
+    models = ('face_cascade', 'dlib_detector', 'shape_predictor', 'face_recognition_model', 'known_faces')
+
+    def detect(self, frame, params, multi_face=False):
+        # 在缩小的图像上检测，人脸框映射回原图
+        faces = detect_dlib(frame.rgb, params)
+        if len(faces) == 1 or (multi_face and len(faces)):
+            return list(faces)
+        # dlib 没检测到 (单人脸模式下检测到多张) 时用 OpenCV 作为备选
+        cv_faces = detect_haar(frame.gray, params)
+        return [dlib.rectangle(x, y, x + w, y + h) for x, y, w, h in cv_faces]
+
+    def rect(self, detection):
+        return (detection.left(), detection.top(),
+                detection.right() - detection.left(), detection.bottom() - detection.top())
+
+    def align(self, frame, detection, landmarks=True):
+        with stage('landmarks'):
+            shape = registry.get('shape_predictor')(frame.rgb, detection)
+        response_data = {'face_rect': rect_dict(*self.rect(detection))}
+        if landmarks:
+            response_data['landmarks'] = _landmark_list(shape)
+        with stage('quality'):
+            acceptable = quality_gate(response_data, frame.gray, self.rect(detection), frame.reduce,
+                                      quality.shape_points(shape))
+        if not acceptable:
+            return response_data, None
+        # 与 compute_face_descriptor(img, shape) 内部使用相同的对齐参数
+        with stage('align'):
+            return response_data, dlib.get_face_chip(frame.rgb, shape, size=150, padding=0.25)
+
+    def embed(self, chips):
+        descriptors = registry.local('face_recognition_model').compute_face_descriptor(list(chips))
+        return np.array([np.array(d) for d in descriptors], dtype=np.float32)
+
+    def similarity(self, distance):
+        return max(0, min(100, (1 - distance) * 100))
+
+    def redetect(self, roi, params, landmarks=False):
+        # dlib 需要连续内存
+        roi = np.ascontiguousarray(roi)
+        faces = detect_dlib(roi, params)
+        if not len(faces):
+            return None
+        face = max(faces, key=lambda f: f.area())
+        detection = {'face_rect': rect_dict(face.left(), face.top(), face.width(), face.height())}
+        if landmarks:
+            detection['landmarks'] = _landmark_list(registry.get('shape_predictor')(roi, face))
+        return detection
+
+    def templates(self, faces):
+        return compute_templates(faces)
+
+
+class OnnxEngine(EmbeddingEngine):
+    """YuNet 检测 + SFace 特征，模型为 ONNX 格式，通过 OpenCV DNN 在 CPU 上推理
+
+    特征归一化为单位长度后存入特征库，欧氏距离 d 与余弦相似度的关系为
+    cos = 1 - d^2 / 2。
+    """
+
+    name = 'onnx'
+    min_face = ONNX_MIN_FACE
+    gallery = 'onnx_known_faces'
+    store = onnx_embedding_store
+    # 检测器和识别器按线程加载，这里只预加载特征库
+    models = ('onnx_known_faces',)
+
+    @property
+    def threshold(self):
+        # SFace 推荐的余弦相似度阈值为 0.363
+        return getattr(settings, 'ONNX_MATCH_THRESHOLD', 0.363) * 100
+
+    def image(self, frame):
+        return frame.bgr
+
+    def detect(self, frame, params, multi_face=False):
+        return list(detect_yunet(frame.bgr, params))
+
+    def rect(self, detection):
+        return tuple(int(v) for v in detection[:4])
+
+    def align(self, frame, detection, landmarks=True):
+        points = detection[4:14].reshape(5, 2)
+        response_data = {'face_rect': rect_dict(*self.rect(detection))}
+        if landmarks:
+            response_data['landmarks'] = [{'x': int(x), 'y': int(y)} for x, y in points]
+        with stage('quality'):
+            acceptable = quality_gate(response_data, frame.gray, self.rect(detection), frame.reduce)
+        if not acceptable:
+            return response_data, None
+        with stage('align'):
+            return response_data, registry.local('sface_recognizer').alignCrop(frame.bgr, detection)
+
+    def embed(self, aligned):
+        recognizer = registry.local('sface_recognizer')
+        features = np.vstack([recognizer.feature(face) for face in aligned]).astype(np.float32)
+        return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+    def similarity(self, distance):
+        return max(0, min(100, (1 - distance ** 2 / 2) * 100))
+
+    def redetect(self, roi, params, landmarks=False):
+        faces = detect_yunet(np.ascontiguousarray(roi), params)
+        if not len(faces):
+            return None
+        face = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+        detection = {'face_rect': rect_dict(*self.rect(face))}
+        if landmarks:
+            detection['landmarks'] = [{'x': int(x), 'y': int(y)} for x, y in face[4:14].reshape(5, 2)]
+        return detection
+
+    def templates(self, faces):
+        return compute_onnx_templates(faces)
+
+
+ENGINES = {engine.name: engine for engine in (OpenCVEngine(), DlibEngine(), OnnxEngine())}
+
+
+def enabled_engines():
+    """部署配置启用的引擎，ONNX 引擎需要先下载模型文件"""
+    names = getattr(settings, 'FACE_ENGINES', ('opencv', 'dlib'))
+    return [ENGINES[name] for name in names if name in ENGINES]
+
+
+def get_engine(name):
+    engine = ENGINES.get(name)
+    if engine is None or engine not in enabled_engines():
+        raise ValueError(f'未启用的识别引擎: {name}')
+    return engine
+
+
+def gallery_engines():
+    """有特征库的已启用引擎，注册和删除学生时需要同步更新"""
+    return [engine for engine in enabled_engines() if engine.gallery]
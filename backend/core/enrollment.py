@@ -0,0 +1,183 @@
+"""增量注册
+
+新学生采集完成或创建用户时，只把该学生的样本加入 LBPH 模型 (update)
+和 dlib 特征库，不重新训练全部数据。模型对象在进程内共享，修改后
+所有识别连接立即生效；模型文件在跨进程锁内同步写入，写入完成后
+其他 worker 进程通过 registry.changed() 得到通知。
+"""
+import os
+import logging
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from .registry import (registry, lbph_lock, recognizer_path, recognizer_lock, write_recognizer,
+                       compute_reference_templates)
+from .engines import gallery_engines
+from .sample_store import sample_store
+from . import quality
+from .preprocess import normalize_face, normalization_path
+
+logger = logging.getLogger(__name__)
+
+def load_student_samples(stu_id):
+    """读取一个学生的 92x112 灰度样本，优先使用打包的样本库"""
+    _, samples = sample_store.load(stu_id)
+    if samples:
+        return samples
+
+    # 尚未导入样本库的旧数据
+    user_path = os.path.join(settings.MEDIA_ROOT, 'faces', stu_id)
+    if not os.path.isdir(user_path):
+        return []
+
+    samples = []
+    for img_file in sorted(os.listdir(user_path)):
+        if img_file.endswith('.jpg'):
+            face = cv2.imread(os.path.join(user_path, img_file), cv2.IMREAD_GRAYSCALE)
+            if face is not None and face.shape == (112, 92):
+                samples.append(face)
+    return samples
+
+
+def reset_lbph():
+    """删除 LBPH 模型和训练时的归一化方式，所有学生都被删除时使用"""
+    with recognizer_lock():
+        for path in (recognizer_path(), normalization_path()):
+            if os.path.exists(path):
+                os.remove(path)
+        registry.changed('lbph_recognizer', invalidate=True)
+        registry.changed('face_normalization', invalidate=True)
+    logger.info("Reset LBPH model")
+
+
+def next_face_id():
+    """为新学生分配 face_id
+
+    LBPH 模型无法删除单个标签，删除学生后重新训练完成前模型中仍有其样本，
+    新的 face_id 要同时大于数据库和模型中的所有标签，避免旧样本被识别为新学生。
+    """
+    from .models import User
+
+    max_face_id = User.objects.aggregate(Max('face_id'))['face_id__max'] or 0
+    registry.sync(force=True)
+    recognizer = registry.get('lbph_recognizer')
+    if recognizer is not None:
+        with lbph_lock.reading():
+            labels = recognizer.getLabels()
+        if labels is not None and labels.size:
+            max_face_id = max(max_face_id, int(labels.max()))
+    return max_face_id + 1
+
+
+def _update_lbph(face_id, samples):
+    if not samples:
+        return 0
+    with recognizer_lock():
+        # 在锁内同步其他 worker 的修改，写入时才不会覆盖它们
+        registry.sync(force=True)
+        recognizer = registry.get('lbph_recognizer')
+        if recognizer is None:
+            return 0
+        # 与全量训练使用相同的归一化
+        normalization = registry.get('face_normalization')
+        samples = [normalize_face(face, normalization) for face in samples]
+        labels = np.full(len(samples), face_id, dtype=np.int32)
+        with lbph_lock.writing():
+            recognizer.update(samples, labels)
+        write_recognizer(recognizer)
+        registry.changed('lbph_recognizer')
+    logger.info(f"Saved LBPH model with {len(samples)} new samples of face_id {face_id}")
+    return len(samples)
+
+
+def _add_to_galleries(stu_id, compute, result):
+    """为每个启用的识别引擎计算模板并写入各自的特征库
+
+    compute(engine) 返回该引擎的模板 (T, D)，无法计算时为 None。
+    result['templates'] 记录每个引擎写入的模板数。
+    """
+    result['templates'] = {}
+    for engine in gallery_engines():
+        try:
+            templates = compute(engine)
+        except Exception as e:
+            logger.warning(f"Failed to compute {engine.name} templates for {stu_id}: {e}")
+            continue
+        if templates is None:
+            continue
+        with engine.store.updating():
+            # 在锁内同步其他 worker 的修改，写入时才不会覆盖它们
+            registry.sync(force=True)
+            gallery = registry.get(engine.gallery)
+            gallery.add(stu_id, templates)
+            engine.store.save_gallery(gallery)
+            registry.changed(engine.gallery)
+        result['templates'][engine.name] = len(templates)
+    result['gallery_updated'] = bool(result['templates'])
+
+
+def enroll_student(stu_id, face_id=None):
+    """把一个学生加入识别模型
+
+    face_id 已知时 (用户已创建) 用该学生的样本更新 LBPH 模型；
+    始终为其计算各引擎的模板特征并写入特征库。返回更新情况。
+    """
+    result = {'stu_id': stu_id, 'lbph_samples': 0, 'gallery_updated': False}
+
+    if face_id is not None:
+        result['lbph_samples'] = _update_lbph(face_id, load_student_samples(stu_id))
+
+    _add_to_galleries(stu_id, lambda engine: compute_reference_templates(stu_id, engine.templates), result)
+
+    logger.info(f"Enrolled {stu_id}: {result}")
+    return result
+
+
+def select_samples(faces, count, min_diff=None):
+    """从连拍的人脸中挑选清晰且互不相同的样本
+
+    按质量评分 (清晰度、曝光) 从高到低贪心选择，与已选样本的平均像素差
+    小于 min_diff 的视为重复帧跳过。返回的第一张为质量最好的样本。
+    """
+    if min_diff is None:
+        min_diff = getattr(settings, 'BURST_MIN_DIFF', 4.0)
+    ranked = sorted(faces, key=lambda face: quality.assess(face)['score'], reverse=True)
+    selected = []
+    for face in ranked:
+        if len(selected) >= count:
+            break
+        if all(cv2.absdiff(face, other).mean() >= min_diff for other in selected):
+            selected.append(face)
+    return selected
+
+
+def enroll_samples(stu_id, faces):
+    """连拍采集完成后一次写入样本和特征
+
+    faces 为已选好的 92x112 灰度人脸，第一张写入 face_0.jpg 作为参考图片。
+    样本写入样本库，质量最好的几张的特征作为模板加入特征库，用户已存在时
+    同时更新 LBPH。没有样本时抛出 ValueError。
+    """
+    from .models import User
+
+    if not len(faces):
+        raise ValueError('未采集到有效人脸')
+
+    result = {'stu_id': stu_id, 'samples': len(faces), 'lbph_samples': 0, 'gallery_updated': False}
+    sample_store.replace(stu_id, faces)
+
+    user_folder = os.path.join(settings.MEDIA_ROOT, 'faces', stu_id)
+    os.makedirs(user_folder, exist_ok=True)
+    cv2.imwrite(os.path.join(user_folder, 'face_0.jpg'), faces[0])
+
+    face_id = User.objects.filter(stu_id=stu_id).values_list('face_id', flat=True).first()
+    if face_id is not None:
+        result['lbph_samples'] = _update_lbph(face_id, faces)
+
+    _add_to_galleries(stu_id, lambda engine: engine.templates(faces), result)
+
+    logger.info(f"Enrolled {stu_id} from burst: {result}")
+    return result
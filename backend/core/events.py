@@ -0,0 +1,126 @@
+"""识别事件 (考勤记录) 的去重和批量写入
+
+识别热路径在事件循环中调用 event_buffer.record()，只做加锁和列表操作：
+同一学号在 ATTENDANCE_DEDUP_SECONDS 内的重复识别只记第一次。待写入的
+事件由后台线程每隔 ATTENDANCE_FLUSH_INTERVAL 秒，或积累到
+ATTENDANCE_FLUSH_SIZE 条时用 bulk_create 一次写入，事件循环中不访问数据库。
+"""
+import time
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """进程内的识别事件缓冲区
+
+    多 worker 部署时去重在各进程内进行，同一学生同时出现在不同 worker
+    的摄像头前会各记一条。
+    """
+
+    def __init__(self, dedup_seconds=60, flush_interval=2.0, flush_size=200, max_pending=10000):
+        self.dedup_seconds = dedup_seconds
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        # 学号 -> 最近一次记录事件的时间 (monotonic)
+        self._last_recorded = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {'recorded': 0, 'deduplicated': 0, 'written': 0, 'dropped': 0, 'failed_flushes': 0}
+
+    def record(self, stu_id, method, confidence=None, camera=''):
+        """记录一次识别成功，返回是否产生了新事件"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_recorded.get(stu_id)
+            if last is not None and now - last < self.dedup_seconds:
+                self._stats['deduplicated'] += 1
+                return False
+            self._last_recorded[stu_id] = now
+            self._pending.append({
+                'stu_id': stu_id,
+                'seen_at': timezone.now(),
+                'method': method,
+                'confidence': confidence,
+                'camera': camera,
+            })
+            self._stats['recorded'] += 1
+            self._trim()
+            full = len(self._pending) >= self.flush_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _trim(self):
+        # 数据库持续写入失败时丢弃最旧的事件，避免内存无限增长
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self._stats['dropped'] += overflow
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """把待写入的事件一次写入数据库，返回写入的条数"""
+        from .models import RecognitionEvent
+
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                batch, self._pending = self._pending, []
+                # 去重窗口已过的学号不再需要保留
+                self._last_recorded = {
+                    stu_id: at for stu_id, at in self._last_recorded.items()
+                    if now - at < self.dedup_seconds
+                }
+            if not batch:
+                return 0
+
+            # 后台线程长期持有数据库连接，按 CONN_MAX_AGE 关闭失效的连接
+            close_old_connections()
+            try:
+                RecognitionEvent.objects.bulk_create(
+                    [RecognitionEvent(**event) for event in batch], batch_size=500
+                )
+            except Exception as e:
+                logger.warning(f"Failed to write {len(batch)} recognition events: {e}")
+                with self._lock:
+                    # 放回队首，下次重试
+                    self._pending[:0] = batch
+                    self._trim()
+                    self._stats['failed_flushes'] += 1
+                return 0
+
+            with self._lock:
+                self._stats['written'] += len(batch)
+            return len(batch)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
+
+
+event_buffer = EventBuffer(
+    dedup_seconds=getattr(settings, 'ATTENDANCE_DEDUP_SECONDS', 60),
+    flush_interval=getattr(settings, 'ATTENDANCE_FLUSH_INTERVAL', 2.0),
+    flush_size=getattr(settings, 'ATTENDANCE_FLUSH_SIZE', 200),
+)
+# 进程退出前写入剩余的事件
+atexit.register(event_buffer.flush)
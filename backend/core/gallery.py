@@ -0,0 +1,305 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+DESCRIPTOR_DIM = 128
+
+AGGREGATIONS = ('min', 'mean', 'centroid')
+
+# 一次查询使用的特征库状态，在锁内取出，距离计算在锁外进行
+_Snapshot = namedtuple('_Snapshot', 'ids matrix sq_norms offsets labels centroids radii index lists')
+
+
+class FaceGallery:
+    """已注册人脸特征库
+
+    每个学生可以有多个模板特征。所有模板按学生分块保存在一块连续的
+    float32 (T, 128) 矩阵中，offsets 记录每个学生的模板区间
+    (第 i 个学生为 offsets[i]:offsets[i+1])，一次矩阵运算算出查询到所有
+    模板的距离后，用 reduceat 按学生聚合：
+
+        min       到该学生最近模板的距离
+        mean      到该学生所有模板的平均距离
+        centroid  到模板中心的距离减去模板半径 (模板到中心的平均距离)
+    """
+
+    def __init__(self, dim=DESCRIPTOR_DIM, capacity=64, aggregation='min'):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f'未知的聚合方式: {aggregation}')
+        self.dim = dim
+        self.aggregation = aggregation
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._ids = []
+        self._rows = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._labels = None
+        self._centroids = None
+        self._radii = None
+        self._owned = True
+        self.index = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_matrix(cls, ids, matrix, counts=None, aggregation='min'):
+        """直接使用已有矩阵(例如 mmap)作为存储，修改前不复制
+
+        counts 为每个学生的模板数，省略时每个学生一个模板。
+        """
+        gallery = cls(dim=matrix.shape[1] if matrix.ndim == 2 else DESCRIPTOR_DIM, capacity=1,
+                      aggregation=aggregation)
+        if len(ids):
+            matrix = np.asarray(matrix)
+            if matrix.dtype != np.float32:
+                matrix = matrix.astype(np.float32)
+            if counts is None:
+                counts = np.ones(len(ids), dtype=np.int64)
+            gallery._matrix = matrix
+            gallery._sq_norms = np.einsum('ij,ij->i', matrix, matrix).astype(np.float32)
+            gallery._ids = list(ids)
+            gallery._rows = {face_key: i for i, face_key in enumerate(ids)}
+            gallery._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            gallery._owned = False
+        return gallery
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, face_key):
+        return face_key in self._rows
+
+    @property
+    def ids(self):
+        return list(self._ids)
+
+    @property
+    def num_templates(self):
+        return int(self._offsets[-1])
+
+    @property
+    def matrix(self):
+        """当前所有模板的只读视图"""
+        view = self._matrix[:self.num_templates]
+        view.flags.writeable = False
+        return view
+
+    def counts(self):
+        return np.diff(self._offsets)
+
+    def templates(self, face_key):
+        """一个学生的全部模板，不存在时返回 None"""
+        with self._lock:
+            i = self._rows.get(face_key)
+            if i is None:
+                return None
+            return np.array(self._matrix[self._offsets[i]:self._offsets[i + 1]])
+
+    def snapshot(self):
+        """返回 (ids, matrix, counts) 的一致副本，用于持久化"""
+        with self._lock:
+            size = self.num_templates
+            return list(self._ids), np.array(self._matrix[:size], dtype=np.float32), self.counts()
+
+    def _ensure_owned(self):
+        # mmap 是只读的，第一次修改时复制到私有内存
+        if not self._owned:
+            size = self.num_templates
+            matrix = np.zeros((max(size * 2, 64), self.dim), dtype=np.float32)
+            matrix[:size] = self._matrix[:size]
+            self._matrix = matrix
+            self._sq_norms = np.concatenate([
+                self._sq_norms[:size],
+                np.zeros(matrix.shape[0] - size, dtype=np.float32),
+            ])
+            self._owned = True
+
+    def _reserve(self, size):
+        self._ensure_owned()
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        used = self.num_templates
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:used] = self._matrix[:used]
+        sq_norms = np.zeros(capacity, dtype=np.float32)
+        sq_norms[:used] = self._sq_norms[:used]
+        self._matrix, self._sq_norms = matrix, sq_norms
+
+    def _invalidate_derived(self):
+        self._labels = None
+        self._centroids = None
+        self._radii = None
+
+    def add(self, face_key, descriptors):
+        """添加或替换一个学生的模板，descriptors 为 (128,) 或 (T, 128)"""
+        descriptors = np.asarray(descriptors, dtype=np.float32).reshape(-1, self.dim)
+        if not len(descriptors):
+            raise ValueError('至少需要一个模板')
+        with self._lock:
+            # 替换时先删除旧模板，新模板追加到末尾，保持每个学生的模板连续
+            self._remove(face_key)
+            start = self.num_templates
+            end = start + len(descriptors)
+            self._reserve(end)
+            self._matrix[start:end] = descriptors
+            self._sq_norms[start:end] = np.einsum('ij,ij->i', descriptors, descriptors)
+            self._rows[face_key] = len(self._ids)
+            self._ids = self._ids + [face_key]
+            self._offsets = np.append(self._offsets, end)
+            self._invalidate_derived()
+            if self.index is not None:
+                self.index.on_add(start, descriptors)
+
+    def _remove(self, face_key):
+        i = self._rows.pop(face_key, None)
+        if i is None:
+            return False
+        self._ensure_owned()
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        size = self.num_templates
+        count = end - start
+        # 后面的模板整体前移，保持矩阵连续。搜索可能正在锁外使用旧数组，
+        # 移动到新数组中，不修改旧数组
+        matrix = np.empty_like(self._matrix)
+        matrix[:start] = self._matrix[:start]
+        matrix[start:size - count] = self._matrix[end:size]
+        sq_norms = np.zeros_like(self._sq_norms)
+        sq_norms[:start] = self._sq_norms[:start]
+        sq_norms[start:size - count] = self._sq_norms[end:size]
+        self._matrix, self._sq_norms = matrix, sq_norms
+        self._offsets = np.concatenate([self._offsets[:i + 1], self._offsets[i + 2:] - count])
+        self._ids = self._ids[:i] + self._ids[i + 1:]
+        for j in range(i, len(self._ids)):
+            self._rows[self._ids[j]] = j
+        self._invalidate_derived()
+        if self.index is not None:
+            self.index.on_remove(start, count)
+        return True
+
+    def remove(self, face_key):
+        """删除一个学生的全部模板"""
+        with self._lock:
+            return self._remove(face_key)
+
+    def _derived(self):
+        """每行所属学生、模板中心和半径，特征库变化后按需重新计算"""
+        if self._labels is None:
+            counts = self.counts()
+            size = self.num_templates
+            self._labels = np.repeat(np.arange(len(self._ids)), counts)
+            if not size:
+                self._centroids = np.zeros((0, self.dim), dtype=np.float32)
+                self._radii = np.zeros(0, dtype=np.float32)
+            else:
+                starts = self._offsets[:-1]
+                matrix = self._matrix[:size]
+                self._centroids = (np.add.reduceat(matrix, starts, axis=0) / counts[:, None]).astype(np.float32)
+                spread = np.linalg.norm(matrix - self._centroids[self._labels], axis=1)
+                self._radii = (np.add.reduceat(spread, starts) / counts).astype(np.float32)
+        return self._labels, self._centroids, self._radii
+
+    @staticmethod
+    def _euclidean(queries, matrix, sq_norms):
+        # |q - g|^2 = |q|^2 + |g|^2 - 2 q·g
+        sq_dists = (np.einsum('ij,ij->i', queries, queries)[:, None]
+                    + sq_norms[None, :]
+                    - 2.0 * queries.dot(matrix.T))
+        np.maximum(sq_dists, 0, out=sq_dists)
+        return np.sqrt(sq_dists)
+
+    def _snapshot(self, use_index=False):
+        """在锁内取出查询需要的数组
+
+        修改特征库时只替换这些数组或写入已用行之后的位置，不改动已取出的数组，
+        多个推理线程的距离计算可以在锁外并行。
+        """
+        with self._lock:
+            size = self.num_templates
+            labels, centroids, radii = self._derived()
+            index = lists = None
+            if use_index and self.index is not None and size >= self.index.min_size:
+                index = self.index
+                lists = index.inverted_lists()
+            return _Snapshot(self._ids, self._matrix[:size], self._sq_norms[:size], self._offsets,
+                             labels, centroids, radii, index, lists)
+
+    def _distances(self, snap, queries):
+        if self.aggregation == 'centroid':
+            centroids = snap.centroids
+            dists = self._euclidean(queries, centroids, np.einsum('ij,ij->i', centroids, centroids))
+            return np.maximum(dists - snap.radii[None, :], 0)
+
+        dists = self._euclidean(queries, snap.matrix, snap.sq_norms)
+        starts = snap.offsets[:-1]
+        if self.aggregation == 'mean':
+            return np.add.reduceat(dists, starts, axis=1) / np.diff(snap.offsets)[None, :]
+        return np.minimum.reduceat(dists, starts, axis=1)
+
+    def distances(self, queries):
+        """返回 (M, 学生数) 的聚合距离矩阵"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        return self._distances(self._snapshot(), queries)
+
+    def _exact_search(self, snap, queries, k):
+        dists = self._distances(snap, queries)
+        size = dists.shape[1]
+        k = min(k, size)
+        if k < size:
+            top = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(size), (len(queries), 1))
+        results = []
+        for i, rows in enumerate(top):
+            rows = rows[np.argsort(dists[i, rows])]
+            results.append((rows, dists[i, rows]))
+        return results
+
+    def _ann_search(self, snap, queries, k):
+        """ANN 索引在模板上找最近的若干行，按学生取最小距离
+
+        只用于 min 聚合：mean 和 centroid 的最近学生不一定有模板出现在
+        最近的行中，这两种聚合总是精确搜索。
+        """
+        size = len(snap.matrix)
+        # 每个学生有多个模板，多取一些候选行以覆盖 k 个不同的学生
+        per_id = max(1, size // max(1, len(snap.ids)))
+        found = snap.index.search(snap.matrix, snap.sq_norms, queries, k * per_id, lists=snap.lists)
+
+        results = []
+        for rows, row_dists in found:
+            candidates = np.unique(snap.labels[rows])
+            best = np.full(len(snap.ids), np.inf, dtype=np.float32)
+            np.minimum.at(best, snap.labels[rows], row_dists)
+            dists = best[candidates]
+            order = np.argsort(dists)[:k]
+            results.append((candidates[order], dists[order]))
+        return results
+
+    def set_index(self, index):
+        """挂载近似最近邻索引，None 表示只用暴力搜索"""
+        with self._lock:
+            self.index = index
+
+    def search(self, queries, k=1, exact=False):
+        """批量最近邻查询
+
+        queries 为 (128,) 或 (M, 128)，返回长度为 M 的列表，
+        每项是按聚合距离升序排列的 [(face_key, distance), ...]
+        min 聚合且模板数达到索引的最小规模时走 ANN 索引，exact=True 强制暴力搜索。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        snap = self._snapshot(use_index=not exact and self.aggregation == 'min')
+        if not snap.ids:
+            return [[] for _ in range(len(queries))]
+
+        if snap.index is not None:
+            found = self._ann_search(snap, queries, k)
+        else:
+            found = self._exact_search(snap, queries, k)
+        return [
+            [(snap.ids[i], float(dist)) for i, dist in zip(rows, dists)]
+            for rows, dists in found
+        ]
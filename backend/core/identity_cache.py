@@ -0,0 +1,49 @@
+import threading
+
+
+class IdentityCache:
+    """学生显示信息的进程内缓存
+
+    识别热路径按 stu_id 或 face_id 查询姓名，不再访问数据库。
+    User 的增删改通过 Django 信号同步到缓存 (见 signals.py)。
+    """
+
+    FIELDS = ('stu_id', 'face_id', 'cn_name', 'en_name')
+
+    def __init__(self):
+        self._by_stu_id = {}
+        self._by_face_id = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        cache = cls()
+        for values in queryset.values(*cls.FIELDS):
+            cache._put(values)
+        return cache
+
+    def __len__(self):
+        return len(self._by_stu_id)
+
+    def _put(self, values):
+        old = self._by_stu_id.get(values['stu_id'])
+        if old is not None and self._by_face_id.get(old['face_id']) is old:
+            del self._by_face_id[old['face_id']]
+        self._by_stu_id[values['stu_id']] = values
+        self._by_face_id[values['face_id']] = values
+
+    def put(self, user):
+        with self._lock:
+            self._put({field: getattr(user, field) for field in self.FIELDS})
+
+    def remove(self, stu_id):
+        with self._lock:
+            values = self._by_stu_id.pop(stu_id, None)
+            if values is not None and self._by_face_id.get(values['face_id']) is values:
+                del self._by_face_id[values['face_id']]
+
+    def get(self, stu_id=None, face_id=None):
+        """按 stu_id 或 face_id 查询，返回字段字典，不存在时返回 None"""
+        if stu_id is not None:
+            return self._by_stu_id.get(stu_id)
+        return self._by_face_id.get(face_id)
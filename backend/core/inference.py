@@ -0,0 +1,82 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusy(Exception):
+    """等待执行的任务已达上限，调用方应丢弃该帧并通知客户端"""
+
+
+def _init_process_worker():
+    # spawn 方式启动的子进程需要重新初始化 Django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class InferenceExecutor:
+    """检测和识别专用的线程池/进程池
+
+    max_pending 限制同时排队和执行的任务数，超出时 run() 抛出 ExecutorBusy，
+    consumer 据此向客户端发送 busy 消息，而不是让帧在内存中无限堆积。
+    """
+
+    def __init__(self, kind='thread', workers=None, max_pending=None):
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.pending = 0
+
+        if kind == 'process':
+            # 进程池中的任务函数和参数必须可以 pickle
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_process_worker)
+        else:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='inference')
+        logger.info(f"Inference executor: {kind} x {self.workers}, max pending {self.max_pending}")
+
+    @property
+    def is_process(self):
+        return self.kind == 'process'
+
+    async def run(self, fn, *args):
+        # pending 只在事件循环线程中修改，无需加锁
+        if self.pending >= self.max_pending:
+            raise ExecutorBusy()
+        self.pending += 1
+        try:
+            return await self.run_unbounded(fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def run_unbounded(self, fn, *args):
+        """不检查排队上限，用于已被接受的帧的后续阶段"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = InferenceExecutor(
+                    kind=getattr(settings, 'INFERENCE_EXECUTOR', 'thread'),
+                    workers=getattr(settings, 'INFERENCE_WORKERS', None),
+                    max_pending=getattr(settings, 'INFERENCE_MAX_PENDING', None),
+                )
+    return _executor
@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.ann import IVFIndex
+from core.gallery import FaceGallery, AGGREGATIONS
+
+
+class Command(BaseCommand):
+    help = '按聚合方式对比 ANN 索引与暴力搜索的 recall@1 和查询延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='使用 N 个随机学生代替已注册的特征库')
+        parser.add_argument('--templates', type=int, default=1,
+                            help='随机特征库中每个学生的模板数')
+        parser.add_argument('--aggregation', nargs='+', choices=AGGREGATIONS, default=list(AGGREGATIONS))
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--noise', type=float, default=0.2,
+                            help='查询特征相对库中特征的扰动幅度')
+        parser.add_argument('--nlist', type=int, default=getattr(settings, 'FACE_ANN_NLIST', 0))
+        parser.add_argument('--nprobe', type=int, nargs='+',
+                            default=[getattr(settings, 'FACE_ANN_NPROBE', 8)])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.RandomState(options['seed'])
+        ids, matrix, counts = self._load_gallery(options['synthetic'], options['templates'], rng)
+        if len(ids) < 2:
+            self.stderr.write('特征库为空，可使用 --synthetic N 生成测试数据')
+            return
+
+        # 以库中特征加扰动作为查询，模拟同一个人的不同照片
+        picked = rng.randint(0, len(matrix), options['queries'])
+        queries = matrix[picked] + rng.normal(0, options['noise'] / np.sqrt(matrix.shape[1]),
+                                              (len(picked), matrix.shape[1])).astype(np.float32)
+        self.stdout.write(f'gallery={len(ids)} templates={len(matrix)} queries={len(queries)}')
+
+        # 只有 min 聚合使用索引
+        if 'min' in options['aggregation']:
+            start = time.perf_counter()
+            index = IVFIndex.train(matrix, nlist=options['nlist'])
+            self.stdout.write(f'ivf trained nlist={index.nlist} in {time.perf_counter() - start:.2f} s')
+
+        for aggregation in options['aggregation']:
+            gallery = FaceGallery.from_matrix(ids, matrix, counts, aggregation=aggregation)
+            start = time.perf_counter()
+            exact = [found[0][0] for found in gallery.search(queries, k=1, exact=True)]
+            exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            self.stdout.write(f'{aggregation:<8} exact     latency={exact_ms:.3f} ms/query')
+            if aggregation != 'min':
+                # mean 和 centroid 聚合的查询总是精确搜索，不使用索引
+                self.stdout.write(f'{aggregation:<8} ivf       not used (exact search only)')
+                continue
+
+            gallery.set_index(index)
+            for nprobe in options['nprobe']:
+                index.nprobe = nprobe
+                start = time.perf_counter()
+                approx = [found[0][0] if found else None for found in gallery.search(queries, k=1)]
+                approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+                recall = np.mean([a == e for a, e in zip(approx, exact)])
+                self.stdout.write(f'{aggregation:<8} nprobe={nprobe:<4} latency={approx_ms:.3f} ms/query '
+                                  f'recall@1={recall:.4f}')
+
+    def _load_gallery(self, synthetic, templates, rng):
+        """返回 (ids, matrix, counts)"""
+        if synthetic:
+            # 每个学生的模板围绕各自的中心分布
+            templates = max(1, templates)
+            centers = rng.normal(0, 1, (synthetic, 128)).astype(np.float32)
+            centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+            matrix = np.repeat(centers, templates, axis=0)
+            if templates > 1:
+                matrix += rng.normal(0, 0.3 / np.sqrt(128), matrix.shape).astype(np.float32)
+            return [str(i) for i in range(synthetic)], matrix, np.full(synthetic, templates, dtype=np.int64)
+
+        from core.registry import registry
+        ids, matrix, counts = registry.get('known_faces').snapshot()
+        return ids, matrix, counts
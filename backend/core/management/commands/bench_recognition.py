@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import metrics, pipeline
+from core.detection import DetectionScaler, get_profile, make_params
+from core.engines import enabled_engines, get_engine, NO_SINGLE_FACE, UNKNOWN_FACE
+from core.preprocess import FrameBuffers
+from core.registry import registry, _current_rss
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+PERCENTILES = (50, 95, 99)
+
+
+def load_directory(path):
+    """读取目录中的帧，一级子目录名为标注的学号，顶层的图片没有标注"""
+    frames = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        rel = os.path.relpath(root, path)
+        label = None if rel == '.' else rel.split(os.sep)[0]
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(root, name), 'rb') as f:
+                    frames.append((label, f.read()))
+    return frames
+
+
+def load_video(path, label=None, step=1, max_frames=0, jpeg_quality=80):
+    """逐帧读取视频并编码为 JPEG，与浏览器上传的帧一致 (canvas 质量 0.8)"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f'无法打开视频: {path}')
+    frames = []
+    index = 0
+    try:
+        while not max_frames or len(frames) < max_frames:
+            ok, image = capture.read()
+            if not ok:
+                break
+            if index % step == 0:
+                _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+                frames.append((label, buffer.tobytes()))
+            index += 1
+    finally:
+        capture.release()
+    return frames
+
+
+def outcome(multi_face, results):
+    """与 FaceRecognitionConsumer.count_results 相同的分类"""
+    if not results or (not multi_face and results[0][0].get('error') == NO_SINGLE_FACE):
+        return 'no_face'
+    # 多人脸模式以最大的人脸作为这一帧的结果
+    response_data = max(
+        (response_data for response_data, _ in results),
+        key=lambda r: (r.get('face_rect') or {}).get('width', 0)
+    )
+    if 'stu_id' in response_data:
+        return 'recognized'
+    if response_data.get('low_quality'):
+        return 'low_quality'
+    if response_data.get('error') == UNKNOWN_FACE:
+        return 'unknown'
+    return 'errors'
+
+
+def prediction(results):
+    faces = [response_data for response_data, _ in results if 'stu_id' in response_data]
+    if not faces:
+        return None
+    return max(faces, key=lambda r: r['face_rect']['width'])['stu_id']
+
+
+class Replay:
+    """模拟一个识别连接：按 FaceRecognitionConsumer 的方式逐帧识别
+
+    每帧都按关键帧处理 (不做跟踪)，检测参数由 DetectionScaler 自适应调整，
+    颜色转换复用本连接的缓冲区，身份从身份缓存查询。
+    """
+
+    def __init__(self, method, multi_face, landmarks, profile=None, adaptive=True):
+        self.method = method
+        self.multi_face = multi_face
+        self.landmarks = landmarks
+        self.buffers = FrameBuffers()
+        self.scaler = DetectionScaler(profile) if adaptive else None
+        if not adaptive:
+            profile = get_profile(profile)
+            self.params = make_params(profile['min_face'], profile['max_face'], profile['levels'])
+
+    def run(self, image_bytes):
+        """返回 (结果分类, 识别出的学号, 各阶段耗时)"""
+        start = time.perf_counter()
+        params = self.scaler.params() if self.scaler else self.params
+        try:
+            results, stages = metrics.timed(
+                pipeline.recognize_frame, image_bytes, self.method,
+                self.multi_face, self.landmarks, params, self.buffers
+            )
+        except Exception as e:
+            print(f"{self.method} benchmark error: {str(e)}")
+            return 'errors', None, {'total': (time.perf_counter() - start) * 1000}
+        if self.scaler:
+            self.scaler.observe([response_data.get('face_rect') for response_data, _ in results])
+
+        identity_start = time.perf_counter()
+        identities = registry.get('identities')
+        for response_data, lookup in results:
+            user = identities.get(**lookup) if lookup else None
+            if user is not None:
+                response_data['stu_id'] = user['stu_id']
+            elif lookup:
+                response_data['error'] = '人脸识别出错'
+        end = time.perf_counter()
+        stages['identity'] = (end - identity_start) * 1000
+        stages['total'] = (end - start) * 1000
+        return outcome(self.multi_face, results), prediction(results), stages
+
+
+def summarize_latency(samples):
+    latency = {}
+    for name in sorted(samples):
+        values = np.asarray(samples[name])
+        summary = {'count': len(values), 'mean': round(float(values.mean()), 3)}
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            summary[f'p{p}'] = round(float(value), 3)
+        latency[name] = summary
+    return latency
+
+
+def summarize_accuracy(records):
+    """按标注计算识别准确率、FRR 和 FAR
+
+    标注为已注册学号的帧是本人尝试：识别为本人算正确，未识别 (包括未检测到
+    人脸和质量过低) 算拒识，识别为他人算误识；标注的学号未注册的帧是冒认
+    尝试，识别为任何人都算误接受。没有标注的帧不参与统计。
+    """
+    identities = registry.get('identities')
+    genuine = correct = rejected = misidentified = 0
+    impostor = accepted = 0
+    for label, predicted in records:
+        if label is None:
+            continue
+        if identities.get(stu_id=label) is not None:
+            genuine += 1
+            if predicted == label:
+                correct += 1
+            elif predicted is None:
+                rejected += 1
+            else:
+                misidentified += 1
+        else:
+            impostor += 1
+            if predicted is not None:
+                accepted += 1
+
+    def rate(count, total):
+        return round(count / total, 4) if total else None
+
+    return {
+        'genuine': genuine,
+        'impostor': impostor,
+        'accuracy': rate(correct, genuine),
+        'frr': rate(rejected, genuine),
+        'misidentification_rate': rate(misidentified, genuine),
+        'far': rate(accepted, impostor),
+    }
+
+
+def peak_rss_mb():
+    """进程启动以来的峰值常驻内存，只有一个引擎的子进程中才代表该引擎的内存"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = ('按识别连接的处理流程回放一组帧，输出各引擎的吞吐量、各阶段延迟分位数、'
+            '峰值内存和识别准确率 (FAR/FRR)。测试多个引擎时每个引擎在单独的子进程中运行，'
+            '峰值内存互不影响')
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--frames', help='图片目录，子目录名为标注的学号 (未注册的学号作为冒认样本)')
+        source.add_argument('--video', help='视频文件，逐帧编码为 JPEG 后回放')
+        parser.add_argument('--label', help='视频中人物的学号')
+        parser.add_argument('--step', type=int, default=1, help='视频每隔几帧取一帧')
+        parser.add_argument('--max-frames', type=int, default=0)
+        parser.add_argument('--methods', nargs='+',
+                            help='要测试的引擎，默认为 FACE_ENGINES 中启用的全部引擎')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='并行回放的连接数，每个连接一个线程')
+        parser.add_argument('--repeat', type=int, default=1, help='每个连接重复回放的次数')
+        parser.add_argument('--warmup', type=int, default=5, help='正式计时前预热的帧数')
+        parser.add_argument('--multi-face', action='store_true')
+        parser.add_argument('--no-landmarks', action='store_true', help='多人脸模式下不返回关键点')
+        parser.add_argument('--profile', help='检测配置，默认为 DETECTION_PROFILE')
+        parser.add_argument('--no-adaptive', action='store_true',
+                            help='固定使用检测配置的参数，不根据人脸大小调整 (标注集中的图片互不相关时使用)')
+        parser.add_argument('--in-process', action='store_true',
+                            help='所有引擎在同一进程中测试，此时只报告内存增量 (rss_delta_mb)')
+        parser.add_argument('--output', help='结果写入的 JSON 文件')
+        parser.add_argument('--baseline', help='与之前输出的 JSON 对比')
+
+    def handle(self, *args, **options):
+        try:
+            if options['frames']:
+                frames = load_directory(options['frames'])
+            else:
+                frames = load_video(options['video'], options['label'], max(1, options['step']),
+                                    options['max_frames'])
+            methods = [get_engine(name) for name in options['methods']] if options['methods'] \
+                else enabled_engines()
+        except ValueError as e:
+            self.stderr.write(str(e))
+            return
+        if options['max_frames']:
+            frames = frames[:options['max_frames']]
+        if not frames:
+            self.stderr.write('没有可回放的帧')
+            return
+
+        labelled = sum(1 for label, _ in frames if label is not None)
+        self.stdout.write(f'frames={len(frames)} labelled={labelled} workers={options["workers"]} '
+                          f'repeat={options["repeat"]}')
+
+        report = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'host': {
+                'cpu_count': os.cpu_count(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'opencv': cv2.__version__,
+            },
+            'config': {
+                'source': options['frames'] or options['video'],
+                'frames': len(frames),
+                'labelled': labelled,
+                'workers': options['workers'],
+                'repeat': options['repeat'],
+                'multi_face': options['multi_face'],
+                'profile': options['profile'] or getattr(settings, 'DETECTION_PROFILE', 'accurate'),
+                'adaptive': not options['no_adaptive'],
+                'quality_gate': getattr(settings, 'FACE_QUALITY_GATE', True),
+                'reduced_decode': getattr(settings, 'REDUCED_DECODE', True),
+            },
+            'methods': {},
+        }
+        # 峰值内存是整个进程的，多个引擎时各自在子进程中测试
+        isolated = len(methods) > 1 and not options['in_process']
+        for engine in methods:
+            if isolated:
+                result = self.bench_subprocess(engine, options)
+                if result is None:
+                    continue
+            else:
+                result = self.bench(engine, frames, options)
+                if len(methods) > 1:
+                    result['peak_rss_mb'] = None
+            report['methods'][engine.name] = result
+            self.print_result(engine.name, result)
+
+        if options['baseline']:
+            self.compare(options['baseline'], report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'结果已写入 {options["output"]}'))
+
+    def bench_subprocess(self, engine, options):
+        """在子进程中测试一个引擎，返回其结果，失败时返回 None"""
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_recognition',
+                   '--methods', engine.name, '--output', output]
+        for name in ('frames', 'video', 'label', 'step', 'max_frames', 'workers', 'repeat', 'warmup', 'profile'):
+            if options[name] is not None:
+                command += ['--' + name.replace('_', '-'), str(options[name])]
+        for name in ('multi_face', 'no_landmarks', 'no_adaptive'):
+            if options[name]:
+                command.append('--' + name.replace('_', '-'))
+        try:
+            # 子进程的输出由本进程汇总打印
+            process = subprocess.run(command, stdout=subprocess.DEVNULL, cwd=settings.BASE_DIR)
+            if process.returncode:
+                self.stderr.write(f'[{engine.name}] benchmark process exited with {process.returncode}')
+                return None
+            with open(output) as f:
+                return json.load(f)['methods'][engine.name]
+        finally:
+            os.remove(output)
+
+    def bench(self, engine, frames, options):
+        rss_start = _current_rss()
+        registry.preload(['identities'] + list(engine.models))
+        multi_face = options['multi_face']
+        landmarks = not multi_face or not options['no_landmarks']
+
+        def new_replay():
+            return Replay(engine.name, multi_face, landmarks, options['profile'], not options['no_adaptive'])
+
+        # 预热：加载各线程私有的模型，分配缓冲区
+        warmup = new_replay()
+        for _, image_bytes in frames[:options['warmup']]:
+            warmup.run(image_bytes)
+
+        workers = max(1, options['workers'])
+
+        def replay(worker):
+            connection = new_replay()
+            records = []
+            for _ in range(options['repeat']):
+                for label, image_bytes in frames[worker::workers]:
+                    kind, predicted, stages = connection.run(image_bytes)
+                    records.append((label, kind, predicted, stages))
+            return records
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            records = [record for worker in pool.map(replay, range(workers)) for record in worker]
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        stage_samples = {}
+        outcomes = {}
+        for _, kind, _, stages in records:
+            outcomes[kind] = outcomes.get(kind, 0) + 1
+            for name, ms in stages.items():
+                stage_samples.setdefault(name, []).append(ms)
+
+        return {
+            'frames': len(records),
+            'wall_s': round(wall, 3),
+            'cpu_s': round(cpu, 3),
+            'fps': round(len(records) / wall, 2) if wall else None,
+            # 每个 CPU 核心每秒处理的帧数 (按进程 CPU 时间计算，包括 OpenCV 内部线程)
+            'fps_per_core': round(len(records) / cpu, 2) if cpu else None,
+            'latency_ms': summarize_latency(stage_samples),
+            'outcomes': outcomes,
+            'accuracy': summarize_accuracy((label, predicted) for label, _, predicted, _ in records),
+            'peak_rss_mb': peak_rss_mb(),
+            # 本引擎加载模型和回放期间增加的常驻内存，已被之前的引擎加载的共享模型不计入
+            'rss_delta_mb': round((_current_rss() - rss_start) / 2 ** 20, 1),
+        }
+
+    def print_result(self, name, result):
+        memory = f'rss_delta={result["rss_delta_mb"]} MB'
+        if result['peak_rss_mb'] is not None:
+            memory = f'peak_rss={result["peak_rss_mb"]} MB ' + memory
+        self.stdout.write(f'[{name}] fps={result["fps"]} fps/core={result["fps_per_core"]} '
+                          f'{memory} outcomes={result["outcomes"]}')
+        for stage, summary in result['latency_ms'].items():
+            self.stdout.write(f'  {stage:<12} p50={summary["p50"]:8.2f} p95={summary["p95"]:8.2f} '
+                              f'p99={summary["p99"]:8.2f} ms  n={summary["count"]}')
+        accuracy = result['accuracy']
+        if accuracy['genuine'] or accuracy['impostor']:
+            self.stdout.write(f'  accuracy={accuracy["accuracy"]} frr={accuracy["frr"]} '
+                              f'misid={accuracy["misidentification_rate"]} far={accuracy["far"]} '
+                              f'(genuine={accuracy["genuine"]} impostor={accuracy["impostor"]})')
+
+    def compare(self, path, report):
+        """打印与基线相比的吞吐量、端到端 p95 延迟和准确率变化"""
+        with open(path) as f:
+            baseline = json.load(f)
+        for name, result in report['methods'].items():
+            base = baseline.get('methods', {}).get(name)
+            if base is None:
+                continue
+            changes = []
+            for label, key in (('fps/core', lambda r: r['fps_per_core']),
+                               ('p95', lambda r: r['latency_ms'].get('total', {}).get('p95')),
+                               ('accuracy', lambda r: r['accuracy']['accuracy']),
+                               ('far', lambda r: r['accuracy']['far'])):
+                old, new = key(base), key(result)
+                if old is None or new is None:
+                    continue
+                delta = f'{(new - old) / old * 100:+.1f}%' if old else f'{new - old:+.4f}'
+                changes.append(f'{label} {old} -> {new} ({delta})')
+            self.stdout.write(f'[{name}] vs baseline: ' + ', '.join(changes))
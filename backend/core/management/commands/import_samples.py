@@ -0,0 +1,73 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.sample_store import sample_store, SAMPLE_SHAPE
+
+
+def _read_student(user_path):
+    """按文件名中的序号读取一个学生的全部有效样本"""
+    files = [f for f in os.listdir(user_path) if f.endswith('.jpg')]
+    files.sort(key=lambda f: (len(f), f))
+    samples = []
+    for img_file in files:
+        face = cv2.imread(os.path.join(user_path, img_file), cv2.IMREAD_GRAYSCALE)
+        if face is not None and face.shape == SAMPLE_SHAPE:
+            samples.append((img_file, face))
+    return samples
+
+
+class Command(BaseCommand):
+    help = '把 media/faces 下的 JPEG 样本导入打包的样本库'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--faces-dir', default=os.path.join(settings.MEDIA_ROOT, 'faces'))
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='并行读取图片的线程数')
+        parser.add_argument('--force', action='store_true',
+                            help='重新导入已在样本库中的学生')
+        parser.add_argument('--prune', action='store_true',
+                            help='导入后删除 JPEG，只保留用于计算 dlib 特征的 face_0.jpg')
+
+    def handle(self, *args, **options):
+        faces_dir = options['faces_dir']
+        if not os.path.isdir(faces_dir):
+            self.stderr.write(f'目录不存在: {faces_dir}')
+            return
+
+        existing = set() if options['force'] else set(sample_store.stu_ids())
+        stu_ids = sorted(
+            d for d in os.listdir(faces_dir)
+            if os.path.isdir(os.path.join(faces_dir, d)) and d not in existing
+        )
+        self.stdout.write(f'待导入 {len(stu_ids)} 名学生，跳过已导入 {len(existing)} 名')
+
+        start = time.perf_counter()
+        students = samples_count = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            paths = [os.path.join(faces_dir, stu_id) for stu_id in stu_ids]
+            # 读取并行进行，写入样本库按顺序执行
+            for stu_id, user_path, samples in zip(stu_ids, paths, pool.map(_read_student, paths)):
+                if not samples:
+                    self.stderr.write(f'{stu_id}: 没有有效样本，跳过')
+                    continue
+                sample_store.replace(stu_id, [face for _, face in samples])
+                students += 1
+                samples_count += len(samples)
+
+                if options['prune']:
+                    for img_file, _ in samples:
+                        if img_file != 'face_0.jpg':
+                            os.remove(os.path.join(user_path, img_file))
+
+                if students % 500 == 0:
+                    self.stdout.write(f'已导入 {students} 名学生，{samples_count} 个样本')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'导入完成：{students} 名学生，{samples_count} 个样本，'
+            f'用时 {time.perf_counter() - start:.1f} s'
+        ))
@@ -0,0 +1,454 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core import protocol
+from .bench_recognition import load_directory, load_video, PERCENTILES
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+RECOGNITION_PATH = '/ws/face_recognition/'
+RECORD_PATH = '/ws/face_record/'
+# 采集连接每隔这么多帧重新开始采集，采集数达不到 20，不会真正注册
+RECORD_RESTART = 15
+# 与前端一致：超时未收到结果时恢复发送额度
+CREDIT_TIMEOUT = 3.0
+# receive_from 超时会取消被测的 ASGI 应用，本进程模式下读取不设实际的超时，
+# 测试结束时直接取消读取任务
+LOCAL_RECEIVE_TIMEOUT = 24 * 3600
+
+
+class LocalConnection:
+    """通过 channels 的 WebsocketCommunicator 在本进程中连接 ASGI 应用"""
+
+    def __init__(self, application, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+        self.communicator.scope['client'] = ('127.0.0.1', 0)
+
+    async def connect(self, timeout):
+        connected, _ = await self.communicator.connect(timeout)
+        if not connected:
+            raise ConnectionError('连接被拒绝')
+
+    async def send(self, data):
+        if isinstance(data, bytes):
+            await self.communicator.send_to(bytes_data=data)
+        else:
+            await self.communicator.send_to(text_data=data)
+
+    async def receive(self):
+        try:
+            return await self.communicator.receive_from(LOCAL_RECEIVE_TIMEOUT)
+        except AssertionError:
+            # 收到的不是数据帧，服务器关闭了连接
+            raise ConnectionError('连接已关闭')
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class RemoteConnection:
+    """通过 websockets 包连接运行中的服务器"""
+
+    def __init__(self, url):
+        self.url = url
+        self.websocket = None
+
+    async def connect(self, timeout):
+        # 调试模式下的结果可能较大，不限制消息长度
+        self.websocket = await asyncio.wait_for(websockets.connect(self.url, max_size=None), timeout)
+
+    async def send(self, data):
+        try:
+            await self.websocket.send(data)
+        except websockets.exceptions.ConnectionClosed:
+            raise ConnectionError('连接已关闭')
+
+    async def receive(self):
+        try:
+            return await self.websocket.recv()
+        except websockets.exceptions.ConnectionClosed:
+            raise ConnectionError('连接已关闭')
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+
+
+class ProcessMonitor:
+    """按 /proc/<pid> 采样服务器进程的 CPU 使用率和常驻内存，不支持的平台不采样"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _read(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                # 进程名可能包含空格，从最后一个 ')' 之后开始解析
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{self.pid}/statm') as f:
+                rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+        # utime、stime 为第 14、15 个字段
+        return (int(fields[11]) + int(fields[12])) / self._ticks, rss
+
+    async def run(self, started, interval):
+        last = self._read()
+        last_time = time.perf_counter()
+        if last is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            current, now = self._read(), time.perf_counter()
+            if current is None:
+                return
+            self.samples.append({
+                't': round(now - started, 2),
+                'cpu_percent': round((current[0] - last[0]) / (now - last_time) * 100, 1),
+                'rss_mb': round(current[1] / 1024 / 1024, 1),
+            })
+            last, last_time = current, now
+
+
+class ClientStats:
+    """一类连接 (识别或采集) 的统计"""
+
+    def __init__(self):
+        self.connections = 0
+        self.failed = 0
+        self.sent = 0
+        self.skipped = 0
+        self.busy = 0
+        self.lost = 0
+        self.server_dropped = 0
+        # (收到结果的时间, 延迟毫秒)
+        self.responses = []
+
+    def respond(self, started, sent_at, data):
+        now = time.perf_counter()
+        if data.get('type') == 'busy':
+            self.busy += 1
+        else:
+            self.responses.append((now - started, (now - sent_at) * 1000))
+
+    def summary(self, window):
+        """window 为统计吞吐量的 (开始, 结束) 秒，排除连接逐步建立的阶段"""
+        start, end = window
+        steady = [latency for at, latency in self.responses if start <= at <= end]
+        result = {
+            'connections': self.connections,
+            'failed_connections': self.failed,
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'responses': len(self.responses),
+            'busy': self.busy,
+            'lost': self.lost,
+            'server_dropped': self.server_dropped,
+            'throughput_fps': round(len(steady) / (end - start), 2) if end > start else None,
+        }
+        latencies = np.asarray([latency for _, latency in self.responses])
+        if len(latencies):
+            result['latency_ms'] = {f'p{p}': round(float(v), 2)
+                                    for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))}
+            result['latency_ms']['max'] = round(float(latencies.max()), 2)
+        return result
+
+    def timeline(self, duration):
+        """每秒收到的结果数和延迟中位数"""
+        buckets = [[] for _ in range(int(duration) + 1)]
+        for at, latency in self.responses:
+            buckets[min(int(at), len(buckets) - 1)].append(latency)
+        return [{'t': second, 'responses': len(values),
+                 'p50_ms': round(float(np.median(values)), 2) if values else None}
+                for second, values in enumerate(buckets)]
+
+
+class LoadTest:
+    def __init__(self, frames, options, connect):
+        self.frames = frames
+        self.options = options
+        self.connect = connect
+        self.recognition = ClientStats()
+        self.record = ClientStats()
+        self.interval = 1.0 / options['fps']
+        self.timeout = options['timeout']
+
+    async def open(self, path, stats):
+        connection = self.connect(path)
+        try:
+            await connection.connect(self.timeout * 4)
+        except Exception as e:
+            print(f"Load test connection error: {str(e)}")
+            stats.failed += 1
+            return None
+        stats.connections += 1
+        return connection
+
+    async def ticks(self, index, deadline):
+        """按固定帧率产生发送时刻，各连接错开起始相位"""
+        next_at = time.perf_counter() + self.interval * index / max(1, self.options['connections'])
+        while next_at < deadline:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            yield
+            next_at += self.interval
+
+    async def read(self, connection, handle):
+        """持续读取结果，直到连接关闭或读取任务被取消"""
+        try:
+            while True:
+                handle(await connection.receive())
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"Load test receive error: {str(e)}")
+
+    async def drain(self, pending, reading):
+        """发送结束后等待剩余的结果，超时未返回的留在 pending 中计为丢失"""
+        wait_until = time.perf_counter() + self.timeout
+        while pending and not reading.done() and time.perf_counter() < wait_until:
+            await asyncio.sleep(0.01)
+
+    async def recognition_client(self, index, started, deadline):
+        stats = self.recognition
+        connection = await self.open(RECOGNITION_PATH, stats)
+        if connection is None:
+            return
+        # 帧序号 -> 发送时间；服务器丢弃的旧帧不会返回结果
+        pending = {}
+        last_sent = 0.0
+        server_dropped = 0
+
+        def handle(message):
+            nonlocal server_dropped
+            data = json.loads(message)
+            sent_at = pending.pop(data.get('seq'), None)
+            if sent_at is not None:
+                stats.respond(started, sent_at, data)
+            server_dropped = max(server_dropped, (data.get('flow') or {}).get('dropped', 0))
+
+        reading = asyncio.ensure_future(self.read(connection, handle))
+        seq = index * 1000000
+        try:
+            async for _ in self.ticks(index, deadline):
+                now = time.perf_counter()
+                # 超时未返回的帧计为丢失
+                for frame_seq, sent_at in list(pending.items()):
+                    if now - sent_at > self.timeout:
+                        del pending[frame_seq]
+                        stats.lost += 1
+                # 模拟前端的发送额度：上一帧的结果返回前不发送新帧
+                if self.options['flow_control'] and pending and now - last_sent < CREDIT_TIMEOUT:
+                    stats.skipped += 1
+                    continue
+                seq += 1
+                image = self.frames[seq % len(self.frames)]
+                pending[seq] = last_sent = time.perf_counter()
+                await connection.send(protocol.pack_frame(
+                    image, method=self.options['method'], multi_face=self.options['multi_face'], seq=seq
+                ))
+                stats.sent += 1
+            await self.drain(pending, reading)
+        finally:
+            reading.cancel()
+        stats.lost += len(pending)
+        stats.server_dropped += server_dropped
+        await connection.close()
+
+    async def record_client(self, index, started, deadline):
+        stats = self.record
+        connection = await self.open(RECORD_PATH, stats)
+        if connection is None:
+            return
+        # 采集连接的消息按顺序处理，结果与发送的帧一一对应
+        pending = deque()
+        start_message = protocol.dumps({'type': 'start_record', 'stu_id': f'loadtest-{index}'})
+
+        def handle(message):
+            data = json.loads(message)
+            if data.get('type') == 'record_started' or not pending:
+                return
+            stats.respond(started, pending.popleft(), data)
+
+        reading = asyncio.ensure_future(self.read(connection, handle))
+        count = 0
+        try:
+            async for _ in self.ticks(index, deadline):
+                now = time.perf_counter()
+                while pending and now - pending[0] > self.timeout:
+                    pending.popleft()
+                    stats.lost += 1
+                if count % RECORD_RESTART == 0:
+                    await connection.send(start_message)
+                image = self.frames[count % len(self.frames)]
+                count += 1
+                pending.append(time.perf_counter())
+                await connection.send(protocol.pack_frame(image, msg_type='record_face'))
+                stats.sent += 1
+            await self.drain(pending, reading)
+        finally:
+            reading.cancel()
+        stats.lost += len(pending)
+        await connection.close()
+
+    async def run(self):
+        options = self.options
+        duration = options['duration']
+        total = options['connections'] + options['record_connections']
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def delayed(client, index, delay):
+            # 连接在 ramp 秒内逐个建立
+            await asyncio.sleep(delay)
+            await client(index, started, deadline)
+
+        ramp = min(options['ramp'], duration)
+        clients = []
+        for i in range(total):
+            delay = ramp * i / total
+            if i < options['connections']:
+                clients.append(delayed(self.recognition_client, i, delay))
+            else:
+                clients.append(delayed(self.record_client, i - options['connections'], delay))
+
+        monitor = None
+        monitoring = None
+        if options['server_pid']:
+            monitor = ProcessMonitor(options['server_pid'])
+            monitoring = asyncio.ensure_future(monitor.run(started, options['sample_interval']))
+        try:
+            await asyncio.gather(*clients)
+        finally:
+            if monitoring is not None:
+                monitoring.cancel()
+
+        window = (ramp, duration)
+        report = {
+            'recognition': self.recognition.summary(window),
+            'record': self.record.summary(window),
+            'timeline': {
+                'recognition': self.recognition.timeline(duration),
+                'record': self.record.timeline(duration),
+            },
+        }
+        if monitor is not None:
+            report['server'] = monitor.samples
+            cpu = [sample['cpu_percent'] for sample in monitor.samples if sample['t'] >= ramp]
+            if cpu:
+                report['server_summary'] = {
+                    'cpu_percent_mean': round(float(np.mean(cpu)), 1),
+                    'cpu_percent_max': max(cpu),
+                    'rss_mb_max': max(sample['rss_mb'] for sample in monitor.samples),
+                }
+        return report
+
+
+class Command(BaseCommand):
+    help = ('打开 N 个识别连接 (和 M 个采集连接)，按指定帧率发送帧，报告持续吞吐量、'
+            '端到端延迟分布、丢失的结果以及服务器的 CPU 和内存')
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--frames', help='图片目录')
+        source.add_argument('--video', help='视频文件')
+        parser.add_argument('--max-frames', type=int, default=200, help='最多读取的帧数')
+        parser.add_argument('--url', help='服务器地址，如 ws://127.0.0.1:8000 (需要安装 websockets 包)；'
+                                          '省略时在本进程中运行 ASGI 应用')
+        parser.add_argument('--server-pid', type=int,
+                            help='采样 CPU 和内存的服务器进程，本进程模式下默认为当前进程')
+        parser.add_argument('--connections', type=int, default=10, help='识别连接数')
+        parser.add_argument('--record-connections', type=int, default=0, help='采集连接数')
+        parser.add_argument('--fps', type=float, default=10, help='每个连接的发送帧率')
+        parser.add_argument('--duration', type=float, default=30, help='持续发送的秒数')
+        parser.add_argument('--ramp', type=float, default=0, help='逐个建立连接的总时长 (秒)，不计入吞吐量')
+        parser.add_argument('--timeout', type=float, default=5, help='超过这个时间未返回的结果计为丢失 (秒)')
+        parser.add_argument('--method', default='opencv')
+        parser.add_argument('--multi-face', action='store_true')
+        parser.add_argument('--flow-control', action='store_true',
+                            help='与前端一样，上一帧的结果返回前不发送新帧')
+        parser.add_argument('--sample-interval', type=float, default=1.0)
+        parser.add_argument('--output', help='结果写入的 JSON 文件')
+
+    def handle(self, *args, **options):
+        try:
+            if options['frames']:
+                frames = load_directory(options['frames'])[:options['max_frames']]
+            else:
+                frames = load_video(options['video'], max_frames=options['max_frames'])
+        except ValueError as e:
+            self.stderr.write(str(e))
+            return
+        if not frames:
+            self.stderr.write('没有可发送的帧')
+            return
+        if options['method'] not in protocol.METHODS.values():
+            self.stderr.write(f'未知的识别方式: {options["method"]}')
+            return
+
+        if options['url']:
+            if websockets is None:
+                self.stderr.write('连接远程服务器需要安装 websockets 包 (pip install websockets)')
+                return
+            # 根日志级别为 DEBUG 时 websockets 会记录每一帧，影响压测客户端自身的性能
+            logging.getLogger('websockets').setLevel(logging.INFO)
+            base = options['url'].rstrip('/')
+
+            def connect(path):
+                return RemoteConnection(base + path)
+        else:
+            from backend.routing import application
+            options['server_pid'] = options['server_pid'] or os.getpid()
+
+            def connect(path):
+                return LocalConnection(application, path)
+
+        test = LoadTest([image for _, image in frames], options, connect)
+        self.stdout.write(f'connections={options["connections"]} record={options["record_connections"]} '
+                          f'fps={options["fps"]} duration={options["duration"]}s '
+                          f'target={options["url"] or "in-process"}')
+        report = asyncio.get_event_loop().run_until_complete(test.run())
+        report['config'] = {key: options[key] for key in (
+            'url', 'connections', 'record_connections', 'fps', 'duration', 'ramp',
+            'timeout', 'method', 'multi_face', 'flow_control')}
+        report['config']['frames'] = len(frames)
+        if not options['url']:
+            # 本进程模式下服务端的计数器可以直接读取
+            from core.metrics import counters
+            report['server_counters'] = counters.snapshot()
+
+        for kind in ('recognition', 'record'):
+            summary = report[kind]
+            if not summary['connections'] and not summary['failed_connections']:
+                continue
+            latency = summary.get('latency_ms', {})
+            self.stdout.write(
+                f'[{kind}] connections={summary["connections"]} failed={summary["failed_connections"]} '
+                f'sent={summary["sent"]} responses={summary["responses"]} busy={summary["busy"]} '
+                f'lost={summary["lost"]} server_dropped={summary["server_dropped"]} '
+                f'throughput={summary["throughput_fps"]} fps'
+            )
+            if latency:
+                self.stdout.write(f'  latency p50={latency["p50"]} p95={latency["p95"]} '
+                                  f'p99={latency["p99"]} max={latency["max"]} ms')
+        if 'server_summary' in report:
+            server = report['server_summary']
+            self.stdout.write(f'[server] cpu mean={server["cpu_percent_mean"]}% max={server["cpu_percent_max"]}% '
+                              f'rss max={server["rss_mb_max"]} MB')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'结果已写入 {options["output"]}'))
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# 启动后这段时间内退出的 worker 视为启动失败
+STARTUP_SECONDS = 5
+
+
+class Command(BaseCommand):
+    help = ('启动多个 daphne worker 进程共享同一个监听端口，由内核在 worker 之间分配连接。'
+            '特征库通过 mmap 共享，模型修改通过 MODEL_SYNC_BACKEND 通知各 worker')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--threads', type=int, default=0,
+                            help='每个 worker 的推理线程数，默认按核数平均分配')
+        parser.add_argument('--application', default='backend.asgi:application')
+
+    def handle(self, *args, **options):
+        if os.name == 'nt':
+            self.stderr.write('Windows 下无法让多个进程共享监听套接字，请直接运行 daphne')
+            return
+        if not getattr(settings, 'MODEL_SYNC_BACKEND', 'file'):
+            self.stderr.write('MODEL_SYNC_BACKEND 为空时各 worker 的模型不会同步')
+
+        workers = max(1, options['workers'])
+        threads = options['threads'] or max(1, (os.cpu_count() or 1) // workers)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((options['host'], options['port']))
+        sock.listen(1024)
+        sock.set_inheritable(True)
+
+        env = dict(os.environ, INFERENCE_WORKERS=str(threads))
+        command = [sys.executable, '-c', 'from daphne.cli import CommandLineInterface; '
+                   'CommandLineInterface.entrypoint()', '--fd', str(sock.fileno()), options['application']]
+
+        def spawn():
+            process = subprocess.Popen(command, env=env, cwd=settings.BASE_DIR, pass_fds=(sock.fileno(),))
+            process.started_at = time.monotonic()
+            return process
+
+        processes = [spawn() for _ in range(workers)]
+        self.stdout.write(f'{workers} workers x {threads} inference threads on '
+                          f'{options["host"]}:{options["port"]}')
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        try:
+            while not stopping:
+                time.sleep(1)
+                for i, process in enumerate(processes):
+                    if process.poll() is None:
+                        continue
+                    if time.monotonic() - process.started_at < STARTUP_SECONDS:
+                        # 启动阶段就退出多半是配置错误，重启也无济于事
+                        self.stderr.write(f'worker {process.pid} failed to start ({process.returncode})')
+                        return
+                    # 运行中意外退出的 worker 重新启动，其余 worker 不受影响
+                    self.stderr.write(f'worker {process.pid} exited with {process.returncode}, restarting')
+                    processes[i] = spawn()
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+            for process in processes:
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            sock.close()
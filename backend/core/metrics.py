@@ -0,0 +1,209 @@
+"""识别流程的计数器、耗时直方图和 Prometheus 文本输出
+
+热路径上只做加锁累加；各阶段耗时由 collect()/stage() 记录到当前线程的
+收集器中，推理池 (包括进程池) 中执行的阶段通过 timed() 把耗时随结果
+一起带回事件循环。
+"""
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+# 延迟直方图的桶上限 (毫秒)
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+class Counters:
+    """进程级计数器，多线程安全，可带标签 (如 method='dlib')"""
+
+    def __init__(self):
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._values[_key(name, labels)] += value
+
+    def snapshot(self):
+        """{名称: 值}，带标签的计数器名称为 name{k="v"}"""
+        with self._lock:
+            return {name + _format_labels(labels): value for (name, labels), value in self._values.items()}
+
+    def items(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class Histograms:
+    """按标签分组的延迟直方图"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # 最后一个桶为 +Inf
+                series = self._series[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['buckets'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def items(self):
+        with self._lock:
+            return sorted((key, {'buckets': list(s['buckets']), 'sum': s['sum'], 'count': s['count']})
+                          for key, s in self._series.items())
+
+
+counters = Counters()
+histograms = Histograms()
+
+_local = threading.local()
+
+
+@contextmanager
+def collect():
+    """收集当前线程中 stage() 记录的耗时，yield 的字典为 {阶段: 毫秒}"""
+    previous = getattr(_local, 'stages', None)
+    stages = _local.stages = {}
+    try:
+        yield stages
+    finally:
+        _local.stages = previous
+
+
+@contextmanager
+def stage(name):
+    """记录一个阶段的耗时，不在 collect() 中时不做任何事"""
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def timed(fn, *args):
+    """在推理池中执行 fn 并返回 (结果, 各阶段耗时)"""
+    with collect() as stages:
+        result = fn(*args)
+    return result, stages
+
+
+class FrameTimer:
+    """一帧在事件循环一侧的耗时记录，合并推理池带回的阶段耗时"""
+
+    def __init__(self, start=None):
+        self.start = start or time.perf_counter()
+        self._last = self.start
+        self.stages = {}
+
+    def lap(self, name):
+        """记录从上一次 lap (或开始) 到现在的耗时"""
+        now = time.perf_counter()
+        self.add({name: (now - self._last) * 1000})
+        self._last = now
+
+    def add(self, stages):
+        for name, ms in stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add({name: (time.perf_counter() - start) * 1000})
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def report(self, method):
+        """写入直方图，返回 {阶段: 毫秒} (保留两位小数)"""
+        total = self.total_ms()
+        for name, ms in self.stages.items():
+            histograms.observe('face_stage_latency_ms', ms, stage=name, method=method)
+        histograms.observe('face_frame_latency_ms', total, method=method)
+        timings = {name: round(ms, 2) for name, ms in self.stages.items()}
+        timings['total'] = round(total, 2)
+        return timings
+
+
+class ConnectionStats:
+    """活动连接的计数，连接断开后移除"""
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def register(self, connection_id, stats):
+        with self._lock:
+            self._connections[connection_id] = stats
+
+    def unregister(self, connection_id):
+        with self._lock:
+            self._connections.pop(connection_id, None)
+
+    def items(self):
+        with self._lock:
+            return sorted((cid, dict(stats)) for cid, stats in self._connections.items())
+
+
+connections = ConnectionStats()
+
+
+def render_prometheus():
+    """Prometheus 文本格式 (0.0.4)"""
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in counters.items():
+        name = f'face_{name}_total'
+        header(name, 'counter')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for (name, labels), series in histograms.items():
+        header(name, 'histogram')
+        cumulative = 0
+        bounds = [str(b) for b in histograms.buckets] + ['+Inf']
+        for bound, count in zip(bounds, series['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {series["sum"]:.3f}')
+        lines.append(f'{name}_count{_format_labels(labels)} {series["count"]}')
+
+    header('face_connection_frames', 'gauge')
+    for connection_id, stats in connections.items():
+        for kind, value in sorted(stats.items()):
+            labels = _format_labels([('connection', connection_id), ('kind', kind)])
+            lines.append(f'face_connection_frames{labels} {value}')
+    return '\n'.join(lines) + '\n'
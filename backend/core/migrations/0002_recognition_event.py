@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecognitionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stu_id', models.CharField(max_length=12)),
+                ('seen_at', models.DateTimeField()),
+                ('method', models.CharField(max_length=16)),
+                ('confidence', models.FloatField(null=True)),
+                ('camera', models.CharField(blank=True, max_length=16)),
+            ],
+            options={
+                'db_table': 'recognition_events',
+                'ordering': ['-seen_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recognitionevent',
+            index=models.Index(fields=['seen_at'], name='events_seen_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recognitionevent',
+            index=models.Index(fields=['stu_id', 'seen_at'], name='events_stu_seen_at_idx'),
+        ),
+    ]
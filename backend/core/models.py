@@ -8,4 +8,24 @@ class User(models.Model):
     created_time = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        db_table = 'users' 
\ No newline at end of file
+        db_table = 'users'
+
+
+class RecognitionEvent(models.Model):
+    """识别成功的记录，同一学生在去重窗口内只记一次 (见 events.py)"""
+    stu_id = models.CharField(max_length=12)
+    # 不关联 User，删除学生后考勤记录仍然保留
+    seen_at = models.DateTimeField()
+    method = models.CharField(max_length=16)
+    # LBPH 为距离 (越小越相似)，其他引擎为相似度百分比
+    confidence = models.FloatField(null=True)
+    # 识别连接 (摄像头) 的编号
+    camera = models.CharField(max_length=16, blank=True)
+
+    class Meta:
+        db_table = 'recognition_events'
+        ordering = ['-seen_at']
+        indexes = [
+            models.Index(fields=['seen_at'], name='events_seen_at_idx'),
+            models.Index(fields=['stu_id', 'seen_at'], name='events_stu_seen_at_idx'),
+        ]
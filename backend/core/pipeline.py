@@ -0,0 +1,110 @@
+"""识别和采集的同步处理流程
+
+这里的函数都是纯 CPU 计算，不访问数据库，由 InferenceExecutor 放到
+线程池或进程池中执行，避免阻塞 WebSocket 的事件循环。具体的检测和
+识别由 engines 中 detection_method 对应的引擎完成；这里只用引擎名
+作为参数，便于在进程池中调用。
+"""
+import os
+
+import cv2
+
+from .detection import detect_haar, default_params, params_for_face
+from .engines import get_engine, rect_dict
+from .preprocess import Frame
+from .metrics import stage
+
+
+def recognize_frame(image_bytes, detection_method='opencv', multi_face=False, landmarks=True,
+                    params=None, buffers=None):
+    """识别一帧图像，返回每张人脸的 (response, lookup) 列表
+
+    response 为发送给客户端的结果，lookup 为需要查询的学生条件
+    (如 {'stu_id': ...})，未匹配时为 None。单人脸模式下列表只有一项。
+    params 为 detection.DetectionParams，省略时使用部署配置的默认参数；
+    buffers 为连接的 FrameBuffers，进程池模式下为 None。
+    """
+    return get_engine(detection_method).recognize(image_bytes, multi_face, landmarks, params, buffers)
+
+
+def prepare(detection_method, image_bytes, multi_face=False, landmarks=True, params=None, buffers=None):
+    """识别的第一阶段：检测并对齐人脸，返回 [(response, aligned), ...]
+
+    特征提取放在 describe 中，便于多个连接合并成一批计算。
+    """
+    return get_engine(detection_method).prepare(image_bytes, multi_face, landmarks, params, buffers)
+
+
+def describe(detection_method, aligned):
+    """批量计算对齐人脸的特征并与已注册人脸匹配，返回与 aligned 一一对应的结果"""
+    return get_engine(detection_method).describe(aligned)
+
+
+def _expand_rect(rect, margin, width, height):
+    """按比例扩大人脸框作为重新检测的区域，裁剪到图像范围内"""
+    dx = int(rect['width'] * margin)
+    dy = int(rect['height'] * margin)
+    x0 = max(0, rect['x'] - dx)
+    y0 = max(0, rect['y'] - dy)
+    x1 = min(width, rect['x'] + rect['width'] + dx)
+    y1 = min(height, rect['y'] + rect['height'] + dy)
+    return x0, y0, x1, y1
+
+
+def redetect_faces(image_bytes, detection_method, rects, landmarks=False, margin=0.5, buffers=None):
+    """只在上一帧人脸框附近的区域内重新检测，用于跟踪帧
+
+    返回与 rects 一一对应的 {'face_rect': ..., 'landmarks': ...}，
+    某个区域内没有检测到人脸时对应项为 None。
+    """
+    engine = get_engine(detection_method)
+    # 区域检测按原图坐标进行，不缩小解码
+    with stage('imdecode'):
+        frame = Frame(image_bytes, color=engine.color, buffers=buffers)
+        image = engine.image(frame)
+    height, width = image.shape[:2]
+
+    detections = []
+    for rect in rects:
+        x0, y0, x1, y1 = _expand_rect(rect, margin, width, height)
+        roi = image[y0:y1, x0:x1]
+        if roi.size == 0:
+            detections.append(None)
+            continue
+
+        # 按上一帧的人脸大小缩放区域，较大的人脸不需要上采样
+        with stage('track'):
+            detection = engine.redetect(roi, params_for_face(rect['width']), landmarks)
+        if detection is not None:
+            # 区域坐标换算回整帧坐标
+            detection['face_rect']['x'] += x0
+            detection['face_rect']['y'] += y0
+            for point in detection.get('landmarks') or ():
+                point['x'] += x0
+                point['y'] += y0
+        detections.append(detection)
+    return detections
+
+
+def capture_face(image_bytes, save_path=None):
+    """检测采集帧中的单张人脸，裁剪为 92x112 灰度图
+
+    返回 (人脸框, 灰度人脸)，未检测到单张人脸时返回 (None, None)。
+    样本保存原始灰度图，归一化在训练和识别时统一进行。
+    指定 save_path 时同时把人脸图像写入该路径。
+    """
+    # 采集只需要灰度图；返回的人脸会被保留，不使用共享缓冲区
+    frame = Frame(image_bytes, color=False)
+    faces = detect_haar(frame.gray, default_params(), min_neighbors=5)
+
+    if len(faces) != 1:
+        return None, None
+
+    x, y, w, h = faces[0]
+    face = frame.crop_face(x, y, w, h)
+
+    # 保存人脸图像
+    if save_path:
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        cv2.imwrite(save_path, face)
+    return rect_dict(x, y, w, h), face
@@ -0,0 +1,174 @@
+"""帧解码与人脸归一化
+
+每帧 JPEG 只解码一次：只需要灰度图时直接按灰度解码 (libjpeg 只解 Y
+分量，省去颜色转换)，检测参数允许时用 IMREAD_REDUCED_* 在解码阶段
+直接缩小。RGB / 灰度等颜色空间按需转换并缓存在 Frame 上，转换结果
+写入每个连接预分配的缓冲区，避免每帧重新分配内存。
+
+LBPH 样本的归一化 (是否直方图均衡化) 在训练时确定并写入模型旁的
+normalization.json，识别和增量注册读取同一份配置，保证与训练一致。
+"""
+import os
+import json
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+FACE_SIZE = (92, 112)
+
+# LBPH 样本 92x112，dlib chip 150x150；缩小解码后人脸宽度不低于这些值
+LBPH_MIN_FACE = FACE_SIZE[0]
+DLIB_MIN_FACE = 100
+
+_GRAY_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+DEFAULT_NORMALIZATION = {'equalize_hist': False}
+
+
+def reduce_factor(params, face_px):
+    """选择最大的解码缩小倍数，使最小人脸缩小后仍不小于 face_px"""
+    if params is None or not getattr(settings, 'REDUCED_DECODE', True):
+        return 1
+    for factor in (8, 4, 2):
+        if params.min_face / factor >= face_px:
+            return factor
+    return 1
+
+
+class FrameBuffers:
+    """每个连接一组的预分配缓冲区
+
+    同一连接的帧按顺序处理，缓冲区可以在帧之间复用；尺寸变化时重新分配。
+    进程池模式下缓冲区无法跨进程共享，调用方传 None。
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+
+class Frame:
+    """解码一次的图像帧，颜色空间转换结果按需计算并缓存
+
+    color=False 时直接按灰度解码，只能取 gray。reduce 为解码时的缩小倍数，
+    检测结果通过 to_original 映射回原图坐标。
+    """
+
+    def __init__(self, image_bytes, color=True, reduce=1, buffers=None):
+        flags = (_COLOR_FLAGS if color else _GRAY_FLAGS)[reduce]
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+        if image is None:
+            raise ValueError('无法解码图像')
+        self.reduce = reduce
+        self.buffers = buffers
+        self._bgr = image if color else None
+        self._gray = None if color else image
+        self._rgb = None
+        # 已裁剪的人脸数，同一帧的每张人脸使用各自的缓冲区
+        self._crops = 0
+
+    @property
+    def shape(self):
+        image = self._gray if self._gray is not None else self._bgr
+        return image.shape[:2]
+
+    def _convert(self, name, code, channels):
+        bgr = self.bgr
+        if self.buffers is None:
+            return cv2.cvtColor(bgr, code)
+        height, width = bgr.shape[:2]
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        return cv2.cvtColor(bgr, code, dst=self.buffers.get(name, shape))
+
+    @property
+    def bgr(self):
+        if self._bgr is None:
+            raise ValueError('灰度解码的帧没有彩色数据')
+        return self._bgr
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = self._convert('gray', cv2.COLOR_BGR2GRAY, 1)
+        return self._gray
+
+    @property
+    def rgb(self):
+        if self._rgb is None:
+            self._rgb = self._convert('rgb', cv2.COLOR_BGR2RGB, 3)
+        return self._rgb
+
+    def crop_face(self, x, y, w, h, normalization=None):
+        """裁剪灰度人脸并缩放为 92x112，按模型的归一化方式处理"""
+        region = self.gray[y:y+h, x:x+w]
+        if self.buffers is None:
+            face = cv2.resize(region, FACE_SIZE)
+        else:
+            buf = self.buffers.get(f'face{self._crops}', FACE_SIZE[::-1])
+            face = cv2.resize(region, FACE_SIZE, dst=buf)
+        self._crops += 1
+        return normalize_face(face, normalization, inplace=self.buffers is not None)
+
+    def to_original(self, response_data):
+        """把缩小解码图像上的人脸框和关键点换算回原图坐标"""
+        factor = self.reduce
+        if factor == 1:
+            return response_data
+        rect = response_data.get('face_rect')
+        if rect:
+            response_data['face_rect'] = {key: int(value * factor) for key, value in rect.items()}
+        if response_data.get('landmarks'):
+            response_data['landmarks'] = [
+                {'x': int(p['x'] * factor), 'y': int(p['y'] * factor)} for p in response_data['landmarks']
+            ]
+        return response_data
+
+
+def normalize_face(face, normalization=None, inplace=False):
+    """LBPH 样本的归一化，训练、增量注册和识别都经过这里"""
+    normalization = normalization or DEFAULT_NORMALIZATION
+    if normalization.get('equalize_hist'):
+        if inplace:
+            return cv2.equalizeHist(face, dst=face)
+        return cv2.equalizeHist(face)
+    return face
+
+
+def normalization_path():
+    return os.path.join(settings.MEDIA_ROOT, 'recognizer/normalization.json')
+
+
+def load_normalization():
+    try:
+        with open(normalization_path()) as f:
+            return dict(DEFAULT_NORMALIZATION, **json.load(f))
+    except (OSError, ValueError):
+        return dict(DEFAULT_NORMALIZATION)
+
+
+def save_normalization(normalization):
+    """原子地写入训练时使用的归一化方式"""
+    path = normalization_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(normalization, f)
+    os.replace(tmp_path, path)
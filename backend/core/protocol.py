@@ -0,0 +1,120 @@
+import json
+import struct
+from collections import namedtuple
+
+# 二进制帧格式 (小端)：
+#   magic     2s  b'FR'
+#   version   B   协议版本，当前为 1
+#   msg_type  B   消息类型，见 MSG_TYPES
+#   method    B   检测方式，见 METHODS
+#   flags     B   bit0: 直方图均衡化  bit1: 多人脸识别  bit2: 多人脸模式返回关键点
+#                 bit3: 结果中附带各阶段耗时 (调试)
+#   seq       I   帧序号，原样返回给客户端
+#   width     H   图像宽度
+#   height    H   图像高度
+# 头部之后紧跟原始 JPEG 数据
+#
+# record_burst 消息一次上传多帧，头部之后为：
+#   count     H   帧数
+#   之后每帧  I   JPEG 长度，紧跟 JPEG 数据
+HEADER = struct.Struct('<2sBBBBIHH')
+MAGIC = b'FR'
+VERSION = 1
+
+MSG_TYPES = {
+    1: 'recognize',
+    2: 'record_face',
+    3: 'record_burst',
+}
+METHODS = {
+    0: 'opencv',
+    1: 'dlib',
+    2: 'onnx',
+}
+FLAG_EQUALIZE_HIST = 0x01
+FLAG_MULTI_FACE = 0x02
+FLAG_LANDMARKS = 0x04
+FLAG_DEBUG = 0x08
+
+BURST_COUNT = struct.Struct('<H')
+BURST_LENGTH = struct.Struct('<I')
+
+FrameHeader = namedtuple('FrameHeader', 'msg_type method equalize_hist multi_face landmarks debug seq width height')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def parse_frame(bytes_data):
+    """解析二进制帧，返回 (FrameHeader, JPEG 数据的 memoryview)，不复制图像数据"""
+    if len(bytes_data) < HEADER.size:
+        raise ProtocolError('帧数据过短')
+
+    magic, version, msg_type, method, flags, seq, width, height = HEADER.unpack_from(bytes_data)
+    if magic != MAGIC:
+        raise ProtocolError('无效的帧头')
+    if version != VERSION:
+        raise ProtocolError(f'不支持的协议版本: {version}')
+    if msg_type not in MSG_TYPES:
+        raise ProtocolError(f'未知的消息类型: {msg_type}')
+
+    header = FrameHeader(
+        msg_type=MSG_TYPES[msg_type],
+        method=METHODS.get(method, 'opencv'),
+        equalize_hist=bool(flags & FLAG_EQUALIZE_HIST),
+        multi_face=bool(flags & FLAG_MULTI_FACE),
+        landmarks=bool(flags & FLAG_LANDMARKS),
+        debug=bool(flags & FLAG_DEBUG),
+        seq=seq,
+        width=width,
+        height=height,
+    )
+    return header, memoryview(bytes_data)[HEADER.size:]
+
+
+def pack_frame(jpeg_bytes, msg_type='recognize', method='opencv', equalize_hist=False,
+               multi_face=False, landmarks=False, seq=0, width=0, height=0, debug=False):
+    """构造二进制帧，供测试工具和压测脚本使用"""
+    msg_type_code = {v: k for k, v in MSG_TYPES.items()}[msg_type]
+    method_code = {v: k for k, v in METHODS.items()}.get(method, 0)
+    flags = ((FLAG_EQUALIZE_HIST if equalize_hist else 0)
+             | (FLAG_MULTI_FACE if multi_face else 0)
+             | (FLAG_LANDMARKS if landmarks else 0)
+             | (FLAG_DEBUG if debug else 0))
+    return HEADER.pack(MAGIC, VERSION, msg_type_code, method_code, flags,
+                       seq & 0xFFFFFFFF, width, height) + bytes(jpeg_bytes)
+
+
+def parse_burst(payload):
+    """把 record_burst 的数据拆分为多个 JPEG 的 memoryview"""
+    payload = memoryview(payload)
+    if len(payload) < BURST_COUNT.size:
+        raise ProtocolError('帧数据过短')
+    count, = BURST_COUNT.unpack_from(payload)
+    offset = BURST_COUNT.size
+    images = []
+    for _ in range(count):
+        if offset + BURST_LENGTH.size > len(payload):
+            raise ProtocolError('连拍数据不完整')
+        length, = BURST_LENGTH.unpack_from(payload, offset)
+        offset += BURST_LENGTH.size
+        if offset + length > len(payload):
+            raise ProtocolError('连拍数据不完整')
+        images.append(payload[offset:offset + length])
+        offset += length
+    return images
+
+
+def pack_burst(jpegs, width=0, height=0):
+    """构造 record_burst 帧"""
+    parts = [BURST_COUNT.pack(len(jpegs))]
+    for jpeg in jpegs:
+        parts.append(BURST_LENGTH.pack(len(jpeg)))
+        parts.append(bytes(jpeg))
+    return pack_frame(b''.join(parts), msg_type='record_burst', width=width, height=height)
+
+
+def dumps(data):
+    """紧凑 JSON，减少返回给客户端的字节数"""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
@@ -0,0 +1,96 @@
+"""人脸质量评分
+
+由清晰度 (拉普拉斯方差)、人脸尺寸、曝光和姿态 (68 个关键点) 几项
+组成，每项归一化到 0~1，总分为各项乘积，任一项很差时总分都会很低。
+用于注册时挑选样本，以及识别时跳过质量过低的帧以节省特征提取。
+"""
+import math
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+# 68 点模型中的关键点编号
+LEFT_EYE_OUTER = 36
+RIGHT_EYE_OUTER = 45
+NOSE_TIP = 30
+MOUTH_TOP = 51
+MOUTH_BOTTOM = 57
+
+# 评估清晰度前统一缩放到的尺寸，使不同大小的人脸可比
+_SHARPNESS_SIZE = (92, 112)
+
+
+def _clip(value):
+    return max(0.0, min(1.0, value))
+
+
+def sharpness(gray_face):
+    """拉普拉斯方差，越大越清晰"""
+    if gray_face.shape[:2] != _SHARPNESS_SIZE[::-1]:
+        gray_face = cv2.resize(gray_face, _SHARPNESS_SIZE, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray_face, cv2.CV_64F).var())
+
+
+def exposure_score(gray_face):
+    """平均亮度越接近中间值得分越高"""
+    return _clip(1 - abs(float(gray_face.mean()) - 128) / 128)
+
+
+def pose_score(points):
+    """由关键点估计偏航 (鼻尖相对两眼的位置)、翻滚 (两眼连线角度) 和俯仰
+
+    points 为 (68, 2) 数组，正脸得分接近 1。
+    """
+    points = np.asarray(points, dtype=np.float32)
+    left, right = points[LEFT_EYE_OUTER], points[RIGHT_EYE_OUTER]
+    nose = points[NOSE_TIP]
+    mouth = (points[MOUTH_TOP] + points[MOUTH_BOTTOM]) / 2
+
+    eye_dx = right[0] - left[0]
+    if eye_dx <= 0:
+        return 0.0
+    # 正脸时鼻尖位于两眼中间，比例为 0.5
+    yaw = abs((nose[0] - left[0]) / eye_dx - 0.5) * 2
+    roll = abs(math.degrees(math.atan2(right[1] - left[1], eye_dx))) / 45
+    eye_y = (left[1] + right[1]) / 2
+    face_dy = mouth[1] - eye_y
+    # 正脸时鼻尖大约位于两眼到嘴的中间
+    pitch = abs((nose[1] - eye_y) / face_dy - 0.5) / 0.4 if face_dy > 0 else 1.0
+    return _clip(1 - max(yaw, roll, pitch))
+
+
+def shape_points(shape):
+    """dlib full_object_detection 转为 (N, 2) 数组"""
+    return np.array([(shape.part(i).x, shape.part(i).y) for i in range(shape.num_parts)],
+                    dtype=np.float32)
+
+
+def assess(gray_face, face_size=None, points=None):
+    """评估一张人脸的质量
+
+    gray_face 为裁剪出的灰度人脸，face_size 为原图中的人脸宽度 (像素)，
+    points 为 68 个关键点。未提供的项不参与评分。
+    """
+    sharpness_ref = getattr(settings, 'FACE_QUALITY_SHARPNESS_REF', 100.0)
+    size_ref = getattr(settings, 'FACE_QUALITY_SIZE_REF', 80)
+
+    raw_sharpness = sharpness(gray_face)
+    quality = {
+        'sharpness': round(_clip(raw_sharpness / sharpness_ref), 3),
+        'exposure': round(exposure_score(gray_face), 3),
+    }
+    if face_size is not None:
+        quality['size'] = round(_clip(face_size / size_ref), 3)
+    if points is not None:
+        quality['pose'] = round(pose_score(points), 3)
+
+    score = 1.0
+    for value in quality.values():
+        score *= value
+    quality['score'] = round(score, 3)
+    return quality
+
+
+def is_acceptable(quality):
+    return quality['score'] >= getattr(settings, 'FACE_QUALITY_MIN_SCORE', 0.15)
@@ -0,0 +1,460 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import cv2
+import dlib
+import numpy as np
+from django.conf import settings
+
+from .gallery import FaceGallery
+from .embedding_store import embedding_store, onnx_embedding_store, _FileLock
+from .sample_store import sample_store
+from .ann import build_index, index_path
+from .identity_cache import IdentityCache
+from . import quality
+from .preprocess import load_normalization
+from .sync import get_generations
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _current_rss():
+    """读取当前进程常驻内存(字节)，不支持的平台返回 0"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RWLock:
+    """读写锁：多个读者可以并发，写者独占"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class ModelRegistry:
+    """进程级模型注册表
+
+    每个模型在第一次使用时加载一次，之后由所有 consumer 共享。
+    加载过程加锁，多个连接同时请求同一模型时只会加载一次。
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # 多 worker 部署时的代数存储 (见 sync.py) 和本进程已知的代数
+        self._generations = None
+        self._seen = {}
+        self._sync_interval = 1.0
+        self._next_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+
+    def watch(self, generations, interval=1.0):
+        """每隔 interval 秒检查其他 worker 修改过的模型，generations 为 None 时不检查"""
+        self._generations = generations
+        self._sync_interval = interval
+
+    def sync(self, force=False):
+        """丢弃代数已变化 (被其他 worker 修改) 的模型，下次使用时重新加载
+
+        get() 每次调用都会经过这里，未到检查时间时直接返回；修改共享数据前
+        用 force=True 立即检查，避免在过期的数据上修改后覆盖其他 worker 的写入。
+        """
+        generations = self._generations
+        if generations is None:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        if not self._sync_lock.acquire(blocking=force):
+            # 其他线程正在检查
+            return
+        try:
+            self._next_sync = now + self._sync_interval
+            for name, generation in generations.read().items():
+                if self._seen.get(name, 0) == generation:
+                    continue
+                self._seen[name] = generation
+                if name in self._models:
+                    logger.info(f"Model '{name}' changed in another worker, reloading")
+                    self.invalidate(name)
+        finally:
+            self._sync_lock.release()
+
+    def changed(self, name, invalidate=False):
+        """本进程修改了共享数据并已写入磁盘或数据库，通知其他 worker 重新加载
+
+        invalidate=True 时本进程也丢弃已加载的模型 (如重新训练后)。
+        """
+        if invalidate:
+            self.invalidate(name)
+        if self._generations is None:
+            return
+        try:
+            generation = self._generations.bump(name)
+        except Exception as e:
+            logger.warning(f"Failed to publish change of '{name}': {e}")
+            return
+        with self._sync_lock:
+            # 期间还有其他 worker 的修改没有同步到本进程
+            missed = self._seen.get(name, 0) != generation - 1
+            self._seen[name] = generation
+        if missed and not invalidate:
+            self.invalidate(name)
+
+    def get(self, name):
+        self.sync()
+        model = self._models.get(name, _MISSING)
+        if model is not _MISSING:
+            return model
+
+        with self._lock:
+            # 等锁期间可能已被其他线程加载
+            model = self._models.get(name, _MISSING)
+            if model is not _MISSING:
+                return model
+
+            rss_before = _current_rss()
+            start = time.perf_counter()
+            model = self._loaders[name]()
+            load_time = time.perf_counter() - start
+            memory = max(0, _current_rss() - rss_before)
+
+            self._models[name] = model
+            self._stats[name] = {
+                'load_time_ms': round(load_time * 1000, 2),
+                'memory_bytes': memory,
+                'loaded_at': time.time(),
+            }
+            logger.info(f"Loaded model '{name}' in {load_time * 1000:.1f} ms, "
+                        f"+{memory / 1024 / 1024:.1f} MB")
+            return model
+
+    def local(self, name):
+        """当前线程私有的模型实例
+
+        级联分类器、dlib 检测器和 ResNet 内部有缓冲区，不能在多个线程中同时调用，
+        推理线程池中的每个线程各自加载一份。
+        """
+        models = getattr(self._local, 'models', None)
+        if models is None:
+            models = self._local.models = {}
+        model = models.get(name)
+        if model is None:
+            model = models[name] = self._loaders[name]()
+        return model
+
+    def peek(self, name):
+        """返回已加载的模型，未加载时不触发加载"""
+        return self._models.get(name)
+
+    def preload(self, names):
+        for name in names:
+            self.get(name)
+
+    def invalidate(self, name):
+        """丢弃已加载的模型，下次使用时重新加载"""
+        with self._lock:
+            self._models.pop(name, None)
+            self._stats.pop(name, None)
+
+    def reload(self, name):
+        self.invalidate(name)
+        return self.get(name)
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stat) for name, stat in self._stats.items()}
+
+
+# LBPH 的 predict 可以并发，增量注册时的 update 需要独占
+lbph_lock = RWLock()
+
+
+# 同一进程内的线程之间互斥，不支持 flock 的平台上也能保证
+_recognizer_write_lock = threading.Lock()
+
+
+def recognizer_path():
+    return os.path.join(settings.MEDIA_ROOT, 'recognizer/trainingData.yml')
+
+
+@contextmanager
+def recognizer_lock():
+    """修改 LBPH 模型文件的跨进程锁
+
+    增量注册在锁内完成 同步 → update → 写入，多个 worker 同时注册时
+    后写入的一方不会覆盖先写入的样本。
+    """
+    os.makedirs(os.path.dirname(recognizer_path()), exist_ok=True)
+    with _recognizer_write_lock, _FileLock(os.path.join(os.path.dirname(recognizer_path()), '.lock')):
+        yield
+
+
+def write_recognizer(recognizer):
+    """把 LBPH 模型原子地写入 trainingData.yml，需要持有 recognizer_lock"""
+    path = recognizer_path()
+    # FileStorage 按扩展名判断格式，临时文件也要以 .yml 结尾
+    fd, tmp_path = tempfile.mkstemp(suffix='.yml', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with lbph_lock.reading():
+            recognizer.write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_face_cascade():
+    return cv2.CascadeClassifier(
+        os.path.join(settings.BASE_DIR, 'haarcascades/haarcascade_frontalface_default.xml')
+    )
+
+
+def _load_lbph_recognizer():
+    try:
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer_file = recognizer_path()
+        if os.path.exists(recognizer_file):
+            recognizer.read(recognizer_file)
+        return recognizer
+    except Exception as e:
+        print(f"Error initializing OpenCV recognizer: {str(e)}")
+        return None
+
+
+def _load_yunet_detector():
+    # 输入尺寸在每次检测前按图像大小设置
+    return cv2.FaceDetectorYN.create(
+        getattr(settings, 'ONNX_DETECTOR_MODEL',
+                os.path.join(settings.BASE_DIR, 'onnx/face_detection_yunet_2022mar.onnx')),
+        '', (320, 320),
+        getattr(settings, 'ONNX_DETECTOR_SCORE', 0.8),
+    )
+
+
+def _load_sface_recognizer():
+    return cv2.FaceRecognizerSF.create(
+        getattr(settings, 'ONNX_RECOGNIZER_MODEL',
+                os.path.join(settings.BASE_DIR, 'onnx/face_recognition_sface_2021dec.onnx')),
+        '',
+    )
+
+
+def _load_face_normalization():
+    return load_normalization()
+
+
+def _load_dlib_detector():
+    return dlib.get_frontal_face_detector()
+
+
+def _load_shape_predictor():
+    return dlib.shape_predictor(
+        os.path.join(settings.BASE_DIR, 'dlib/shape_predictor_68_face_landmarks.dat')
+    )
+
+
+def _load_face_recognition_model():
+    return dlib.face_recognition_model_v1(
+        os.path.join(settings.BASE_DIR, 'dlib/dlib_face_recognition_resnet_model_v1.dat')
+    )
+
+
+def compute_reference_templates(stu_id, compute=None):
+    """计算学生的模板特征 (T, D)，失败返回 None
+
+    compute 为从灰度人脸计算模板的函数，省略时为 dlib 的 compute_templates。
+    样本库中有样本时取质量最好的几张作为模板，否则使用 face_0.jpg。
+    """
+    compute = compute or compute_templates
+    _, samples = sample_store.load(stu_id)
+    if samples:
+        templates = compute(samples)
+        if templates is not None:
+            return templates
+
+    face_path = os.path.join(settings.MEDIA_ROOT, 'faces', stu_id, 'face_0.jpg')
+    face = cv2.imread(face_path, cv2.IMREAD_GRAYSCALE)
+    if face is None:
+        return None
+    return compute([face])
+
+
+def compute_templates(faces):
+    """从多张 92x112 灰度人脸中挑选质量最好的几张，返回它们的 dlib 特征 (T, 128)
+
+    先按清晰度和曝光粗选 FACE_TEMPLATE_CANDIDATES 张，定位关键点后加入
+    姿态评分，取前 FACE_TEMPLATE_COUNT 张计算特征。都检测不到人脸时返回 None。
+    """
+    candidates = getattr(settings, 'FACE_TEMPLATE_CANDIDATES', 8)
+    count = getattr(settings, 'FACE_TEMPLATE_COUNT', 5)
+    ranked = sorted(faces, key=lambda face: quality.assess(face)['score'], reverse=True)
+
+    # 注册在请求线程和推理线程池中并发执行，检测器和 ResNet 用线程私有的实例
+    detector = registry.local('dlib_detector')
+    shape_predictor = registry.get('shape_predictor')
+    scored = []
+    for face in ranked[:candidates]:
+        img = cv2.cvtColor(np.asarray(face), cv2.COLOR_GRAY2RGB)
+        detections = detector(img)
+        if len(detections) != 1:
+            continue
+        shape = shape_predictor(img, detections[0])
+        score = quality.assess(face, points=quality.shape_points(shape))['score']
+        scored.append((score, img, shape))
+    if not scored:
+        return None
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    model = registry.local('face_recognition_model')
+    return np.array([model.compute_face_descriptor(img, shape) for _, img, shape in scored[:count]],
+                    dtype=np.float32)
+
+
+def compute_onnx_templates(faces):
+    """从多张 92x112 灰度人脸中挑选质量最好的几张，返回单位长度的 SFace 特征 (T, 128)
+
+    样本本身已经是裁剪好的人脸，四周补边后 YuNet 才能检测到并给出对齐用的关键点。
+    都检测不到人脸时返回 None。
+    """
+    count = getattr(settings, 'FACE_TEMPLATE_COUNT', 5)
+    ranked = sorted(faces, key=lambda face: quality.assess(face)['score'], reverse=True)
+
+    detector = registry.local('yunet_detector')
+    recognizer = registry.local('sface_recognizer')
+    features = []
+    for face in ranked:
+        if len(features) >= count:
+            break
+        face = np.asarray(face)
+        pad = face.shape[1] // 2
+        img = cv2.copyMakeBorder(cv2.cvtColor(face, cv2.COLOR_GRAY2BGR), pad, pad, pad, pad,
+                                 cv2.BORDER_CONSTANT)
+        detector.setInputSize((img.shape[1], img.shape[0]))
+        _, found = detector.detect(img)
+        if found is None or len(found) != 1:
+            continue
+        features.append(recognizer.feature(recognizer.alignCrop(img, found[0])).ravel())
+    if not features:
+        return None
+    features = np.array(features, dtype=np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def _new_gallery():
+    return FaceGallery(aggregation=getattr(settings, 'FACE_GALLERY_AGGREGATION', 'min'))
+
+
+def build_known_faces(compute=None):
+    """从人脸样本重新计算所有学生的模板特征，compute 见 compute_reference_templates
+
+    只包含数据库中存在的学生，已删除学生残留的样本目录不会重新进入特征库。
+    """
+    from .models import User
+
+    gallery = _new_gallery()
+    faces_dir = os.path.join(settings.MEDIA_ROOT, 'faces')
+    stu_ids = set(sample_store.stu_ids())
+    if os.path.isdir(faces_dir):
+        stu_ids.update(d for d in os.listdir(faces_dir) if os.path.isdir(os.path.join(faces_dir, d)))
+    stu_ids &= set(User.objects.values_list('stu_id', flat=True))
+
+    for stu_id in sorted(stu_ids):
+        try:
+            templates = compute_reference_templates(stu_id, compute)
+            if templates is not None:
+                gallery.add(stu_id, templates)
+        except Exception as e:
+            print(f"Error loading face for {stu_id}: {str(e)}")
+    return gallery
+
+
+def _load_gallery(store, compute, index_file):
+    """优先 mmap 持久化的特征库，不存在时从图片构建一次并写入"""
+    stored = store.load()
+    if stored is not None:
+        ids, matrix, counts, version = stored
+        logger.info(f"Mapped embedding store v{version} with {len(ids)} faces, {len(matrix)} templates")
+        gallery = FaceGallery.from_matrix(
+            ids, matrix, counts, aggregation=getattr(settings, 'FACE_GALLERY_AGGREGATION', 'min')
+        )
+    else:
+        gallery = build_known_faces(compute)
+        version = store.save_gallery(gallery)
+
+    gallery.set_index(build_index(gallery, version, index_file))
+    return gallery
+
+
+def _load_known_faces():
+    return _load_gallery(embedding_store, compute_templates, index_path())
+
+
+def _load_onnx_known_faces():
+    return _load_gallery(onnx_embedding_store, compute_onnx_templates, index_path('ann_index_onnx'))
+
+
+def _load_identities():
+    """所有学生的显示信息，与特征库一起预加载"""
+    from .models import User
+    return IdentityCache.from_queryset(User.objects.all())
+
+
+registry = ModelRegistry()
+registry.register('face_cascade', _load_face_cascade)
+registry.register('lbph_recognizer', _load_lbph_recognizer)
+registry.register('face_normalization', _load_face_normalization)
+registry.register('dlib_detector', _load_dlib_detector)
+registry.register('shape_predictor', _load_shape_predictor)
+registry.register('face_recognition_model', _load_face_recognition_model)
+registry.register('known_faces', _load_known_faces)
+registry.register('yunet_detector', _load_yunet_detector)
+registry.register('sface_recognizer', _load_sface_recognizer)
+registry.register('onnx_known_faces', _load_onnx_known_faces)
+registry.register('identities', _load_identities)
+registry.watch(get_generations(), getattr(settings, 'MODEL_SYNC_INTERVAL', 1.0))
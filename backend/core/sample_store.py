@@ -0,0 +1,183 @@
+import os
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .embedding_store import _FileLock
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SHAPE = (112, 92)
+SAMPLE_BYTES = SAMPLE_SHAPE[0] * SAMPLE_SHAPE[1]
+
+# 索引记录：学号、分片号、分片内位置、删除标记
+INDEX_DTYPE = np.dtype([
+    ('stu_id', 'S32'),
+    ('shard', '<u4'),
+    ('slot', '<u4'),
+    ('deleted', 'u1'),
+])
+
+
+class SampleStore:
+    """打包存储的 92x112 灰度训练样本
+
+    目录结构 (MEDIA_ROOT/samples)::
+
+        index.bin        INDEX_DTYPE 记录，只追加
+        shard_0000.bin   uint8 样本数据，每个样本 112*92 字节，只追加
+
+    分片写满 shard_size 个样本后新建下一个分片。重新采集时旧记录只置删除
+    标记，不改动分片数据。训练时把分片 mmap 为 (K, 112, 92) 数组直接使用，
+    不再逐个解码 JPEG。样本对应的 face_id 以数据库为准，训练时按学号查询。
+    """
+
+    def __init__(self, root=None, shard_size=None):
+        self.root = root or os.path.join(settings.MEDIA_ROOT, 'samples')
+        self.shard_size = shard_size or getattr(settings, 'SAMPLE_SHARD_SIZE', 50000)
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, 'index.bin')
+
+    def _shard_path(self, shard):
+        return os.path.join(self.root, f'shard_{shard:04d}.bin')
+
+    def _read_index(self):
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        # 忽略写入中断留下的不完整记录
+        count = size // INDEX_DTYPE.itemsize
+        if not count:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+
+    def records(self, stu_id=None):
+        """有效 (未删除) 的索引记录"""
+        index = self._read_index()
+        mask = index['deleted'] == 0
+        if stu_id is not None:
+            mask &= index['stu_id'] == stu_id.encode()
+        return np.asarray(index[mask])
+
+    def __len__(self):
+        return len(self.records())
+
+    def stu_ids(self):
+        return sorted({s.decode() for s in np.unique(self.records()['stu_id'])})
+
+    def has_samples(self, stu_id):
+        return len(self.records(stu_id)) > 0
+
+    def shard(self, shard):
+        """把一个分片 mmap 为 (K, 112, 92) 的只读数组"""
+        path = self._shard_path(shard)
+        count = os.path.getsize(path) // SAMPLE_BYTES
+        if not count:
+            return np.zeros((0,) + SAMPLE_SHAPE, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode='r', shape=(count,) + SAMPLE_SHAPE)
+
+    def load(self, stu_id=None):
+        """返回 (学号列表, 样本列表)，样本为分片 mmap 上的视图，不复制数据"""
+        records = self.records(stu_id)
+        stu_ids = []
+        samples = []
+        for shard in np.unique(records['shard']):
+            data = self.shard(int(shard))
+            selected = records[(records['shard'] == shard) & (records['slot'] < len(data))]
+            stu_ids.extend(s.decode() for s in selected['stu_id'])
+            samples.extend(data[slot] for slot in selected['slot'].tolist())
+        return stu_ids, samples
+
+    def _mark_deleted(self, stu_id):
+        index = self._read_index()
+        if not len(index):
+            return 0
+        positions = np.flatnonzero((index['stu_id'] == stu_id.encode()) & (index['deleted'] == 0))
+        if len(positions):
+            writable = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r+', shape=index.shape)
+            writable['deleted'][positions] = 1
+            writable.flush()
+            del writable
+        return len(positions)
+
+    def _append(self, stu_id, faces):
+        if not len(faces):
+            return 0
+        index = self._read_index()
+        shard = int(index['shard'].max()) if len(index) else 0
+        records = []
+        pending = list(faces)
+        while pending:
+            path = self._shard_path(shard)
+            used = os.path.getsize(path) // SAMPLE_BYTES if os.path.exists(path) else 0
+            room = self.shard_size - used
+            if room <= 0:
+                shard += 1
+                continue
+            batch, pending = pending[:room], pending[room:]
+            with open(path, 'ab') as f:
+                # 截掉写入中断留下的半个样本，保证按样本对齐
+                f.truncate(used * SAMPLE_BYTES)
+                for face in batch:
+                    f.write(np.ascontiguousarray(face, dtype=np.uint8).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            records.extend((stu_id.encode(), shard, used + i, 0) for i in range(len(batch)))
+
+        # 分片数据落盘后再写索引，索引中的记录总是指向完整的样本
+        with open(self.index_path, 'ab') as f:
+            f.truncate(len(index) * INDEX_DTYPE.itemsize)
+            f.write(np.array(records, dtype=INDEX_DTYPE).tobytes())
+        return len(records)
+
+    def _check(self, stu_id, faces):
+        if len(stu_id.encode()) > INDEX_DTYPE['stu_id'].itemsize:
+            raise ValueError(f'学号过长: {stu_id}')
+        for face in faces:
+            if face.shape != SAMPLE_SHAPE or face.dtype != np.uint8:
+                raise ValueError(f'样本必须为 {SAMPLE_SHAPE[1]}x{SAMPLE_SHAPE[0]} 的 uint8 灰度图')
+
+    def append(self, stu_id, faces):
+        """追加一个学生的样本，返回写入数量"""
+        self._check(stu_id, faces)
+        with self._lock, self._file_lock():
+            return self._append(stu_id, faces)
+
+    def replace(self, stu_id, faces):
+        """用新采集的样本替换该学生的全部样本"""
+        self._check(stu_id, faces)
+        with self._lock, self._file_lock():
+            self._mark_deleted(stu_id)
+            return self._append(stu_id, faces)
+
+    def remove(self, stu_id):
+        if not os.path.exists(self.index_path):
+            return 0
+        with self._lock, self._file_lock():
+            return self._mark_deleted(stu_id)
+
+    def clear(self):
+        """删除全部样本"""
+        if not os.path.isdir(self.root):
+            return
+        with self._lock, self._file_lock():
+            # 先删索引，删除中断时剩下的分片不会再被引用
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            for name in os.listdir(self.root):
+                if name.startswith('shard_'):
+                    os.remove(os.path.join(self.root, name))
+
+    def _file_lock(self):
+        # 跨进程写锁，与特征库相同
+        os.makedirs(self.root, exist_ok=True)
+        return _FileLock(os.path.join(self.root, '.lock'))
+
+
+sample_store = SampleStore()
@@ -1,7 +1,13 @@
 from rest_framework import serializers
-from .models import User
+from .models import User, RecognitionEvent
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ['stu_id', 'face_id', 'cn_name', 'en_name', 'created_time'] 
\ No newline at end of file
+        fields = ['stu_id', 'face_id', 'cn_name', 'en_name', 'created_time']
+
+
+class RecognitionEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RecognitionEvent
+        fields = ['id', 'stu_id', 'seen_at', 'method', 'confidence', 'camera']
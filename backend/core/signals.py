@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import User
+from .registry import registry
+
+
+@receiver(post_save, sender=User)
+def update_identity_cache(sender, instance, **kwargs):
+    # 缓存尚未加载时无需处理，加载时会读取最新数据
+    cache = registry.peek('identities')
+    if cache is not None:
+        cache.put(instance)
+    # 其他 worker 在事务提交后重新加载身份缓存
+    transaction.on_commit(lambda: registry.changed('identities'))
+
+
+@receiver(post_delete, sender=User)
+def remove_from_identity_cache(sender, instance, **kwargs):
+    cache = registry.peek('identities')
+    if cache is not None:
+        cache.remove(instance.stu_id)
+    transaction.on_commit(lambda: registry.changed('identities'))
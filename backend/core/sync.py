@@ -0,0 +1,96 @@
+"""多个 worker 进程之间的模型失效通知
+
+多 worker 部署时每个进程各自加载模型，特征库通过 mmap 共享页缓存。
+LBPH 模型、特征库和身份缓存各有一个代数 (generation)：修改数据的进程
+在写入磁盘/数据库后把代数加一，其他进程的 registry 每隔
+MODEL_SYNC_INTERVAL 秒读取一次代数，发生变化的模型在下次使用时重新加载。
+
+    file   MEDIA_ROOT/generations.json，同一台机器上的多个 worker (默认)
+    redis  Redis 哈希，跨机器部署时使用，需要安装 redis 包
+"""
+import os
+import json
+import logging
+
+from django.conf import settings
+
+from .embedding_store import _FileLock
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileGenerations:
+    """代数保存在一个 JSON 文件中，读取时只在文件修改后重新解析"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.MEDIA_ROOT, 'generations.json')
+        self._mtime = None
+        self._generations = {}
+
+    def _read_file(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def read(self):
+        """返回 {名称: 代数}"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            self._generations = self._read_file()
+            self._mtime = mtime
+        return dict(self._generations)
+
+    def bump(self, name):
+        """代数加一并返回新的代数"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with _FileLock(self.path + '.lock'):
+            generations = self._read_file()
+            generations[name] = generations.get(name, 0) + 1
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(generations, f)
+            os.replace(tmp_path, self.path)
+        return generations[name]
+
+
+class RedisGenerations:
+    """代数保存在 Redis 哈希中"""
+
+    def __init__(self, url, key='face:generations'):
+        if redis is None:
+            raise ValueError('MODEL_SYNC_BACKEND=redis 需要安装 redis 包')
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+
+    def read(self):
+        try:
+            values = self.client.hgetall(self.key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to read model generations: {e}")
+            return {}
+        return {name.decode(): int(value) for name, value in values.items()}
+
+    def bump(self, name):
+        return int(self.client.hincrby(self.key, name, 1))
+
+
+def get_generations():
+    """按 MODEL_SYNC_BACKEND 创建代数存储，None 表示单进程部署，不做同步"""
+    backend = getattr(settings, 'MODEL_SYNC_BACKEND', 'file')
+    if not backend:
+        return None
+    if backend == 'file':
+        return FileGenerations()
+    if backend == 'redis':
+        return RedisGenerations(getattr(settings, 'MODEL_SYNC_REDIS_URL', 'redis://127.0.0.1:6379/0'))
+    raise ValueError(f'未知的模型同步方式: {backend}')
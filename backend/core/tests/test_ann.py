@@ -0,0 +1,87 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from core.ann import IVFIndex, build_index
+from core.gallery import FaceGallery
+
+
+def clustered(rng, students, templates):
+    centers = rng.normal(0, 1, (students, 128)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    matrix = np.repeat(centers, templates, axis=0)
+    matrix += rng.normal(0, 0.3 / np.sqrt(128), matrix.shape).astype(np.float32)
+    return [f's{i}' for i in range(students)], matrix, np.full(students, templates)
+
+
+class IVFIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.ids, self.matrix, self.counts = clustered(self.rng, 600, 3)
+        self.index = IVFIndex.train(self.matrix, nlist=24)
+        picked = self.rng.randint(0, len(self.matrix), 200)
+        self.queries = self.matrix[picked] + self.rng.normal(0, 0.2 / np.sqrt(128),
+                                                             (200, 128)).astype(np.float32)
+
+    def search(self, aggregation, nprobe):
+        gallery = FaceGallery.from_matrix(self.ids, self.matrix, self.counts, aggregation=aggregation)
+        exact = [found[0][0] for found in gallery.search(self.queries, exact=True)]
+        self.index.nprobe = nprobe
+        gallery.set_index(self.index)
+        approx = [found[0][0] for found in gallery.search(self.queries)]
+        return np.mean([a == e for a, e in zip(approx, exact)])
+
+    def test_recall(self):
+        self.assertEqual(self.search('min', self.index.nlist), 1.0)
+        self.assertGreaterEqual(self.search('min', 4), 0.9)
+
+    def test_mean_and_centroid_are_exact(self):
+        # 最近的模板行不一定属于 mean/centroid 距离最近的学生，这两种聚合不走索引
+        for aggregation in ('mean', 'centroid'):
+            with self.subTest(aggregation=aggregation):
+                self.assertEqual(self.search(aggregation, 1), 1.0)
+
+    def test_tracks_gallery_changes(self):
+        gallery = FaceGallery.from_matrix(self.ids, self.matrix, self.counts)
+        self.index.nprobe = self.index.nlist
+        gallery.set_index(self.index)
+        gallery.remove('s0')
+        gallery.add('new', self.matrix[:2] + 0.01)
+        self.assertEqual(gallery.search(self.matrix[0])[0][0][0], 'new')
+        self.assertEqual(self.index._size, gallery.num_templates)
+        exact = gallery.search(self.queries, exact=True)
+        approx = gallery.search(self.queries)
+        self.assertEqual([f[0][0] for f in approx], [f[0][0] for f in exact])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'index', 'ann_index.npz')
+            self.index.save(path, version=7)
+            loaded, version = IVFIndex.load(path, nprobe=3)
+            self.assertEqual(version, 7)
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['ann_index.npz'])
+        np.testing.assert_array_equal(loaded.centroids, self.index.centroids)
+        np.testing.assert_array_equal(loaded._assignments, self.index._assignments[:self.index._size])
+
+    def test_retrains_when_gallery_grows(self):
+        with tempfile.TemporaryDirectory() as root, \
+                override_settings(FACE_ANN_MIN_SIZE=100, FACE_ANN_NLIST=0, FACE_ANN_RETRAIN_GROWTH=4):
+            path = os.path.join(root, 'ann_index.npz')
+            small = FaceGallery.from_matrix(self.ids[:50], self.matrix[:150], self.counts[:50])
+            index = build_index(small, version=1, path=path)
+            self.assertEqual((index.nlist, index.trained_size), (12, 150))
+
+            # 增长不多时沿用聚类中心
+            grown = FaceGallery.from_matrix(self.ids[:150], self.matrix[:450], self.counts[:150])
+            index = build_index(grown, version=2, path=path)
+            self.assertEqual((index.nlist, index.trained_size, index._size), (12, 150, 450))
+
+            # 超过训练规模的 4 倍后重新训练，簇数随规模增加
+            large = FaceGallery.from_matrix(self.ids, self.matrix, self.counts)
+            index = build_index(large, version=3, path=path)
+            self.assertEqual((index.nlist, index.trained_size), (42, 1800))
+            loaded, version = IVFIndex.load(path)
+            self.assertEqual((loaded.nlist, loaded.trained_size, version), (42, 1800, 3))
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import multiprocessing
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.embedding_store import EmbeddingStore
+from core.gallery import FaceGallery
+
+
+def enroll(root, names):
+    """模拟一个 worker：在锁内读取最新版本、加入学生并写入"""
+    store = EmbeddingStore(root=root)
+    for name in names:
+        with store.updating():
+            stored = store.load()
+            gallery = FaceGallery.from_matrix(*stored[:3]) if stored else FaceGallery()
+            gallery.add(name, np.full(128, len(name), dtype=np.float32))
+            store.save_gallery(gallery)
+
+
+class EmbeddingStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = EmbeddingStore(root=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_empty_store(self):
+        self.assertEqual(self.store.current_version(), 0)
+        self.assertIsNone(self.store.load())
+
+    def test_versions_and_cleanup(self):
+        matrix = np.arange(3 * 128, dtype=np.float32).reshape(3, 128)
+        for expected in (1, 2, 3):
+            self.assertEqual(self.store.save(['a', 'b'], matrix, counts=[2, 1]), expected)
+
+        ids, loaded, counts, version = self.store.load()
+        self.assertEqual((ids, counts.tolist(), version), (['a', 'b'], [2, 1], 3))
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, matrix)
+        # 只保留最近的 KEEP_VERSIONS 个版本
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['.lock', 'CURRENT', 'v000002.json', 'v000002.npy', 'v000003.json', 'v000003.npy'])
+
+    def test_gallery_roundtrip(self):
+        gallery = FaceGallery()
+        gallery.add('a', np.ones((2, 128)))
+        gallery.add('b', np.zeros(128))
+        self.store.save_gallery(gallery)
+        ids, matrix, counts, _ = self.store.load()
+        restored = FaceGallery.from_matrix(ids, matrix, counts)
+        self.assertEqual(restored.ids, ['a', 'b'])
+        np.testing.assert_array_equal(restored.templates('a'), np.ones((2, 128)))
+
+    def test_clear(self):
+        self.store.save(['a'], np.ones((1, 128)))
+        self.assertEqual(self.store.clear(), 2)
+        ids, matrix, counts, version = self.store.load()
+        self.assertEqual((ids, matrix.shape, version), ([], (0, 128), 2))
+
+    def test_inconsistent_version_is_ignored(self):
+        self.store.save(['a', 'b'], np.ones((2, 128)))
+        np.save(os.path.join(self.tmp.name, 'v000001.npy'), np.ones((3, 128), dtype=np.float32))
+        self.assertIsNone(self.store.load())
+
+    def test_concurrent_updates_are_not_lost(self):
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=enroll, args=(self.tmp.name, [f'w{i}-{j}' for j in range(10)]))
+                   for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+        ids, _, _, version = self.store.load()
+        self.assertEqual(sorted(ids), sorted(f'w{i}-{j}' for i in range(3) for j in range(10)))
+        self.assertEqual(version, 30)
@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from core.events import EventBuffer
+from core.models import RecognitionEvent
+
+
+class EventBufferTest(TestCase):
+
+    def setUp(self):
+        # 不启动后台写入线程，测试中只由 flush() 写入
+        patcher = mock.patch.object(EventBuffer, '_run')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = EventBuffer(dedup_seconds=60, flush_interval=2.0, flush_size=1000)
+
+    def test_flush_writes_pending_events(self):
+        self.assertTrue(self.buffer.record('s1', 'dlib', confidence=87.5, camera='gate'))
+        self.assertTrue(self.buffer.record('s2', 'opencv'))
+        self.assertEqual(RecognitionEvent.objects.count(), 0)
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.flush(), 0)
+        event = RecognitionEvent.objects.get(stu_id='s1')
+        self.assertEqual((event.method, event.confidence, event.camera), ('dlib', 87.5, 'gate'))
+        self.assertEqual(self.buffer.stats(), {
+            'recorded': 2, 'deduplicated': 0, 'written': 2, 'dropped': 0, 'failed_flushes': 0, 'pending': 0,
+        })
+
+    def test_deduplicates_within_window(self):
+        self.buffer.record('s1', 'dlib')
+        self.assertFalse(self.buffer.record('s1', 'dlib'))
+        self.buffer.flush()
+        # 刷新后仍在去重窗口内
+        self.assertFalse(self.buffer.record('s1', 'onnx'))
+        self.assertEqual(RecognitionEvent.objects.count(), 1)
+
+        with mock.patch('core.events.time.monotonic', return_value=10 ** 9):
+            self.assertTrue(self.buffer.record('s1', 'dlib'))
+        self.assertEqual(self.buffer.stats()['deduplicated'], 2)
+
+    def test_failed_flush_keeps_events(self):
+        self.buffer.record('s1', 'dlib')
+        with mock.patch.object(RecognitionEvent.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.stats()['pending'], 1)
+        self.assertEqual(self.buffer.stats()['failed_flushes'], 1)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(RecognitionEvent.objects.count(), 1)
+
+    def test_drops_oldest_when_full(self):
+        self.buffer.max_pending = 3
+        for i in range(5):
+            self.buffer.record(f's{i}', 'dlib')
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(sorted(RecognitionEvent.objects.values_list('stu_id', flat=True)), ['s2', 's3', 's4'])
+        self.assertEqual(self.buffer.stats()['dropped'], 2)
+
+    def test_flush_size_wakes_writer(self):
+        self.buffer.flush_size = 2
+        self.buffer.record('s1', 'dlib')
+        self.assertFalse(self.buffer._wakeup.is_set())
+        self.buffer.record('s2', 'dlib')
+        self.assertTrue(self.buffer._wakeup.is_set())
@@ -0,0 +1,110 @@
+import threading
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.gallery import FaceGallery, AGGREGATIONS
+
+
+def make_gallery(rng, students=40, templates=(1, 4), aggregation='min'):
+    """每个学生的模板围绕各自的中心分布，模板数在 templates 范围内随机"""
+    gallery = FaceGallery(aggregation=aggregation)
+    for i in range(students):
+        center = rng.normal(0, 1, 128)
+        count = rng.randint(templates[0], templates[1] + 1)
+        gallery.add(f's{i}', center + rng.normal(0, 0.3, (count, 128)))
+    return gallery
+
+
+def brute_force(gallery, query, aggregation):
+    """逐个学生计算聚合距离，作为向量化实现的对照"""
+    dists = {}
+    for face_key in gallery.ids:
+        templates = gallery.templates(face_key).astype(np.float64)
+        d = np.linalg.norm(templates - query, axis=1)
+        if aggregation == 'min':
+            dists[face_key] = d.min()
+        elif aggregation == 'mean':
+            dists[face_key] = d.mean()
+        else:
+            centroid = templates.mean(axis=0)
+            radius = np.linalg.norm(templates - centroid, axis=1).mean()
+            dists[face_key] = max(np.linalg.norm(query - centroid) - radius, 0.0)
+    return sorted(dists.items(), key=lambda item: item[1])
+
+
+class FaceGalleryTest(SimpleTestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def assert_matches_brute_force(self, gallery, queries, k=3):
+        for query, found in zip(queries, gallery.search(queries, k=k)):
+            expected = brute_force(gallery, query, gallery.aggregation)[:k]
+            self.assertEqual([face_key for face_key, _ in found], [face_key for face_key, _ in expected])
+            np.testing.assert_allclose([d for _, d in found], [d for _, d in expected], rtol=1e-4, atol=1e-4)
+
+    def test_search_matches_brute_force(self):
+        for aggregation in AGGREGATIONS:
+            with self.subTest(aggregation=aggregation):
+                gallery = make_gallery(self.rng, aggregation=aggregation)
+                queries = self.rng.normal(0, 1, (20, 128)).astype(np.float32)
+                self.assert_matches_brute_force(gallery, queries)
+
+    def test_search_after_replace_and_remove(self):
+        gallery = make_gallery(self.rng, aggregation='mean')
+        gallery.add('s3', self.rng.normal(0, 1, (2, 128)))
+        self.assertTrue(gallery.remove('s5'))
+        self.assertFalse(gallery.remove('s5'))
+        self.assertNotIn('s5', gallery)
+        self.assertEqual(len(gallery), 39)
+        self.assertEqual(gallery.num_templates, int(gallery.counts().sum()))
+        self.assert_matches_brute_force(gallery, self.rng.normal(0, 1, (10, 128)).astype(np.float32))
+
+    def test_from_matrix_copies_on_write(self):
+        source = make_gallery(self.rng)
+        ids, matrix, counts = source.snapshot()
+        matrix.flags.writeable = False
+        gallery = FaceGallery.from_matrix(ids, matrix, counts)
+        gallery.add('new', np.ones(128))
+        self.assertIn('new', gallery)
+        self.assertEqual(len(matrix), source.num_templates)
+        self.assertEqual(gallery.search(np.ones(128))[0][0][0], 'new')
+
+    def test_empty_gallery(self):
+        self.assertEqual(FaceGallery().search(np.zeros((2, 128))), [[], []])
+
+    def test_search_while_modifying(self):
+        # 搜索在锁外计算，同时增删其他学生不能影响结果
+        gallery = make_gallery(self.rng, students=20, templates=(3, 3), aggregation='min')
+        stable = {face_key: gallery.templates(face_key) for face_key in gallery.ids}
+        stop = threading.Event()
+        errors = []
+
+        def writer():
+            rng = np.random.RandomState(1)
+            i = 0
+            keys = sorted(stable)
+            while not stop.is_set():
+                gallery.add(f'tmp{i % 5}', rng.normal(0, 1, (rng.randint(1, 4), 128)) + 50)
+                gallery.remove(f'tmp{(i + 2) % 5}')
+                # 用相同的模板替换，后面的行整体前移
+                face_key = keys[i % len(keys)]
+                gallery.add(face_key, stable[face_key])
+                i += 1
+
+        def reader():
+            for _ in range(200):
+                for face_key, templates in stable.items():
+                    found = gallery.search(templates[1])[0][0]
+                    if found[0] != face_key or found[1] > 1e-2:
+                        errors.append((face_key, found))
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads[1:]:
+            thread.join()
+        stop.set()
+        threads[0].join()
+        self.assertEqual(errors, [])
@@ -0,0 +1,52 @@
+from django.test import SimpleTestCase
+
+from core import protocol
+
+
+class FrameProtocolTest(SimpleTestCase):
+
+    def test_header_size(self):
+        self.assertEqual(protocol.HEADER.size, 14)
+
+    def test_frame_roundtrip(self):
+        jpeg = b'\xff\xd8jpeg-data\xff\xd9'
+        data = protocol.pack_frame(jpeg, method='dlib', equalize_hist=True, landmarks=True,
+                                   seq=0x1_0000_0005, width=640, height=480, debug=True)
+        self.assertEqual(len(data), 14 + len(jpeg))
+        header, payload = protocol.parse_frame(data)
+        self.assertEqual(header, protocol.FrameHeader(
+            msg_type='recognize', method='dlib', equalize_hist=True, multi_face=False,
+            landmarks=True, debug=True, seq=5, width=640, height=480))
+        self.assertIsInstance(payload, memoryview)
+        self.assertEqual(bytes(payload), jpeg)
+
+    def test_every_method_and_message_type(self):
+        for code, method in protocol.METHODS.items():
+            for msg_type in protocol.MSG_TYPES.values():
+                header, _ = protocol.parse_frame(protocol.pack_frame(b'', msg_type=msg_type, method=method))
+                self.assertEqual((header.method, header.msg_type), (method, msg_type))
+
+    def test_unknown_method_falls_back_to_opencv(self):
+        data = bytearray(protocol.pack_frame(b'x'))
+        data[4] = 99
+        header, _ = protocol.parse_frame(bytes(data))
+        self.assertEqual(header.method, 'opencv')
+
+    def test_invalid_frames(self):
+        valid = protocol.pack_frame(b'x')
+        for data in (valid[:13], b'XX' + valid[2:], valid[:2] + b'\x02' + valid[3:],
+                     valid[:3] + b'\x09' + valid[4:]):
+            with self.assertRaises(protocol.ProtocolError):
+                protocol.parse_frame(data)
+
+    def test_burst_roundtrip(self):
+        jpegs = [b'first', b'', b'third' * 100]
+        header, payload = protocol.parse_frame(protocol.pack_burst(jpegs, width=320, height=240))
+        self.assertEqual((header.msg_type, header.width, header.height), ('record_burst', 320, 240))
+        self.assertEqual([bytes(image) for image in protocol.parse_burst(payload)], jpegs)
+
+    def test_truncated_burst(self):
+        _, payload = protocol.parse_frame(protocol.pack_burst([b'abc', b'defg']))
+        for end in (1, 5, len(payload) - 1):
+            with self.assertRaises(protocol.ProtocolError):
+                protocol.parse_burst(payload[:end])
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from core.sample_store import SampleStore, SAMPLE_SHAPE, INDEX_DTYPE
+
+
+def faces(value, count):
+    return [np.full(SAMPLE_SHAPE, value + i, dtype=np.uint8) for i in range(count)]
+
+
+class SampleStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = SampleStore(root=self.tmp.name, shard_size=4)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_across_shards(self):
+        self.assertEqual(self.store.append('s1', faces(10, 3)), 3)
+        self.assertEqual(self.store.append('s2', faces(20, 3)), 3)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['.lock', 'index.bin', 'shard_0000.bin', 'shard_0001.bin'])
+        stu_ids, samples = self.store.load()
+        self.assertEqual(stu_ids, ['s1'] * 3 + ['s2'] * 3)
+        self.assertEqual([int(s[0, 0]) for s in samples], [10, 11, 12, 20, 21, 22])
+        _, samples = self.store.load('s2')
+        self.assertEqual([int(s[0, 0]) for s in samples], [20, 21, 22])
+
+    def test_replace_and_remove_leave_tombstones(self):
+        self.store.append('s1', faces(10, 2))
+        self.store.append('s2', faces(20, 2))
+        self.assertEqual(self.store.replace('s1', faces(30, 1)), 1)
+        self.assertEqual(self.store.remove('s2'), 2)
+        self.assertEqual(self.store.remove('s2'), 0)
+
+        # 旧记录只置删除标记，索引和分片只追加
+        index = np.fromfile(os.path.join(self.tmp.name, 'index.bin'), dtype=INDEX_DTYPE)
+        self.assertEqual(index['deleted'].tolist(), [1, 1, 1, 1, 0])
+        self.assertEqual(self.store.stu_ids(), ['s1'])
+        self.assertEqual(len(self.store), 1)
+        self.assertFalse(self.store.has_samples('s2'))
+        _, samples = self.store.load('s1')
+        self.assertEqual([int(s[0, 0]) for s in samples], [30])
+
+    def test_clear(self):
+        self.store.append('s1', faces(10, 6))
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(os.listdir(self.tmp.name), ['.lock'])
+        self.store.append('s2', faces(20, 1))
+        stu_ids, samples = self.store.load()
+        self.assertEqual(stu_ids, ['s2'])
+        np.testing.assert_array_equal(samples[0], faces(20, 1)[0])
+
+    def test_ignores_partial_index_record(self):
+        self.store.append('s1', faces(10, 2))
+        with open(os.path.join(self.tmp.name, 'index.bin'), 'ab') as f:
+            f.write(b'\x01' * (INDEX_DTYPE.itemsize - 1))
+        self.assertEqual(len(self.store), 2)
+        self.store.append('s2', faces(20, 1))
+        self.assertEqual(self.store.stu_ids(), ['s1', 's2'])
+
+    def test_rejects_invalid_samples(self):
+        with self.assertRaises(ValueError):
+            self.store.append('s1', [np.zeros((10, 10), dtype=np.uint8)])
+        with self.assertRaises(ValueError):
+            self.store.append('x' * 40, faces(0, 1))
@@ -0,0 +1,47 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from core.training import TrainingManager, PENDING, SUCCEEDED
+
+
+class TrainingManagerTest(SimpleTestCase):
+
+    def setUp(self):
+        # run_training 阻塞到测试放行，模拟正在执行的训练
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.runs = []
+
+        def run_training(job):
+            self.runs.append(job.id)
+            self.started.set()
+            self.release.wait(5)
+
+        patcher = mock.patch('core.training.run_training', side_effect=run_training)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.release.set)
+        self.manager = TrainingManager()
+
+    def test_submit_reuses_active_job(self):
+        job = self.manager.submit()
+        self.assertTrue(self.started.wait(5))
+        self.assertIs(self.manager.submit(), job)
+
+    def test_data_change_queues_one_follow_up_job(self):
+        running = self.manager.submit()
+        self.assertTrue(self.started.wait(5))
+
+        follow_up = self.manager.submit(data_changed=True)
+        self.assertIsNot(follow_up, running)
+        self.assertEqual(follow_up.status, PENDING)
+        # 排队中的任务还没读取数据，再次删除时复用它
+        self.assertIs(self.manager.submit(data_changed=True), follow_up)
+        self.assertIs(self.manager.submit(), running)
+
+        self.release.set()
+        self.manager._executor.shutdown(wait=True)
+        self.assertEqual(self.runs, [running.id, follow_up.id])
+        self.assertEqual((running.status, follow_up.status), (SUCCEEDED, SUCCEEDED))
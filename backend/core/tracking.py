@@ -0,0 +1,58 @@
+import time
+
+
+class FaceTracker:
+    """每个识别连接一个的人脸跟踪器
+
+    关键帧做全图检测和识别，之后的帧只在上一帧人脸框附近的区域重新检测，
+    身份沿用关键帧的识别结果。出现以下情况时回到全图检测：
+    距离关键帧超过 keyframe_interval 帧、身份超过 reverify_seconds 未重新验证、
+    任意一张人脸在区域内丢失，或者检测方式/模式发生变化。
+    """
+
+    def __init__(self, keyframe_interval=10, reverify_seconds=2.0):
+        self.keyframe_interval = keyframe_interval
+        self.reverify_seconds = reverify_seconds
+        self.mode = None
+        self.tracks = []
+        self.frames_since_keyframe = 0
+        self.tracked_frames = 0
+
+    def should_track(self, mode):
+        if mode != self.mode or not self.tracks:
+            return False
+        if self.frames_since_keyframe >= self.keyframe_interval:
+            return False
+        now = time.monotonic()
+        return all(now - track['verified_at'] < self.reverify_seconds for track in self.tracks)
+
+    def rects(self):
+        return [track['response']['face_rect'] for track in self.tracks]
+
+    def reset(self, mode, results):
+        """关键帧识别完成后用识别结果重新建立跟踪"""
+        now = time.monotonic()
+        self.mode = mode
+        self.frames_since_keyframe = 0
+        self.tracks = [
+            {'response': dict(response_data), 'verified_at': now}
+            for response_data, _ in results
+            # 质量过低的人脸没有身份结果，下一帧重新检测
+            if response_data.get('face_rect') and not response_data.get('low_quality')
+        ]
+
+    def update(self, detections):
+        """用区域检测结果更新跟踪，返回每张人脸的结果；有人脸丢失时返回 None"""
+        if len(detections) != len(self.tracks) or any(d is None for d in detections):
+            self.tracks = []
+            return None
+
+        self.frames_since_keyframe += 1
+        self.tracked_frames += 1
+        results = []
+        for track, detection in zip(self.tracks, detections):
+            track['response'].update(detection)
+            response_data = dict(track['response'])
+            response_data['tracked'] = True
+            results.append(response_data)
+        return results
@@ -0,0 +1,223 @@
+"""后台训练任务
+
+全量训练 LBPH 模型放到后台线程执行，接口立即返回任务 ID，
+前端通过 train_status 轮询进度。样本库中的样本直接 mmap 使用，
+尚未导入的 JPEG 用线程池并行读取 (cv2.imread 解码时释放 GIL)。
+训练完成后先写临时文件再原子替换 trainingData.yml。
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .registry import registry, recognizer_lock, write_recognizer
+from .sample_store import sample_store
+from .preprocess import normalize_face, save_normalization
+
+logger = logging.getLogger(__name__)
+
+# 内存中最多保留的历史任务数
+MAX_JOBS = 20
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class TrainingJob:
+    def __init__(self, equalize_hist):
+        self.id = uuid.uuid4().hex
+        self.equalize_hist = equalize_hist
+        self.status = PENDING
+        self.stage = ''
+        self.students = 0
+        self.images_total = 0
+        self.images_scanned = 0
+        self.samples_accepted = 0
+        self.error = None
+        self.message = ''
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in (PENDING, RUNNING)
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'equalize_hist': self.equalize_hist,
+            'students': self.students,
+            'images_total': self.images_total,
+            'images_scanned': self.images_scanned,
+            'samples_accepted': self.samples_accepted,
+            'elapsed_seconds': round(self.elapsed(), 2),
+            'message': self.message,
+            'error': self.error,
+        }
+
+
+def _load_face(img_path, normalization):
+    face = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    if face is None or face.shape != (112, 92):
+        return None
+    return normalize_face(face, normalization)
+
+
+def _collect_images(faces_dir, face_ids, skip=()):
+    """返回 [(图片路径, face_id)]，没有对应用户或已在样本库中的目录跳过"""
+    items = []
+    students = 0
+    if not os.path.isdir(faces_dir):
+        return items, students
+    for stu_id in sorted(os.listdir(faces_dir)):
+        user_path = os.path.join(faces_dir, stu_id)
+        if stu_id in skip or not os.path.isdir(user_path):
+            continue
+        face_id = face_ids.get(stu_id)
+        if face_id is None:
+            logger.warning(f"User not found for stu_id: {stu_id}")
+            continue
+        students += 1
+        for img_file in os.listdir(user_path):
+            if img_file.endswith('.jpg'):
+                items.append((os.path.join(user_path, img_file), face_id))
+    return items, students
+
+
+def run_training(job):
+    """执行一次全量训练，进度写入 job
+
+    样本库中的学生直接使用 mmap 的样本；尚未导入样本库的学生
+    从 faces 目录并行读取 JPEG。
+    """
+    from .models import User
+
+    faces_dir = os.path.join(settings.MEDIA_ROOT, 'faces')
+    if not os.path.exists(faces_dir) and not len(sample_store):
+        raise RuntimeError(f'No faces directory found at {faces_dir}')
+
+    job.stage = 'scanning'
+    # 一次查询取出所有学生的 face_id
+    face_ids = dict(User.objects.values_list('stu_id', 'face_id'))
+    stored_ids, stored_samples = sample_store.load()
+    stored_students = set(stored_ids)
+    items, loose_students = _collect_images(faces_dir, face_ids, skip=stored_students)
+    job.students = len(stored_students & set(face_ids)) + loose_students
+    job.images_total = len(stored_samples) + len(items)
+
+    job.stage = 'loading'
+    # 识别时读取同一份配置，保证样本归一化方式与训练一致
+    normalization = {'equalize_hist': bool(job.equalize_hist)}
+    face_samples = []
+    labels = []
+    for stu_id, face in zip(stored_ids, stored_samples):
+        job.images_scanned += 1
+        face_id = face_ids.get(stu_id)
+        if face_id is None:
+            continue
+        face_samples.append(normalize_face(face, normalization))
+        labels.append(face_id)
+        job.samples_accepted += 1
+
+    workers = getattr(settings, 'TRAINING_LOAD_WORKERS', os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='train-load') as pool:
+        faces = pool.map(lambda item: _load_face(item[0], normalization), items, chunksize=32)
+        for (img_path, face_id), face in zip(items, faces):
+            job.images_scanned += 1
+            if face is None:
+                logger.warning(f"Skipping invalid image: {img_path}")
+                continue
+            face_samples.append(face)
+            labels.append(face_id)
+            job.samples_accepted += 1
+
+    if not face_samples:
+        raise RuntimeError('No valid face samples found')
+
+    job.stage = 'training'
+    logger.info(f"Training with {len(face_samples)} samples")
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.train(face_samples, np.array(labels, dtype=np.int32))
+    # 验证模型
+    recognizer.predict(face_samples[0])
+
+    job.stage = 'saving'
+    with recognizer_lock():
+        write_recognizer(recognizer)
+        save_normalization(normalization)
+        # 通知已连接的识别端使用新模型
+        registry.changed('lbph_recognizer', invalidate=True)
+        registry.changed('face_normalization', invalidate=True)
+    job.message = f'Model trained with {len(face_samples)} samples'
+
+
+class TrainingManager:
+    """训练任务队列，同一时间只执行一个训练任务"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='training')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, equalize_hist=False, data_changed=False):
+        """提交训练任务；已有任务在排队或执行时直接返回该任务
+
+        data_changed=True 表示训练数据刚被修改 (如删除学生)：正在执行的任务
+        可能已读到旧数据，此时在其后排一个新任务，已有排队任务时仍复用它。
+        """
+        with self._lock:
+            active = [job for job in self._jobs.values() if job.active]
+            for job in active:
+                # 排队中的任务尚未读取数据，会用到最新的样本
+                if job.status == PENDING or not data_changed:
+                    return job
+            job = TrainingJob(equalize_hist)
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                del self._jobs[next(iter(self._jobs))]
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def latest(self):
+        with self._lock:
+            return next(reversed(list(self._jobs.values())), None)
+
+    def _run(self, job):
+        job.status = RUNNING
+        job.started_at = time.monotonic()
+        try:
+            run_training(job)
+            job.status = SUCCEEDED
+            logger.info(f"Training job {job.id} finished: {job.message}")
+        except Exception as e:
+            logger.exception(f"Training job {job.id} failed")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.stage = ''
+            job.finished_at = time.monotonic()
+            # 训练线程的数据库连接不会被请求周期回收，手动关闭
+            connection.close()
+
+
+training_manager = TrainingManager()
@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet
+from .views import UserViewSet, RecognitionEventViewSet
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
+router.register(r'events', RecognitionEventViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,4 +1,5 @@
 import os
+import datetime
 import cv2
 import numpy as np
 import base64
@@ -7,13 +8,25 @@ from django.conf import settings
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import User
-from .serializers import UserSerializer
+from .models import User, RecognitionEvent
+from .serializers import UserSerializer, RecognitionEventSerializer
+from .registry import registry, recognizer_path
+from .enrollment import enroll_student, next_face_id, reset_lbph
+from .engines import enabled_engines, gallery_engines
+from .metrics import counters, render_prometheus
+from .batching import batcher_stats
+from .training import training_manager
+from .events import event_buffer
+from .sample_store import sample_store
 import logging
 from django.core.cache import cache
-from django.http import JsonResponse
-from django.db.models import Max
+from django.http import JsonResponse, HttpResponse
+from django.db.models import Max, Min, Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
 
 logger = logging.getLogger(__name__)
 
@@ -66,17 +79,42 @@ class UserViewSet(viewsets.ModelViewSet):
                 return Response({'error': '该学号已存在'}, status=status.HTTP_400_BAD_REQUEST)
             
             # 生成新的 face_id
-            max_face_id = User.objects.all().aggregate(Max('face_id'))['face_id__max'] or 0
-            request.data['face_id'] = max_face_id + 1
+            request.data['face_id'] = next_face_id()
             
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             self.perform_create(serializer)
+
+            # 增量注册：只把该学生的样本加入 LBPH 模型和特征库，无需重新训练
+            try:
+                enroll_student(stu_id, serializer.instance.face_id)
+            except Exception as e:
+                print(f"Error enrolling {stu_id}: {str(e)}")
             
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def perform_destroy(self, instance):
+        stu_id = instance.stu_id
+        super().perform_destroy(instance)
+        sample_store.remove(stu_id)
+
+        for engine in gallery_engines():
+            with engine.store.updating():
+                registry.sync(force=True)
+                gallery = registry.get(engine.gallery)
+                if gallery.remove(stu_id):
+                    engine.store.save_gallery(gallery)
+                    registry.changed(engine.gallery)
+
+        # LBPH 模型无法删除单个标签：还有学生时后台重新训练，否则直接清空模型。
+        # 正在执行的训练可能已读到被删学生的样本，需要再排一次
+        if not User.objects.exists():
+            reset_lbph()
+        elif os.path.exists(recognizer_path()):
+            training_manager.submit(registry.get('face_normalization')['equalize_hist'], data_changed=True)
+
     @action(detail=False, methods=['post'])
     def init_db(self, request):
         logger.debug(f"Received init_db request: {request.data}")
@@ -87,98 +125,124 @@ class UserViewSet(viewsets.ModelViewSet):
             
             # 清空数据库
             User.objects.all().delete()
+            sample_store.clear()
+            for engine in gallery_engines():
+                with engine.store.updating():
+                    engine.store.clear()
+                    registry.changed(engine.gallery, invalidate=True)
+            reset_lbph()
+            registry.changed('identities', invalidate=True)
             
             return Response({'message': '数据库初始化成功'})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def model_stats(self, request):
+        """已启用的识别引擎，以及已加载模型的加载耗时和内存占用"""
+        return Response({
+            'engines': [engine.name for engine in enabled_engines()],
+            'models': registry.stats(),
+        })
+
+    @action(detail=False, methods=['get'])
+    def stream_stats(self, request):
+        """识别连接的帧计数 (接收、处理、丢弃) 和特征提取批大小分布"""
+        return Response({
+            'frames': counters.snapshot(),
+            'descriptor_batch_sizes': batcher_stats(),
+            'attendance_events': event_buffer.stats(),
+        })
+
     @action(detail=False, methods=['post'])
-    def train_model(self,request):
-        try:
-            print(f"Training with OpenCV version: {cv2.__version__}")
-            
-            # 获取是否使用直方图均衡化的参数
-            equalize_hist = request.data.get('equalize_hist', False)
-            print(f"Using histogram equalization: {equalize_hist}")
-            
-            recognizer = cv2.face.LBPHFaceRecognizer_create()
-            faces_dir = os.path.join(settings.MEDIA_ROOT, 'faces')
-            
-            if not os.path.exists(faces_dir):
-                return JsonResponse({
-                    'success': False,
-                    'error': f'No faces directory found at {faces_dir}'
-                })
-            
-            face_samples = []
-            face_ids = []
-            
-            # 收集训练数据
-            for stu_id in os.listdir(faces_dir):
-                user_path = os.path.join(faces_dir, stu_id)
-                if os.path.isdir(user_path):
-                    try:
-                        # 获取用户的 face_id
-                        user = User.objects.get(stu_id=stu_id)
-                        face_id = user.face_id
-                        
-                        for img_file in os.listdir(user_path):
-                            if img_file.endswith('.jpg'):
-                                img_path = os.path.join(user_path, img_file)
-                                face = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-                                
-                                # 如果启用了直方图均衡化，则进行处理
-                                if equalize_hist and face is not None:
-                                    face = cv2.equalizeHist(face)
-                                
-                                if face is not None and face.shape == (112, 92):
-                                    face_samples.append(face)
-                                    face_ids.append(face_id)
-                                else:
-                                    print(f"Skipping invalid image: {img_path}")
-                    except User.DoesNotExist:
-                        print(f"User not found for stu_id: {stu_id}")
-                        continue
-            
-            if not face_samples:
-                return JsonResponse({
-                    'success': False,
-                    'error': 'No valid face samples found'
-                })
-            
-            try:
-                # 训练模型
-                print(f"Training with {len(face_samples)} samples")
-                recognizer.train(face_samples, np.array(face_ids))
-                
-                # 保存模型
-                recognizer_file = os.path.join(settings.MEDIA_ROOT, 'recognizer/trainingData.yml')
-                os.makedirs(os.path.dirname(recognizer_file), exist_ok=True)
-                recognizer.write(recognizer_file)
-                
-                # 验证模型
-                test_image = face_samples[0]
-                recognizer.predict(test_image)
-                
-                print("Model trained and verified successfully")
-                return JsonResponse({
-                    'success': True,
-                    'message': f'Model trained with {len(face_samples)} samples'
-                })
-                
-            except Exception as e:
-                print(f"Error during training: {str(e)}")
-                # 如果训练失败，删除可能损坏的模型文件
-                if os.path.exists(recognizer_file):
-                    os.remove(recognizer_file)
-                return JsonResponse({
-                    'success': False,
-                    'error': f'Training error: {str(e)}'
-                })
-                
-        except Exception as e:
-            print(f"Error in train_model: {str(e)}")
-            return JsonResponse({
-                'success': False,
-                'error': str(e)
-            })
+    def train_model(self, request):
+        """提交后台训练任务，立即返回任务 ID，进度通过 train_status 查询"""
+        print(f"Training with OpenCV version: {cv2.__version__}")
+
+        # 获取是否使用直方图均衡化的参数
+        equalize_hist = bool(request.data.get('equalize_hist', False))
+        print(f"Using histogram equalization: {equalize_hist}")
+
+        job = training_manager.submit(equalize_hist)
+        return Response({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'])
+    def train_status(self, request):
+        """查询训练任务进度；不传 job_id 时返回最近一次任务"""
+        job_id = request.query_params.get('job_id')
+        job = training_manager.get(job_id) if job_id else training_manager.latest()
+        if job is None:
+            return Response({'error': '训练任务不存在'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job.to_dict())
+
+
+def _parse_time(name, value, end=False):
+    """解析 ISO 时间或日期；end=True 时日期表示当天结束"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: f'无效的时间: {value}'})
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1) if end else day, datetime.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class EventPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class RecognitionEventViewSet(viewsets.ReadOnlyModelViewSet):
+    """考勤记录查询
+
+    参数：stu_id、camera、method、start/end (ISO 时间或日期，end 为日期时包含当天)，
+    按 page/page_size 分页。时间范围查询使用 (seen_at) 和 (stu_id, seen_at) 索引。
+    """
+    queryset = RecognitionEvent.objects.all()
+    serializer_class = RecognitionEventSerializer
+    pagination_class = EventPagination
+
+    def filter_time(self, queryset):
+        params = self.request.query_params
+        if params.get('start'):
+            queryset = queryset.filter(seen_at__gte=_parse_time('start', params['start']))
+        if params.get('end'):
+            queryset = queryset.filter(seen_at__lt=_parse_time('end', params['end'], end=True))
+        return queryset
+
+    def get_queryset(self):
+        queryset = self.filter_time(RecognitionEvent.objects.all())
+        for field in ('stu_id', 'camera', 'method'):
+            value = self.request.query_params.get(field)
+            if value:
+                queryset = queryset.filter(**{field: value})
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def attendance(self, request):
+        """时间范围内每个学生的首次、最后一次识别时间和记录数，按学号分页"""
+        queryset = self.filter_time(RecognitionEvent.objects.all())
+        stu_id = request.query_params.get('stu_id')
+        if stu_id:
+            queryset = queryset.filter(stu_id=stu_id)
+        rows = (queryset.values('stu_id')
+                .annotate(first_seen=Min('seen_at'), last_seen=Max('seen_at'), events=Count('id'))
+                .order_by('stu_id'))
+        page = self.paginate_queryset(rows)
+        names = dict(User.objects.filter(stu_id__in=[row['stu_id'] for row in page])
+                     .values_list('stu_id', 'cn_name'))
+        for row in page:
+            row['cn_name'] = names.get(row['stu_id'])
+        return self.get_paginated_response(page)
+
+
+def metrics_view(request):
+    """Prometheus 文本格式的识别指标：帧和人脸计数、各阶段耗时直方图、活动连接"""
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,81 @@
+// 二进制帧协议，与后端 core/protocol.py 保持一致
+// 头部 14 字节(小端): magic 'FR' | version | msg_type | method | flags | seq(u32) | width(u16) | height(u16)
+// 头部之后紧跟原始 JPEG 数据
+// record_burst 消息的数据部分: count(u16) | 每帧 length(u32) + JPEG
+
+const HEADER_SIZE = 14
+const VERSION = 1
+
+export const MSG_TYPES = {
+  recognize: 1,
+  record_face: 2,
+  record_burst: 3
+}
+
+export const METHODS = {
+  opencv: 0,
+  dlib: 1,
+  onnx: 2
+}
+
+const FLAG_EQUALIZE_HIST = 0x01
+const FLAG_MULTI_FACE = 0x02
+const FLAG_LANDMARKS = 0x04
+const FLAG_DEBUG = 0x08
+
+// 将 canvas 内容编码为 JPEG 字节
+export const canvasToJpeg = (canvas, quality = 0.8) => {
+  return new Promise((resolve, reject) => {
+    canvas.toBlob(blob => {
+      if (!blob) {
+        reject(new Error('JPEG 编码失败'))
+        return
+      }
+      blob.arrayBuffer().then(resolve, reject)
+    }, 'image/jpeg', quality)
+  })
+}
+
+export const packFrame = (jpegBuffer, {
+  msgType = 'recognize',
+  method = 'opencv',
+  equalizeHist = false,
+  multiFace = false,
+  landmarks = false,
+  debug = false,
+  seq = 0,
+  width = 0,
+  height = 0
+} = {}) => {
+  const frame = new Uint8Array(HEADER_SIZE + jpegBuffer.byteLength)
+  const view = new DataView(frame.buffer)
+  view.setUint8(0, 0x46)  // 'F'
+  view.setUint8(1, 0x52)  // 'R'
+  view.setUint8(2, VERSION)
+  view.setUint8(3, MSG_TYPES[msgType])
+  view.setUint8(4, METHODS[method] ?? 0)
+  view.setUint8(5, (equalizeHist ? FLAG_EQUALIZE_HIST : 0) |
+    (multiFace ? FLAG_MULTI_FACE : 0) |
+    (landmarks ? FLAG_LANDMARKS : 0) |
+    (debug ? FLAG_DEBUG : 0))
+  view.setUint32(6, seq >>> 0, true)
+  view.setUint16(10, width, true)
+  view.setUint16(12, height, true)
+  frame.set(new Uint8Array(jpegBuffer), HEADER_SIZE)
+  return frame.buffer
+}
+
+// 把连拍的多帧 JPEG 打包为一条 record_burst 消息
+export const packBurst = (jpegBuffers, { width = 0, height = 0 } = {}) => {
+  const total = jpegBuffers.reduce((sum, jpeg) => sum + 4 + jpeg.byteLength, 2)
+  const payload = new Uint8Array(total)
+  const view = new DataView(payload.buffer)
+  view.setUint16(0, jpegBuffers.length, true)
+  let offset = 2
+  for (const jpeg of jpegBuffers) {
+    view.setUint32(offset, jpeg.byteLength, true)
+    payload.set(new Uint8Array(jpeg), offset + 4)
+    offset += 4 + jpeg.byteLength
+  }
+  return packFrame(payload.buffer, { msgType: 'record_burst', width, height })
+}